@@ -11,8 +11,11 @@ import logging
 import argparse
 import locale
 import concurrent.futures
+import contextlib
 from urllib.parse import quote, unquote, urlparse, parse_qs
 import hashlib
+import json
+import base64
 import uuid
 import signal
 from datetime import timedelta
@@ -73,6 +76,18 @@ parser.add_argument('--log-path', type=str, default=os.environ.get('LOG_PATH'),
 parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 23237)), help='Server port')
 parser.add_argument('--password', type=str, default=os.environ.get('APP_AUTH_PASSWORD') or os.environ.get('APP_PASSWORD'),
                     help='Optional password for web access; leave empty to disable auth')
+parser.add_argument('--deep-scan-interval', type=float, default=float(os.environ.get('DEEP_SCAN_INTERVAL', 168)),
+                    help='Hours between full (deep verify) library scans; 0 = always deep scan')
+parser.add_argument('--scan-workers', type=int, default=int(os.environ.get('SCAN_WORKERS', 0)),
+                    help='Tag extraction workers used by library scans; 0 = auto (CPU count)')
+parser.add_argument('--scan-mode', choices=mod.extractor.MODES, default=os.environ.get('SCAN_MODE', 'process'),
+                    help='Run tag extraction in worker processes (fork platforms only) or threads')
+parser.add_argument('--watch-mode', choices=mod.watcher.MODES, default=os.environ.get('WATCH_MODE', 'auto'),
+                    help='File watching: auto = native events on local disks, polling on network mounts')
+parser.add_argument('--watch-poll-interval', type=float, default=float(os.environ.get('WATCH_POLL_INTERVAL', 60)),
+                    help='Seconds between directory snapshot polls for polled mounts')
+parser.add_argument('--thumb-cache-mb', type=int, default=int(os.environ.get('THUMB_CACHE_MB', 256)),
+                    help='Disk budget in MB for generated cover thumbnails (0 = unlimited)')
 args = parser.parse_args()
 
 # --- 路径初始化 ---
@@ -97,6 +112,14 @@ console_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
+# mod 包内各模块共用同一组日志输出
+mod_logger = logging.getLogger('mod')
+mod_logger.setLevel(logging.INFO)
+mod_logger.handlers.clear()
+mod_logger.propagate = False
+mod_logger.addHandler(file_handler)
+mod_logger.addHandler(console_handler)
+
 # 过滤 Werkzeug 访问日志，隐藏心跳检测的 200 响应
 class AccessLogFilter(logging.Filter):
     def filter(self, record):
@@ -108,7 +131,11 @@ logging.getLogger('werkzeug').addFilter(AccessLogFilter())
 logger.info(f"Music Library Path: {MUSIC_LIBRARY_PATH}")
 
 # --- 全局状态变量 ---
-SCAN_STATUS = {
+# 进程内事件总线：状态字典的修改会作为增量推送给 /api/events 的订阅者
+EVENTS = mod.events.EventBus()
+
+# 扫描/刮削状态：由任务引擎中扫描、刮削任务的进度映射而来（见 _mirror_scan_status），字段沿用前端约定
+SCAN_STATUS = mod.events.ObservableDict(EVENTS, 'scan', {
     'scanning': False,
     'scan_total': 0,
     'scan_processed': 0,
@@ -118,12 +145,59 @@ SCAN_STATUS = {
     'current_file': '',
     'current_path': '',
     'failed': 0
-}
-scan_status_lock = threading.Lock()
+})
 
-# 库版本戳，用于前端检测变更
+# 库版本戳，用于前端检测变更（同时作为 /api/music 的 ETag 依据）
 LIBRARY_VERSION = time.time()
 
+def bump_library_version():
+    """曲库数据写入提交后调用，通知前端刷新并使列表缓存失效"""
+    global LIBRARY_VERSION
+    LIBRARY_VERSION = time.time()
+    EVENTS.publish('library', {'library_version': LIBRARY_VERSION})
+
+# --- 后台任务 ---
+# 扫描/刮削/下载/安装等后台工作统一提交到任务引擎（mod.jobs），状态以 'jobs' topic 推送；
+# 启动时在数据库迁移完成后设置 JOBS.db 并调用 JOBS.start()，恢复上次未完成的任务
+JOBS = mod.jobs.JobEngine(EVENTS)
+JOBS.add_pool('library', 1)   # 扫描、刮削、指纹补算：串行执行，用户触发的任务优先并可抢占后台任务
+JOBS.add_pool('system', 1)
+
+# 任务优先级（数值越小越优先）
+PRIORITY_USER = 10
+PRIORITY_SCAN = 50
+PRIORITY_BACKGROUND = 80
+
+SCAN_JOB_KINDS = ('scan_library', 'scan_directory')
+
+def _mirror_scan_status(job):
+    """将扫描/刮削任务的状态与进度映射到 SCAN_STATUS（前端沿用的状态字段）"""
+    progress = job.progress
+    if job.kind in SCAN_JOB_KINDS:
+        if job.state == mod.jobs.RUNNING:
+            fields = {'scanning': True, 'scan_total': progress.get('total', 0),
+                      'scan_processed': progress.get('processed', 0)}
+        else:
+            fields = {'scanning': False}
+    elif job.kind == 'scrape':
+        if job.state == mod.jobs.RUNNING:
+            fields = {'is_scraping': True, 'scrape_total': progress.get('total', 0),
+                      'scrape_processed': progress.get('processed', 0), 'failed': progress.get('failed', 0)}
+        else:
+            fields = {'is_scraping': False}
+    else:
+        return
+    if job.state == mod.jobs.RUNNING or job.state == mod.jobs.DONE:
+        fields['current_file'] = progress.get('message', '')
+        fields['current_path'] = progress.get('path', '')
+    elif job.state in mod.jobs.FINISHED:
+        fields['current_file'] = ''
+    changed = {key: value for key, value in fields.items() if SCAN_STATUS.get(key) != value}
+    if changed:
+        SCAN_STATUS.update(changed)
+
+JOBS.add_listener(_mirror_scan_status)
+
 # 辅助: 生成ID
 def generate_song_id(path):
     return hashlib.md5(path.encode('utf-8')).hexdigest()
@@ -139,6 +213,10 @@ class MusicFileEventHandler(FileSystemEventHandler):
         if event.is_directory: return
         self._process(event.src_path, 'deleted')
 
+    def on_modified(self, event):
+        if event.is_directory: return
+        self._process(event.src_path, 'created')
+
     def on_moved(self, event):
         if event.is_directory: return
         # 视为删除旧文件，添加新文件
@@ -146,79 +224,57 @@ class MusicFileEventHandler(FileSystemEventHandler):
         self._process(event.dest_path, 'created')
 
     def _process(self, path, action):
-        global LIBRARY_VERSION
-        filename = os.path.basename(path)
-        ext = os.path.splitext(filename)[1].lower()
-        
-        is_audio = ext in AUDIO_EXTS
-        is_misc = ext in ('.lrc', '.jpg', '.jpeg', '.png')
-        
-        if not is_audio and not is_misc:
+        """只做过滤并交给 FILE_EVENTS 合并，解析与写库在其分发线程中按批进行，不阻塞监听线程"""
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in AUDIO_EXTS and ext not in SIDECAR_EXTS:
             return
-
-        logger.info(f"检测到文件变更 [{action}]: {filename}")
-        
-        try:
-            if action == 'created':
-                time.sleep(0.5)
-                if is_audio:
-                    index_single_file(path)
-                elif is_misc:
-                    # 如果是附件，尝试重新索引同名音频文件以更新状态
-                    base = os.path.splitext(path)[0]
-                    for aud in AUDIO_EXTS:
-                        aud_path = base + aud
-                        if os.path.exists(aud_path):
-                            index_single_file(aud_path)
-                            
-            elif action == 'deleted':
-                if is_audio:
-                    with get_db() as conn:
-                        conn.execute("DELETE FROM songs WHERE path=?", (path,))
-                        conn.commit()
-                elif is_misc:
-                    # 附件删除，同样反向更新音频状态
-                    base = os.path.splitext(path)[0]
-                    for aud in AUDIO_EXTS:
-                        aud_path = base + aud
-                        if os.path.exists(aud_path):
-                            index_single_file(aud_path)
-            
-            LIBRARY_VERSION = time.time()
-            
-        except Exception as e:
-            logger.error(f"处理文件变更失败: {e}")
-
-# 全局 Observer 实例
-global_observer = None
+        if path.startswith(THUMBS.cache_dir + os.sep):
+            return  # 生成的缩略图
+        logger.debug(f"检测到文件变更 [{action}]: {os.path.basename(path)}")
+        FILE_EVENTS.add(path, action)
+
+# 监听管理：本地磁盘使用 watchdog 原生监听，网络挂载（NFS/SMB 等）与目录过多的树使用目录快照轮询
+WATCHES = None
+# 超过该目录数的本地目录树改用轮询（原生递归监听每个目录占用一个 inotify watch）
+WATCH_NATIVE_MAX_DIRS = 20000
+
+def _watch_tree_too_large(root):
+    """根据目录扫描清单估计目录数"""
+    try:
+        with get_db() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM directories WHERE path = ? OR (path >= ? AND path < ?)",
+                                 (root, *mod.libdiff.path_range(root))).fetchone()[0]
+        return count > WATCH_NATIVE_MAX_DIRS
+    except Exception:
+        return False
 
 def init_watchdog():
-    global global_observer
-    if not Observer: return
-    
-    if global_observer:
-        global_observer.stop()
-        global_observer.join()
-        
-    global_observer = Observer()
+    global WATCHES
+    if WATCHES:
+        WATCHES.stop()
+
+    WATCHES = mod.watcher.WatchManager(Observer() if Observer else None, MusicFileEventHandler(), FILE_EVENTS.add,
+                                       AUDIO_EXTS + SIDECAR_EXTS, mode=args.watch_mode,
+                                       poll_interval=max(1.0, args.watch_poll_interval),
+                                       prefer_poll=_watch_tree_too_large)
+    if WATCHES.observer is not None:
+        WATCHES.observer.start()
     refresh_watchdog_paths()
-    global_observer.start()
     logger.info("文件监听服务已启动")
-    try:
-        while True:
-            time.sleep(1)
-    except:
-        global_observer.stop()
-    global_observer.join()
 
 def shutdown_handler(signum, frame):
     """处理停止信号，优雅关闭服务"""
-    global global_observer
     logger.info(f"接收到信号 ({signum})，正在准备关闭服务...")
-    if global_observer:
+    if WATCHES:
         logger.info("正在停止文件监听服务...")
-        global_observer.stop()
+        WATCHES.stop()
         # 注意：不再调用 join()，因为这可能是在信号处理函数中
+    mod.extractor.stop_process_pool()
+    try:
+        # 等待写队列中剩余的任务提交后关闭数据库连接
+        DB.close()
+    except Exception as e:
+        logger.warning(f"关闭数据库失败: {e}")
     logger.info("服务已停止")
     sys.exit(0)
 
@@ -227,42 +283,16 @@ signal.signal(signal.SIGTERM, shutdown_handler)
 signal.signal(signal.SIGINT, shutdown_handler)
 
 def refresh_watchdog_paths():
-    """根据数据库刷新监听目录"""
-    global global_observer
-    if not global_observer: return
-    
-    # 1. 移除现有所有 schedule
-    global_observer.unschedule_all()
-    
-    # 2. 获取目标路径
-    # 2. 获取目标路径并去重
+    """根据数据库中的挂载点更新监听目录（只增删有变化的目录，嵌套在其他目录下的不重复监听）"""
+    if not WATCHES: return
+
+    roots = [MUSIC_LIBRARY_PATH]
     try:
-        raw_paths = {os.path.abspath(MUSIC_LIBRARY_PATH)}
         with get_db() as conn:
-            rows = conn.execute("SELECT path FROM mount_points").fetchall()
-            for r in rows: 
-                if r['path']:
-                    raw_paths.add(os.path.abspath(r['path']))
-    except: 
-        raw_paths = {os.path.abspath(MUSIC_LIBRARY_PATH)}
-
-    # 路径规范化与去重 (排除子目录)
-    sorted_paths = sorted(list(raw_paths), key=len)
-    final_targets = []
-    for p in sorted_paths:
-        # 如果当前路径是已添加路径的子目录，则跳过
-        if not any(p.startswith(parent + os.sep) or p == parent for parent in final_targets):
-            final_targets.append(p)
-    
-    # 3. 重新添加 schedule
-    event_handler = MusicFileEventHandler()
-    for path in final_targets:
-        if os.path.exists(path):
-            try:
-                global_observer.schedule(event_handler, path, recursive=True)
-                logger.info(f"监听目录: {path}")
-            except Exception as e:
-                logger.warning(f"无法监听目录 {path}: {e}")
+            roots.extend(r['path'] for r in conn.execute("SELECT path FROM mount_points").fetchall() if r['path'])
+    except Exception:
+        pass
+    WATCHES.sync(roots)
 
 
 NETEASE_DOWNLOAD_DIR = os.path.join(MUSIC_LIBRARY_PATH, 'NetEase')
@@ -273,7 +303,7 @@ NETEASE_MAX_CONCURRENT = 5
 NETEASE_QUALITY_DEFAULT = 'exhigh'
 # NETEASE_QUALITY = None # Configured quality - REMOVED
 
-DOWNLOAD_TASKS = {} # task_id -> {status, progress, message, filename}
+DOWNLOAD_TASKS = mod.events.ObservableDict(EVENTS, 'downloads') # task_id -> {status, progress, message, filename}
 
 
 # 修复路径问题
@@ -519,225 +549,287 @@ def logout():
     return resp
 
 # --- 数据库管理 ---
+# 读操作走连接池，写操作统一经由单写线程队列，避免 "database is locked"
+def open_database():
+    database = mod.db.Database(DB_PATH)
+    # 全文检索触发器依赖的归一化函数（繁转简、汉字逐字切分）
+    database.create_function(mod.libsearch.FOLD_FUNCTION, 1, mod.libsearch.fold)
+    # 歌手/专辑归类触发器使用的拆分函数
+    database.create_function(mod.catalog.SPLIT_FUNCTION, 1, mod.catalog.split_artists_json)
+    database.create_function(mod.catalog.PRIMARY_FUNCTION, 1, mod.catalog.primary_artist)
+    # 升级前歌曲补齐 dir_id
+    database.create_function(mod.roots.DIR_ID_FUNCTION, 1, mod.roots.dir_id)
+    return database
+
+DB = open_database()
+
+# 歌曲写入统一使用 UPSERT：保留原 rowid，使检索索引触发器按 UPDATE 同步，
+# 避免 INSERT OR REPLACE 先删后插导致 rowid 变化；经由 write_songs 写入（补上根目录分区列）
+SONG_UPSERT_SQL = '''
+    INSERT INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover, audio_size, content_hash,
+                       duration, bitrate, sample_rate, bits_per_sample, channels, codec, cover_source,
+                       root_id, rel_path, dir_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        path=excluded.path, filename=excluded.filename, title=excluded.title,
+        artist=excluded.artist, album=excluded.album, mtime=excluded.mtime,
+        size=excluded.size, has_cover=excluded.has_cover,
+        audio_size=excluded.audio_size, content_hash=excluded.content_hash,
+        duration=excluded.duration, bitrate=excluded.bitrate, sample_rate=excluded.sample_rate,
+        bits_per_sample=excluded.bits_per_sample, channels=excluded.channels, codec=excluded.codec,
+        cover_source=excluded.cover_source, root_id=excluded.root_id, rel_path=excluded.rel_path, dir_id=excluded.dir_id
+'''
+
+def song_roots(conn):
+    """当前扫描根目录的 root_id 映射（在写事务内加载，与同一事务中的挂载点变更一致）"""
+    return mod.roots.RootIndex.load(conn, MUSIC_LIBRARY_PATH)
+
+def write_songs(conn, rows):
+    """
+    写入 song_row() 生成的行（在写线程中调用）：按所在根目录补上 root_id/rel_path/dir_id，并更新封面关联与歌词。
+    文件变化后已提取的封面关联失效（下次请求时按新的 cover_source 重新提取）；
+    文件中没有封面/歌词时保留刮削得到的封面/歌词
+    """
+    roots = song_roots(conn)
+    lyrics = [(row[0], *entry) for row in rows for entry in row[-1]]
+    rows = [row[:-1] for row in rows]
+    conn.executemany(SONG_UPSERT_SQL, [(*row, *roots.columns(row[1])) for row in rows])
+    conn.executemany("DELETE FROM song_covers WHERE song_id=? AND (source<>? OR ? IS NOT NULL)",
+                     [(row[0], mod.covers.SCRAPED, row[-1]) for row in rows])
+    missing = [(mod.covers.SCRAPED, row[0]) for row in rows if not row[-1]]
+    if missing:
+        conn.executemany("UPDATE songs SET has_cover=1, cover_source=? WHERE id=? "
+                         "AND EXISTS (SELECT 1 FROM song_covers WHERE song_id=songs.id)", missing)
+    conn.executemany(f"DELETE FROM lyrics WHERE song_id=? AND source IN ({','.join('?' * len(mod.lyrics.SCAN_SOURCES))})",
+                     [(row[0], *mod.lyrics.SCAN_SOURCES) for row in rows])
+    mod.lyrics.store(conn, lyrics)
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH, timeout=30.0, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """借出只读连接，用法: with get_db() as conn: ..."""
+    return DB.connection()
+
+def db_write(fn, *args, **kwargs):
+    """在写线程中执行 fn(conn, ...) 并等待提交完成，返回 fn 的结果。"""
+    return DB.write(fn, *args, **kwargs)
 
 def init_db():
+    global DB
+
+    def _ensure_defaults(conn):
+        # 检查是否已有默认收藏夹，如果没有则创建
+        default_count = conn.execute("SELECT COUNT(*) FROM favorite_playlists WHERE is_default = 1").fetchone()[0]
+        if default_count == 0:
+            conn.execute("INSERT INTO favorite_playlists (id, name, is_default, created_at) VALUES (?, ?, ?, ?)", 
+                       ('default', '默认收藏夹', 1, time.time()))
+
+        # 清理错误索引的非音频文件
+        try:
+            placeholders = ' AND '.join([f"filename NOT LIKE '%{ext}'" for ext in AUDIO_EXTS])
+            conn.execute(f"DELETE FROM songs WHERE {placeholders}")
+        except: pass
+
     def _init_db_core():
-        with get_db() as conn:
-            # 检查旧模式并迁移
-            try:
-                cursor = conn.execute("SELECT path FROM songs LIMIT 1")
-            except Exception:
-                conn.execute("DROP TABLE IF EXISTS songs")
-                conn.execute("DROP TABLE IF EXISTS mount_files")
-
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS songs (
-                    id TEXT PRIMARY KEY,
-                    path TEXT UNIQUE,
-                    filename TEXT,
-                    title TEXT,
-                    artist TEXT,
-                    album TEXT,
-                    mtime REAL,
-                    size INTEGER,
-                    has_cover INTEGER DEFAULT 0
-                )
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS favorite_playlists (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    is_default INTEGER DEFAULT 0,
-                    created_at REAL
-                )
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS favorites (
-                   song_id TEXT,
-                   playlist_id TEXT,
-                   title TEXT DEFAULT '',
-                   artist TEXT DEFAULT '',
-                   created_at REAL,
-                   PRIMARY KEY (song_id, playlist_id)
-                )
-            ''')
-            
-            # 检查是否已有默认收藏夹，如果没有则创建
-            default_count = conn.execute("SELECT COUNT(*) FROM favorite_playlists WHERE is_default = 1").fetchone()[0]
-            if default_count == 0:
-                conn.execute("INSERT INTO favorite_playlists (id, name, is_default, created_at) VALUES (?, ?, ?, ?)", 
-                           ('default', '默认收藏夹', 1, time.time()))
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS mount_points (
-                    path TEXT PRIMARY KEY,
-                    created_at REAL
-                )
-            ''')
-            
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS system_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            ''')
-            
-            # 清理错误索引的非音频文件
-            try:
-                placeholders = ' OR '.join([f"filename NOT LIKE '%{ext}'" for ext in AUDIO_EXTS])
-                conn.execute(f"DELETE FROM songs WHERE {placeholders}")
-            except: pass
-            
-            conn.commit()
+        version = DB.migrate(mod.schema.MIGRATIONS)
+        db_write(_ensure_defaults)
+        return version
 
     try:
-        _init_db_core()
-        logger.info("数据库初始化完成。")
-    except Exception as e:
+        version = _init_db_core()
+        logger.info(f"数据库初始化完成 (结构版本 v{version})。")
+    except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+        # 锁冲突、迁移语句错误等不属于文件损坏，不能重建
+        logger.exception(f"数据库初始化失败: {e}")
+    except sqlite3.DatabaseError as e:
+        # 仅在数据库文件损坏时重建；原文件改名保留，避免丢失用户数据
         logger.error(f"数据库初始化失败: {e}，尝试重建数据库...")
         try:
+            DB.close()
+            backup_path = f"{DB_PATH}.corrupt-{int(time.time())}"
             if os.path.exists(DB_PATH):
-                os.remove(DB_PATH)
-            _init_db_core()
-            logger.info("数据库重建完成。")
+                os.replace(DB_PATH, backup_path)
+                logger.warning(f"已将损坏的数据库移动到: {backup_path}")
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(DB_PATH + suffix):
+                    os.replace(DB_PATH + suffix, backup_path + suffix)
+            DB = open_database()
+            version = _init_db_core()
+            logger.info(f"数据库重建完成 (结构版本 v{version})。")
         except Exception as e2:
              logger.exception(f"数据库重建失败: {e2}")
+    except Exception as e:
+        logger.exception(f"数据库初始化失败: {e}")
+
+# --- 曲库变更日志 (library_changes，由数据库触发器写入) ---
+# 删除记录保留期限，超期后压缩并抬高水位，早于水位的客户端需全量同步
+LIBRARY_CHANGES_RETENTION = 30 * 86400
+
+def _library_change_seq(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='library_changes'").fetchone()
+    return row[0] if row else 0
+
+def _library_changes_horizon(conn):
+    row = conn.execute("SELECT value FROM system_settings WHERE key='library_changes_horizon'").fetchone()
+    return int(row[0]) if row else 0
+
+def compact_library_changes():
+    """清理超过保留期的删除记录（插入/更新记录每首歌只有一条，无需清理）"""
+    def _compact(conn):
+        cutoff = time.time() - LIBRARY_CHANGES_RETENTION
+        row = conn.execute("SELECT MAX(seq) FROM library_changes WHERE op='delete' AND changed_at < ?", (cutoff,)).fetchone()
+        horizon = row[0] if row else None
+        if not horizon:
+            return 0
+        removed = conn.execute("DELETE FROM library_changes WHERE op='delete' AND seq <= ?", (horizon,)).rowcount
+        if horizon > _library_changes_horizon(conn):
+            conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)",
+                         ('library_changes_horizon', str(horizon)))
+        return removed
 
-# --- 元数据提取 ---
-def get_metadata(file_path):
-    metadata = {'title': None, 'artist': None, 'album': None}
     try:
-        audio = None
-        try:
-            audio = EasyID3(file_path)
-        except Exception as e1:
-            try:
-                audio = File(file_path, easy=True)
-            except Exception as e2:
-                audio = File(file_path)
-                logger.warning(f"文件 {file_path} 元数据解析异常: {e2}")
-        if audio:
-            def get_tag(key):
-                val = None
-                # Method 1: Direct .get (EasyID3 etc)
-                if hasattr(audio, 'get'):
-                    val = audio.get(key)
-                # Method 2: via .tags (FLAC etc)
-                elif hasattr(audio, 'tags') and audio.tags:
-                    val = audio.tags.get(key)
-                    # Try uppercase for Vorbis comments if standard key fails
-                    if not val:
-                        val = audio.tags.get(key.upper())
-                
-                if val:
-                    if isinstance(val, list):
-                        val = val[0]
-                    # 确保返回值是字符串类型，处理ASFUnicodeAttribute等特殊类型
-                    if val is not None and not isinstance(val, str):
-                        val = str(val)
-                    return val
-                return None
-            metadata['title'] = get_tag('title')
-            metadata['artist'] = get_tag('artist')
-            metadata['album'] = get_tag('album')
+        removed = db_write(_compact)
+        if removed:
+            logger.info(f"曲库变更日志已压缩: 清理 {removed} 条删除记录")
     except Exception as e:
-        logger.error(f"提取元数据失败: {file_path}, 错误: {e}")
-    filename = os.path.splitext(os.path.basename(file_path))[0]
-    if not metadata['title']:
-        if ' - ' in filename:
-            parts = filename.split(' - ', 1)
-            if not metadata['artist']: metadata['artist'] = parts[0].strip()
-            metadata['title'] = parts[1].strip()
-        else:
-            metadata['title'] = filename
-    if not metadata['artist']: metadata['artist'] = "未知艺术家"
-    logger.debug(f"文件 {file_path} 元数据: {metadata}")
-    return metadata
+        logger.warning(f"曲库变更日志压缩失败: {e}")
 
-def extract_embedded_cover(file_path: str, base_name: str = None):
-    """提取音频内嵌封面并保存为 covers/<base_name>.jpg，成功返回 True。"""
-    try:
-        if not os.path.exists(file_path):
-            return False
-        base_name = base_name or os.path.splitext(os.path.basename(file_path))[0]
-        cover_dir = os.path.join(MUSIC_LIBRARY_PATH, 'covers')
-        os.makedirs(cover_dir, exist_ok=True)
-        target_path = os.path.join(cover_dir, f"{base_name}.jpg")
-        if os.path.exists(target_path):
-            return True
+# --- 目录扫描清单 (directories) ---
+# 增量扫描跳过 mtime 未变化的目录（不再逐个 stat 其中的文件）。
+# 目录 mtime 只反映增删改名，文件原地修改（如改标签）需要依靠定期深度校验发现。
+DEEP_SCAN_INTERVAL = max(0, args.deep_scan_interval) * 3600
 
-        audio = File(file_path)
-        if not audio:
-            return False
+class DirectoryManifest:
+    """一次扫描的目录清单：读取已记录的 mtime，收集本次遍历结果，扫描结束后写回"""
 
-        data = None
+    def __init__(self, roots, use_manifest=True):
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.recorded = {}
+        self.unchanged_dirs = set()
+        self.scanned = []
+        with get_db() as conn:
+            for row in conn.execute("SELECT path, mtime FROM directories"):
+                if self._in_roots(row['path']):
+                    self.recorded[row['path']] = row['mtime']
+        self.use_manifest = use_manifest and bool(self.recorded)
+
+    def _in_roots(self, path):
+        return any(path == r or path.startswith(r.rstrip(os.sep) + os.sep) for r in self.roots)
+
+    def is_unchanged(self, path, mtime):
+        return self.use_manifest and self.recorded.get(path) == mtime
+
+    def on_dir(self, listing):
+        if listing.unchanged:
+            self.unchanged_dirs.add(listing.path)
+        elif listing.mtime:
+            self.scanned.append((listing.path, listing.mtime, len(listing.files)))
+
+    def keeps(self, song_path):
+        """歌曲所在目录未变化（文件未重新枚举），视为仍然存在"""
+        return os.path.dirname(song_path) in self.unchanged_dirs
+
+    def save(self):
+        now = time.time()
+        walked = self.unchanged_dirs | {p for p, _, _ in self.scanned}
+        stale = [(p,) for p in self.recorded if p not in walked]
+
+        def _save(conn):
+            conn.executemany('''
+                INSERT INTO directories (path, mtime, file_count, last_scanned) VALUES (?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET mtime=excluded.mtime, file_count=excluded.file_count, last_scanned=excluded.last_scanned
+            ''', [(p, m, n, now) for p, m, n in self.scanned])
+            conn.executemany("DELETE FROM directories WHERE path=?", stale)
+
+        db_write(_save)
+        logger.info(f"目录清单: 重新枚举 {len(self.scanned)} 个目录, 跳过未变化 {len(self.unchanged_dirs)} 个")
+
+def _deep_scan_due():
+    with get_db() as conn:
+        row = conn.execute("SELECT value FROM system_settings WHERE key='last_deep_scan'").fetchone()
+    return not row or time.time() - float(row[0]) >= DEEP_SCAN_INTERVAL
+
+def _mark_deep_scan():
+    DB.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('last_deep_scan', str(time.time())))
 
-        # MP3 / ID3
-        if hasattr(audio, 'tags') and audio.tags:
-            if hasattr(audio.tags, 'getall'):
-                for tag in audio.tags.getall('APIC'):
-                    if getattr(tag, 'data', None):
-                        data = tag.data
-                        break
-            if not data:
-                covr = audio.tags.get('covr')
-                if covr:
-                    val = covr[0] if isinstance(covr, (list, tuple)) else covr
-                    try:
-                        data = bytes(val)
-                    except Exception:
-                        pass
-
-        # FLAC / 其他
-        if not data and hasattr(audio, 'pictures'):
-            pics = getattr(audio, 'pictures') or []
-            if pics:
-                data = pics[0].data
-
-        if not data:
-            logger.info(f"未找到内嵌封面: {file_path}")
-            return False
+# --- 元数据提取 ---
+# 封面按内容哈希保存在 covers/store（mod.covers），歌曲与封面的对应关系在 song_covers 表
+COVER_DIR = os.path.join(MUSIC_LIBRARY_PATH, 'covers')
+COVERS = mod.covers.CoverStore(os.path.join(COVER_DIR, mod.covers.STORE_DIR))
+
+def set_song_cover(song_id: str, cover_bytes: bytes, source: str = mod.covers.SCRAPED):
+    """保存封面并关联到歌曲，返回 mod.covers.Cover"""
+    cover = _with_palette(COVERS.put(cover_bytes))
+
+    def _link(conn):
+        mod.covers.link(conn, [(song_id, cover, source)])
+        conn.execute("UPDATE songs SET has_cover=1, cover_source=? WHERE id=?", (source, song_id))
+
+    db_write(_link)
+    bump_library_version()
+    return cover
+
+def _with_palette(cover):
+    """为首次入库的封面计算调色板（已计算过的封面不再解码）"""
+    with get_db() as conn:
+        row = conn.execute("SELECT palette FROM covers WHERE hash=?", (cover.hash,)).fetchone()
+    if row and row['palette'] is not None:
+        return cover
+    return cover._replace(palette=mod.covers.encode_palette(mod.covers.extract_palette(COVERS.path(cover.hash))))
+
+def cover_palette(cover_hash):
+    """封面的调色板（颜色列表）；未关联到歌曲的封面（外部文件）临时计算，不保存"""
+    with get_db() as conn:
+        row = conn.execute("SELECT palette FROM covers WHERE hash=?", (cover_hash,)).fetchone()
+    if row:
+        return mod.covers.decode_palette(row['palette'])
+    return mod.covers.extract_palette(COVERS.path(cover_hash)) or None
+
+COVER_LOADS = mod.covers.SingleFlight()
+
+def _materialize_cover(song_id, path, source):
+    found = mod.extractor.load_cover(path, COVER_DIR, source)
+    if not found:
+        logger.info(f"封面已不在记录的位置: {path} ({source})")
+        return None
+    data, source = found
+    cover = _with_palette(COVERS.put(data))
 
-        with open(target_path, 'wb') as f:
-            f.write(data)
-        logger.info(f"内嵌封面提取并保存: {target_path}")
-        return True
-    except Exception as e:
-        logger.warning(f"提取内嵌封面失败: {file_path}, 错误: {repr(e)}")
-        return False
+    def _link(conn):
+        # 提取期间歌曲被删除时不再关联
+        if conn.execute("SELECT 1 FROM songs WHERE id=?", (song_id,)).fetchone():
+            mod.covers.link(conn, [(song_id, cover, source)])
+            conn.execute("UPDATE songs SET cover_source=? WHERE id=? AND cover_source IS NULL", (source, song_id))
 
-def extract_embedded_lyrics(file_path: str):
-    """提取音频内嵌歌词，返回歌词字符串或 None。"""
-    try:
-        if not os.path.exists(file_path):
-            return None
-        
-        audio = File(file_path)
-        if not audio:
-            return None
+    db_write(_link)
+    return cover.hash
 
-        # 1. MP3 / ID3 (USLT)
-        if hasattr(audio, 'tags') and isinstance(audio.tags, ID3):
-            for key in audio.tags.keys():
-                if key.startswith('USLT'):
-                    return audio.tags[key].text
-        
-        # 2. FLAC / Vorbis Comments
-        if hasattr(audio, 'tags'):
-            lyrics = audio.tags.get('lyrics') or audio.tags.get('LYRICS') or audio.tags.get('unsyncedlyrics') or audio.tags.get('UNSYNCEDLYRICS')
-            if lyrics:
-                return lyrics[0]
-                
-        # 3. M4A / MP4
-        if hasattr(audio, 'tags') and '©lyr' in audio.tags:
-             return audio.tags['©lyr'][0]
+def song_cover(song_id):
+    """
+    歌曲封面的 hash：已提取时直接返回，否则按扫描记录的位置（cover_source）提取入库，没有封面时返回 None
+    同一首歌的并发请求（如多个尺寸的缩略图）只提取一次
+    """
+    with get_db() as conn:
+        row = conn.execute('''
+            SELECT s.path, s.has_cover, s.cover_source, sc.cover_hash
+            FROM songs s LEFT JOIN song_covers sc ON sc.song_id = s.id WHERE s.id=?
+        ''', (song_id,)).fetchone()
+    if not row:
+        return None
+    if row['cover_hash'] and COVERS.has(row['cover_hash']):
+        return row['cover_hash']
+    if not row['has_cover']:
+        return None
+    return COVER_LOADS.do(song_id, lambda: _materialize_cover(song_id, row['path'], row['cover_source']))
 
-    except Exception as e:
-        logger.warning(f"提取内嵌歌词失败: {file_path}, 错误: {repr(e)}")
-    return None
+def extract_embedded_cover(file_path: str, song_id: str = None):
+    """提取音频内嵌封面存入封面存储（传入 song_id 时关联到该歌曲），返回 Cover，没有内嵌封面时返回 None。"""
+    if not os.path.exists(file_path):
+        return None
+    record = mod.tagreader.read_tags(file_path)
+    if not record.cover:
+        return None
+    if song_id:
+        return set_song_cover(song_id, record.cover, mod.covers.EMBEDDED)
+    return COVERS.put(record.cover)
 
 def fetch_cover_bytes(url: str):
     if not url:
@@ -788,40 +880,44 @@ def embed_cover_to_file(audio_path: str, cover_bytes: bytes):
     except Exception as e:
         logger.warning(f"内嵌封面失败: {audio_path}, 错误: {e}")
 
-def save_cover_file(cover_bytes: bytes, base_name: str):
-    if not cover_bytes or not base_name:
+def save_song_cover(song_path: str, cover_bytes: bytes):
+    """为已索引的歌曲保存下载得到的封面（未内嵌成功的格式也能显示封面）"""
+    if not cover_bytes or not song_path:
         return None
     try:
-        cover_dir = os.path.join(MUSIC_LIBRARY_PATH, 'covers')
-        os.makedirs(cover_dir, exist_ok=True)
-        cover_path = os.path.join(cover_dir, f"{base_name}.jpg")
-        with open(cover_path, 'wb') as f:
-            f.write(cover_bytes)
-        return cover_path
+        return set_song_cover(generate_song_id(song_path), cover_bytes)
     except Exception as e:
-        logger.warning(f"封面保存失败: {base_name}, 错误: {e}")
+        logger.warning(f"封面保存失败: {song_path}, 错误: {e}")
         return None
 
 def fetch_netease_lyrics(song_id: str):
-    """返回 (lrc, yrc) 字符串；若无则为 None。"""
+    """返回 (lrc, yrc, 翻译) 字符串；若无则为 None。"""
     if not song_id:
-        return None, None
+        return None, None, None
     lrc_text = None
     yrc_text = None
+    tlyric_text = None
     try:
         lyr_resp = call_netease_api('/lyric/new', {'id': song_id}, need_cookie=False)
         if isinstance(lyr_resp, dict):
             yrc_text = (lyr_resp.get('yrc') or {}).get('lyric')
             lrc_text = (lyr_resp.get('lrc') or {}).get('lyric')
+            tlyric_text = (lyr_resp.get('tlyric') or {}).get('lyric')
         if not lrc_text:
             old_resp = call_netease_api('/lyric', {'id': song_id}, need_cookie=False)
             if isinstance(old_resp, dict):
                 lrc_text = (old_resp.get('lrc') or {}).get('lyric') or lrc_text
                 if not yrc_text:
                     yrc_text = (old_resp.get('yrc') or {}).get('lyric')
+                if not tlyric_text:
+                    tlyric_text = (old_resp.get('tlyric') or {}).get('lyric')
     except Exception as e:
         logger.warning(f"获取网易歌词失败: {e}")
-    return lrc_text, yrc_text
+    return lrc_text, yrc_text, tlyric_text
+
+def save_lyrics(song_id: str, entries, source: str):
+    """保存歌曲歌词到 lyrics 表，entries 为 (format, text) 序列"""
+    db_write(mod.lyrics.store, [(song_id, fmt, source, text) for fmt, text in entries])
 
 def embed_lyrics_to_file(audio_path: str, lrc_text: str):
     """将歌词嵌入音频（行级歌词）。"""
@@ -856,6 +952,8 @@ def embed_lyrics_to_file(audio_path: str, lrc_text: str):
         logger.warning(f"内嵌歌词失败: {audio_path}, 错误: {e}")
 
 AUDIO_EXTS = ('.mp3', '.wav', '.ogg', '.flac', '.aac', '.m4a')
+# 音频旁的歌词/封面文件，变更时重新索引同名音频
+SIDECAR_EXTS = ('.lrc', '.yrc', '.jpg', '.jpeg', '.png')
 
 def index_single_file(file_path):
     """单独索引一个文件。"""
@@ -866,55 +964,33 @@ def index_single_file(file_path):
         if ext not in AUDIO_EXTS: return
         
         stat = os.stat(file_path)
-        meta = get_metadata(file_path)
-        sid = generate_song_id(file_path)
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        base_path = os.path.splitext(file_path)[0]
-        cover_path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-        has_cover = 0
-        if os.path.exists(base_path + ".jpg") or os.path.exists(cover_path):
-            has_cover = 1
-        else:
-            # 尝试提取内嵌封面
-            if extract_embedded_cover(file_path, base_name):
-                has_cover = 1
-        
-        with get_db() as conn:
-            # 全局去重检测
-            dup = conn.execute("SELECT path FROM songs WHERE filename=? AND size=? AND path!=?", (os.path.basename(file_path), stat.st_size, file_path)).fetchone()
-            if dup:
-                logger.info(f"索引: 跳过重复文件 {file_path} (已存在: {dup['path']})")
-                return
-
-            conn.execute('''
-                INSERT OR REPLACE INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (sid, file_path, os.path.basename(file_path), meta['title'], meta['artist'], meta['album'], stat.st_mtime, stat.st_size, has_cover))
-            conn.commit()
+        info = mod.walker.FileRecord(file_path, os.path.basename(file_path), stat.st_mtime, stat.st_size)
+        # 与扫描共用解析逻辑：一次解析得到标签、封面位置、内容指纹（重复文件由 duplicates 表标记）与音频流属性
+        tags = mod.extractor.extract_file(file_path, COVER_DIR)
+        db_write(write_songs, [song_row(info, tags)])
+        bump_library_version()
         logger.info(f"单文件索引完成: {file_path}")
     except Exception as e:
         logger.error(f"单文件索引失败: {e}")
 
-def scrape_single_song(item, idx, total):
-    """单独刮削一首歌曲的任务函数"""
+def scrape_single_song(job, item):
+    """单独刮削一首歌曲，返回是否完全成功（未找到结果或只补全了部分时为 False）"""
     song = item['song']
-    
+    job.token.check()
+
     # Update current path for UI (approximate due to concurrency)
-    SCAN_STATUS['current_path'] = song['path']
+    job.report(path=song['path'])
     
     try:
         # 0. 先尝试提取内嵌封面 (Fix: 优先使用内嵌封面，避免无效刮削)
         if item['need_cover']:
-             if extract_embedded_cover(song['path']):
-                with get_db() as conn:
-                    conn.execute("UPDATE songs SET has_cover=1 WHERE id=?", (song['id'],))
-                    conn.commit()
+             if extract_embedded_cover(song['path'], song['id']):
                 logger.info(f"刮削时发现内嵌封面，已提取: {song['title']}")
                 item['need_cover'] = False # 已解决封面，不再网络下载封面
 
         # 如果内嵌封面解决了封面问题，且不需要歌词，则直接返回
         if not item['need_cover'] and not item['need_lyrics']:
-            return
+            return True
 
         # 搜索 (增加重试机制)
         results = None
@@ -947,6 +1023,7 @@ def scrape_single_song(item, idx, total):
         providers = [mod.searchx.qq, mod.searchx.netease, mod.searchx.kugou]
         
         for attempt in range(3):
+            job.token.check()
             results = [] 
             
             found_satisfactory = False
@@ -977,12 +1054,10 @@ def scrape_single_song(item, idx, total):
                 break
             
             if attempt < 2:
-                time.sleep(1) # Delay between retries
+                job.token.wait(1) # Delay between retries
 
         if not results:
-            with scan_status_lock:
-                 SCAN_STATUS['failed'] = SCAN_STATUS.get('failed', 0) + 1
-            return
+            return False
         
         # 标记是否发生部分失败（例如没找到封面或歌词）
         is_partial_fail = False
@@ -1001,12 +1076,9 @@ def scrape_single_song(item, idx, total):
                    pass
             
             if found_lyrics:
-                base_name = os.path.splitext(song['filename'])[0]
-                save_lrc_path = os.path.join(MUSIC_LIBRARY_PATH, 'lyrics', f"{base_name}.lrc")
                 try:
-                    with open(save_lrc_path, 'w', encoding='utf-8') as f:
-                        f.write(found_lyrics)
-                    logger.info(f"自动保存歌词成功: {save_lrc_path}")
+                    save_lyrics(song['id'], [(mod.lyrics.LRC, found_lyrics)], mod.lyrics.SCRAPED)
+                    logger.info(f"自动保存歌词成功: {song['title']}")
                 except Exception as e:
                     logger.warning(f"保存歌词失败: {e}")
                     is_partial_fail = True
@@ -1027,18 +1099,11 @@ def scrape_single_song(item, idx, total):
                      pass
             
             if found_cover:
-                base_name = os.path.splitext(song['filename'])[0]
-                local_cover_path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
                 try:
                     resp = requests.get(found_cover, timeout=10, headers=COMMON_HEADERS)
-                    if resp.status_code == 200:
-                        with open(local_cover_path, 'wb') as f:
-                            f.write(resp.content)
-                        # 更新数据库
-                        with get_db() as conn:
-                            conn.execute("UPDATE songs SET has_cover=1 WHERE id=?", (song['id'],))
-                            conn.commit()
-                        logger.info(f"自动保存封面成功: {local_cover_path}")
+                    if resp.status_code == 200 and resp.content:
+                        cover = set_song_cover(song['id'], resp.content)
+                        logger.info(f"自动保存封面成功: {song['title']} ({cover.hash})")
                     else:
                         logger.warning(f"下载封面失败: {resp.status_code} - {found_cover}")
                         is_partial_fail = True
@@ -1049,111 +1114,72 @@ def scrape_single_song(item, idx, total):
                 logger.info(f"结果中未包含封面: {song['title']}")
                 is_partial_fail = True
         
-        if is_partial_fail:
-             with scan_status_lock:
-                 SCAN_STATUS['failed'] = SCAN_STATUS.get('failed', 0) + 1
+        return not is_partial_fail
     
     except Exception as e:
         logger.warning(f"刮削单曲失败 {song['title']}: {e}")
-        with scan_status_lock:
-             SCAN_STATUS['failed'] = SCAN_STATUS.get('failed', 0) + 1
-    finally:
-        # 更新状态 (移至finally块，确保只有在处理完成后才更新进度，且使用锁保证线程安全)
-        # 使用 scrape_processed 专用于刮削进度
-        with scan_status_lock:
-            current_processed = SCAN_STATUS.get('scrape_processed', 0) + 1
-            SCAN_STATUS['scrape_processed'] = current_processed
-            # 减少日志刷屏，只在5的倍数或完成时更新
-            if current_processed % 5 == 0 or current_processed >= total:
-                SCAN_STATUS['current_file'] = "刮削中..."
-
-
-def auto_scrape_missing_metadata(target_dir=None):
-    """后台任务：自动刮削缺失的封面和歌词"""
+        return False
+
+
+def auto_scrape_missing_metadata(job, target_dir=None):
+    """后台任务：自动刮削缺失的封面和歌词（被抢占后重新执行时，已补全的歌曲不会再次刮削）"""
     with app.app_context():
         logger.info(f"开始自动刮削缺失元数据... {f'(目录: {target_dir})' if target_dir else ''}")
-        SCAN_STATUS['current_file'] = "正在准备自动刮削..."
-        SCAN_STATUS['is_scraping'] = True
-        SCAN_STATUS['scrape_processed'] = 0
-        SCAN_STATUS['scrape_total'] = 0
-        
-        try:
-            songs_to_scrape = []
-            with get_db() as conn:
-                sql = "SELECT id, path, title, artist, album, filename, has_cover FROM songs"
-                params = ()
-                if target_dir:
-                    sql += " WHERE path LIKE ? || '%'"
-                    params = (target_dir,)
-                cursor = conn.execute(sql, params)
-                all_songs = cursor.fetchall()
-
-            for song in all_songs:
-                # 检查封面
-                need_cover = (song['has_cover'] == 0)
-                
-                # 检查歌词
-                base_name = os.path.splitext(song['filename'])[0]
-                lrc_path = os.path.join(MUSIC_LIBRARY_PATH, 'lyrics', f"{base_name}.lrc")
-                need_lyrics = not os.path.exists(lrc_path)
-                
-                if need_cover or need_lyrics:
-                    songs_to_scrape.append({
-                        'song': song,
-                        'need_cover': need_cover,
-                        'need_lyrics': need_lyrics
-                    })
-
-            total = len(songs_to_scrape)
-            if total == 0:
-                logger.info("没有需要刮削的歌曲。")
-                # 强制显示完成状态一段时间，让前端捕获
-                SCAN_STATUS['current_file'] = "刮削完成"
-                time.sleep(1.5)
-                SCAN_STATUS['is_scraping'] = False
-                return
+        job.report(message="正在准备自动刮削...", total=0, processed=0, failed=0)
 
+        # 封面/歌词标记由扫描与 lyrics 表触发器维护，缺失项直接按字段查询
+        with get_db() as conn:
+            sql = ("SELECT id, path, title, artist, album, filename, has_cover, has_lyrics FROM songs "
+                   "WHERE (has_cover = 0 OR IFNULL(has_lyrics, 0) = 0)")
+            params = ()
+            if target_dir:
+                # 挂载点按 root_id 索引查询，其他目录按 path 索引范围
+                where, params = song_roots(conn).song_filter(target_dir)
+                sql += f" AND {where}"
+            songs_to_scrape = [{'song': song, 'need_cover': song['has_cover'] == 0, 'need_lyrics': not song['has_lyrics']}
+                               for song in conn.execute(sql, params).fetchall()]
+
+        total = len(songs_to_scrape)
+        processed = failed = 0
+        if total == 0:
+            logger.info("没有需要刮削的歌曲。")
+        else:
             logger.info(f"发现 {total} 首歌曲需要刮削元数据")
-            
-            # 更新状态 scrape_total 和 scrape_processed
-            SCAN_STATUS['scrape_total'] = total
-            SCAN_STATUS['scrape_processed'] = 0
-            SCAN_STATUS['failed'] = 0
+            job.report(total=total, processed=0, failed=0)
 
-            # 使用线程池并发处理
+            # 使用线程池并发处理；任务被取消/抢占时丢弃尚未开始的歌曲
             max_workers = 20  # 控制并发数，避免请求过快被封禁
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = []
-                for idx, item in enumerate(songs_to_scrape):
-                    # 提交任务
-                    futures.append(executor.submit(scrape_single_song, item, idx, total))
-                
-                # 等待所有任务完成并捕获异常
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = [executor.submit(scrape_single_song, job, item) for item in songs_to_scrape]
                 for future in concurrent.futures.as_completed(futures):
+                    job.token.check()
                     try:
-                        future.result()
+                        ok = future.result()
                     except Exception as e:
                         logger.error(f"刮削任务执行异常: {e}")
-
-        except Exception as e:
-            logger.error(f"自动刮削任务异常: {e}")
-        finally:
-            logger.info("自动刮削任务结束")
-            
-            # 强制停留完成状态 (带上失败统计)
-            failed_count = SCAN_STATUS.get('failed', 0)
-            if failed_count > 0:
-                SCAN_STATUS['current_file'] = f"刮削完成 ({failed_count}首失败)"
-            else:
-                SCAN_STATUS['current_file'] = "刮削完成"
-            
-            time.sleep(1.5)
-            
-            # 只有当不在扫描文件时才重置状态，避免覆盖文件扫描的状态
-            # 实际上由于是分离线程，这里重置可能会影响UI显示，但 current_file 为空通常表示空闲
-            if not SCAN_STATUS.get('scanning', False):
-                 SCAN_STATUS['current_file'] = ''
-            SCAN_STATUS['is_scraping'] = False
+                        ok = False
+                    processed += 1
+                    failed += 0 if ok else 1
+                    fields = {'processed': processed, 'failed': failed}
+                    # 减少推送，只在5的倍数或完成时更新文字
+                    if processed % 5 == 0 or processed >= total:
+                        fields['message'] = "刮削中..."
+                    job.report(**fields)
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        logger.info("自动刮削任务结束")
+        # 短暂停留在完成状态 (带上失败统计)，让轮询的前端捕获
+        job.report(message=f"刮削完成 ({failed}首失败)" if failed else "刮削完成")
+        job.token.wait(1.5)
+        job.report(message='', path='')
+
+def submit_scrape(target_dir=None, priority=PRIORITY_BACKGROUND):
+    return JOBS.submit('scrape', {'target_dir': target_dir}, priority=priority, key=target_dir or '')
+
+JOBS.register('scrape', auto_scrape_missing_metadata, 'library', priority=PRIORITY_BACKGROUND,
+              persistent=True, preemptible=True)
 
 @app.route('/api/mount_points/retry_scrape', methods=['POST'])
 def retry_scrape_mount():
@@ -1162,11 +1188,8 @@ def retry_scrape_mount():
         if not path:
              return jsonify({'success': False, 'error': '未指定路径'})
         
-        if SCAN_STATUS.get('is_scraping') or SCAN_STATUS.get('scanning'):
-             return jsonify({'success': False, 'error': '后台任务进行中，请稍后'})
-             
-        threading.Thread(target=auto_scrape_missing_metadata, args=(path,), daemon=True).start()
-        return jsonify({'success': True, 'message': '已开始重新刮削'})
+        job = submit_scrape(path, priority=PRIORITY_USER)
+        return jsonify({'success': True, 'message': '已开始重新刮削', 'job_id': job.id})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1177,126 +1200,216 @@ def update_mount_point():
         if not path:
              return jsonify({'success': False, 'error': '未指定路径'})
         
-        if SCAN_STATUS.get('is_scraping') or SCAN_STATUS.get('scanning'):
-             return jsonify({'success': False, 'error': '后台任务进行中，请稍后'})
-             
-        threading.Thread(target=scan_directory_single, args=(path,), daemon=True).start()
-        return jsonify({'success': True, 'message': '开始更新目录...'})
+        # 用户触发的目录更新优先于后台扫描/刮削，正在运行的后台任务会让出并在之后继续
+        job = JOBS.submit('scan_directory', {'target_dir': path}, key=path)
+        return jsonify({'success': True, 'message': '开始更新目录...', 'job_id': job.id})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-def scan_directory_single(target_dir):
+# --- 标签解析 ---
+# 扫描时的标签解析与内嵌封面提取在子进程池中并行执行（不支持时退化为线程池），主进程只负责写库
+SCAN_WORKERS = max(0, args.scan_workers)
+SCAN_MODE = args.scan_mode
+
+def new_tag_extractor():
+    return mod.extractor.Extractor(COVER_DIR, workers=SCAN_WORKERS, mode=SCAN_MODE)
+
+def song_row(info, tags):
+    """合并遍历得到的 FileRecord 与解析结果 (见 mod.extractor.extract_file) 为 songs 行"""
+    # tags: (title, artist, album, has_cover, audio_size, content_hash, 音频流属性..., cover_source, lyrics)
+    return (generate_song_id(info.path), info.path, info.filename, *tags[:3], info.mtime, info.size, *tags[3:])
+
+# --- 扫描结果分批写库 ---
+# 解析结果每 SCAN_WRITE_BATCH 行提交一个事务，提交后立即对客户端可见；
+# 已提交的行带有 mtime/size，扫描中断后重新扫描时会被直接跳过。
+SCAN_WRITE_BATCH = 500
+SCAN_CHECKPOINT_KEY = 'scan_checkpoint'
+
+class ScanWriter:
+    """
+    重复文件照常写入，由 duplicates 表（按内容指纹）标记并在列表中隐藏
+
+    :param checkpoint: 全库扫描的检查点 dict，随每批写入一同提交到 system_settings
+    :param lock_file: 每批提交后刷新扫描锁文件的 mtime，避免长时间扫描的锁被判定过期
+    """
+
+    def __init__(self, checkpoint=None, lock_file=None):
+        self.checkpoint = checkpoint
+        self.lock_file = lock_file
+        self.rows = []
+        self.deletes = []
+        self.committed = 0
+        self.deleted = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) + len(self.deletes) >= SCAN_WRITE_BATCH:
+            self.flush()
+
+    def delete(self, path):
+        self.deletes.append((path,))
+        if len(self.rows) + len(self.deletes) >= SCAN_WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.rows and not self.deletes:
+            return
+        rows, self.rows = self.rows, []
+        deletes, self.deletes = self.deletes, []
+        db_write(self._write, rows, deletes)
+        self.committed += len(rows)
+        self.deleted += len(deletes)
+        if self.lock_file and os.path.exists(self.lock_file):
+            try: os.utime(self.lock_file)
+            except OSError: pass
+        bump_library_version()
+
+    def _write(self, conn, rows, deletes):
+        if deletes:
+            conn.executemany("DELETE FROM songs WHERE path=?", deletes)
+        if rows:
+            write_songs(conn, rows)
+        if self.checkpoint is not None:
+            self.checkpoint.update(committed=self.checkpoint.get('committed', 0) + len(rows),
+                                   updated_at=time.time())
+            if rows:
+                self.checkpoint['last_path'] = rows[-1][1]
+            _store_scan_checkpoint(conn, self.checkpoint)
+
+def _store_scan_checkpoint(conn, checkpoint):
+    conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)",
+                 (SCAN_CHECKPOINT_KEY, json.dumps(checkpoint, ensure_ascii=False)))
+
+def _load_scan_checkpoint():
+    """读取未完成扫描留下的检查点，没有时返回 None"""
+    try:
+        with get_db() as conn:
+            row = conn.execute("SELECT value FROM system_settings WHERE key=?", (SCAN_CHECKPOINT_KEY,)).fetchone()
+        return json.loads(row[0]) if row else None
+    except Exception:
+        return None
+
+def _clear_scan_checkpoint():
+    DB.execute("DELETE FROM system_settings WHERE key=?", (SCAN_CHECKPOINT_KEY,))
+
+def apply_file_events(batch):
+    """
+    应用一批合并后的文件变更 ({path: 'created' | 'deleted'})：
+    音频新增/修改重新解析，删除直接移除；歌词/封面附件变更时重新索引同名音频以更新状态。
+    解析交给解析池并行执行，结果与删除在同一事务中提交，曲库版本每批只更新一次。
+    """
+    extract, deletes = {}, []
+    for path, action in batch.items():
+        base, ext = os.path.splitext(path)
+        if ext.lower() in AUDIO_EXTS:
+            if action == mod.watcher.DELETED:
+                deletes.append(path)
+            else:
+                extract[path] = True
+        else:
+            for aud in AUDIO_EXTS:
+                aud_path = base + aud
+                if batch.get(aud_path) != mod.watcher.DELETED and os.path.exists(aud_path):
+                    extract[aud_path] = True
+
+    records = []
+    for path in extract:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        records.append(mod.walker.FileRecord(path, os.path.basename(path), st.st_mtime, st.st_size))
+
+    writer = ScanWriter()
+    for path in deletes:
+        writer.delete(path)
+    if records:
+        # 少量文件时 fork 子进程的开销大于收益，直接用线程池
+        mode = SCAN_MODE if len(records) > mod.extractor.PROCESS_BATCH_SIZE else 'thread'
+        with mod.extractor.Extractor(COVER_DIR, workers=SCAN_WORKERS,
+                                     mode=mode) as extractor:
+            for info in records:
+                extractor.submit(info)
+            for info, tags in extractor.results(wait_all=True):
+                if tags:
+                    writer.add(song_row(info, tags))
+    writer.flush()
+    logger.info(f"文件变更已处理: {len(batch)} 个事件，索引 {writer.committed} 首，删除 {writer.deleted} 首")
+
+# 监听事件合并：同一路径去重，等待文件写入完成后按批处理
+FILE_EVENTS = mod.watcher.EventCoalescer(apply_file_events, max_batch=SCAN_WRITE_BATCH)
+
+def _drain_extractor(job, extractor, writer, wait_all):
+    """取走已完成的解析结果交给写入器，并上报扫描进度"""
+    for info, tags in extractor.results(wait_all=wait_all):
+        job.token.check()
+        if tags:
+            writer.add(song_row(info, tags))
+        processed = job.progress.get('processed', 0) + 1
+        fields = {'processed': processed, 'path': info.path}
+        if processed % 10 == 0:
+            fields['message'] = f"处理中... {int((processed/max(1, extractor.submitted))*100)}%"
+        job.report(**fields)
+
+def scan_directory_single(job, target_dir):
     """扫描指定目录并更新数据库"""
-    global SCAN_STATUS
-    
     if not os.path.exists(target_dir):
         logger.error(f"目录不存在: {target_dir}")
         return
 
-    # Check lock (reuse logic partially or just check global status)
-    if SCAN_STATUS.get('scanning'): return
+    with app.app_context():
+        job.report(total=0, processed=0, message='正在扫描目录...')
+        logger.info(f"开始单独扫描目录: {target_dir}")
+        
+        # 用户手动触发的目录更新总是完整枚举，同时刷新该目录下的清单
+        manifest = DirectoryManifest([target_dir], use_manifest=False)
+        walker = mod.walker.Walker(AUDIO_EXTS)
+        writer = ScanWriter()
 
-    try:
-        with app.app_context():
-            SCAN_STATUS.update({
-                'scanning': True, 
-                'scan_total': 0, 
-                'scan_processed': 0, 
-                'current_file': '正在扫描目录...'
-            })
-            logger.info(f"开始单独扫描目录: {target_dir}")
-            
-            disk_files = {} # path -> info
-            supported_exts = AUDIO_EXTS
-            
-            for root, dirs, files in os.walk(target_dir):
-                 dirs[:] = [d for d in dirs if d not in ('lyrics', 'covers')]
-                 for f in files:
-                     if f.lower().endswith(supported_exts):
-                         path = os.path.join(root, f)
-                         try:
-                             stat = os.stat(path)
-                             info = {'mtime': stat.st_mtime, 'size': stat.st_size, 'path': path, 'filename': f}
-                             disk_files[path] = info
-                         except: pass
+        # 边遍历边比对（只比对该目录范围内的歌曲）：新增/变更的文件一经发现即提交元数据解析，结果分批写库
+        try:
+            with new_tag_extractor() as extractor, get_db() as conn, \
+                    contextlib.closing(mod.libdiff.diff(conn, walker, [target_dir], on_dir=manifest.on_dir,
+                                                        whole_library=False)) as changes:
+                for change in changes:
+                    job.token.check()
+                    if change.op == mod.libdiff.DELETE:
+                        writer.delete(change.path)
+                    else:
+                        extractor.submit(change.record)
+                        job.report(total=extractor.submitted)
+                        _drain_extractor(job, extractor, writer, wait_all=False)
 
-            with get_db() as conn:
-                # 只获取相关路径的歌曲
-                cursor = conn.cursor()
-                # Assuming path stored in DB is absolute
-                cursor.execute("SELECT id, path, mtime, size FROM songs WHERE path LIKE ? || '%'", (target_dir,))
-                db_rows = {row['path']: row for row in cursor.fetchall()}
-                
-                to_delete_paths = set(db_rows.keys()) - set(disk_files.keys())
-                if to_delete_paths:
-                    cursor.executemany("DELETE FROM songs WHERE path=?", [(p,) for p in to_delete_paths])
-                    conn.commit()
-
-                files_to_process_list = []
-                for path, info in disk_files.items():
-                    db_rec = db_rows.get(path)
-                    # If new or modified
-                    if not db_rec or db_rec['mtime'] != info['mtime'] or db_rec['size'] != info['size']:
-                        files_to_process_list.append(info)
-
-                total_files = len(files_to_process_list)
-                SCAN_STATUS.update({'scan_total': total_files, 'scan_processed': 0})
-                
-                to_update_db = []
-                
-                if total_files > 0:
-                    def process_file_metadata(info):
-                        # Simple inline version
-                        SCAN_STATUS['current_path'] = info['path']
-                        meta = get_metadata(info['path'])
-                        sid = generate_song_id(info['path'])
-                        base_path = os.path.splitext(info['path'])[0]
-                        has_cover = 1 if os.path.exists(base_path + ".jpg") or os.path.exists(os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{os.path.basename(base_path)}.jpg")) else 0
-                        if has_cover == 0:
-                            if extract_embedded_cover(info['path']): has_cover = 1
-                        # 确保所有元数据都是字符串类型，避免数据库绑定错误
-                        title = str(meta['title']) if meta['title'] is not None else ''
-                        artist = str(meta['artist']) if meta['artist'] is not None else ''
-                        album = str(meta['album']) if meta['album'] is not None else ''
-                        return (sid, info['path'], info['filename'], title, artist, album, info['mtime'], info['size'], has_cover)
-
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                         futures = {executor.submit(process_file_metadata, item): item for item in files_to_process_list}
-                         for future in concurrent.futures.as_completed(futures):
-                             try:
-                                 res = future.result()
-                                 to_update_db.append(res)
-                             except Exception: pass
-                             SCAN_STATUS['scan_processed'] += 1
-                             if SCAN_STATUS['scan_processed'] % 5 == 0:
-                                 SCAN_STATUS['current_file'] = f"处理中... {int((SCAN_STATUS['scan_processed']/total_files)*100)}%"
-
-                if to_update_db:
-                    conn.executemany('''
-                        INSERT OR REPLACE INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', to_update_db)
-                    conn.commit()
-            
-            # Finally trigger scraping for missing metadata in this dir
-            auto_scrape_missing_metadata(target_dir)
+                _drain_extractor(job, extractor, writer, wait_all=True)
+        finally:
+            # 被取消时也提交已解析的部分
+            writer.flush()
+        manifest.save()
+        job.report(message='扫描完成')
+        
+        # Finally trigger scraping for missing metadata in this dir
+        submit_scrape(target_dir)
 
-    except Exception as e:
-        logger.exception(f"目录扫描失败: {e}")
-    finally:
-        SCAN_STATUS['scanning'] = False
-        SCAN_STATUS['current_file'] = '扫描完成'
-        SCAN_STATUS['processed'] = SCAN_STATUS['total']
-        global LIBRARY_VERSION
-        LIBRARY_VERSION = time.time()
+JOBS.register('scan_directory', scan_directory_single, 'library', priority=PRIORITY_USER, persistent=True)
 
 # --- 优化后的并发扫描逻辑 ---
-def scan_library_incremental():
-    global SCAN_STATUS
-    
+# 扫描锁文件记录所属进程，重启前遗留的锁直接视为过期
+SCAN_LOCK_OWNER = f"{os.getpid()}-{time.time()}"
+
+def _scan_lock_stale(lock_file):
+    try:
+        with open(lock_file) as f:
+            owner = f.read().split()[1:]
+        if owner:
+            return owner[0] != SCAN_LOCK_OWNER
+    except Exception:
+        pass
+    return time.time() - os.path.getmtime(lock_file) > 300
+
+def scan_library_incremental(job):
     lock_file = os.path.join(MUSIC_LIBRARY_PATH, '.scan_lock')
     if os.path.exists(lock_file):
-        if time.time() - os.path.getmtime(lock_file) > 300:
+        if _scan_lock_stale(lock_file):
             try:
                 os.remove(lock_file)
                 logger.info("过期扫描锁文件已移除。")
@@ -1307,16 +1420,10 @@ def scan_library_incremental():
 
     try:
         with app.app_context():
-            # 更新状态：开始
             # 更新状态：开始扫描
-            SCAN_STATUS.update({
-                'scanning': True, 
-                'scan_total': 0, 
-                'scan_processed': 0, 
-                'current_file': '正在遍历文件...'
-            })
+            job.report(total=0, processed=0, message='正在遍历文件...')
             
-            with open(lock_file, 'w') as f: f.write(str(time.time()))
+            with open(lock_file, 'w') as f: f.write(f"{time.time()} {SCAN_LOCK_OWNER}")
             logger.info("开始增量扫描...")
             
             # 1. 获取所有扫描根目录
@@ -1327,206 +1434,872 @@ def scan_library_incremental():
                 scan_roots.extend([r['path'] for r in rows])
         except Exception: pass
         
-        disk_files = {} # path -> info
-        supported_exts = AUDIO_EXTS
-        
-        # 2. 遍历所有目录
-        for root_dir in scan_roots:
-            if not os.path.exists(root_dir): continue
-            for root, dirs, files in os.walk(root_dir):
-                # 排除自动生成的目录
-                dirs[:] = [d for d in dirs if d not in ('lyrics', 'covers')]
-                for f in files:
-                    if f.lower().endswith(supported_exts):
-                        path = os.path.join(root, f)
-                        try:
-                            stat = os.stat(path)
-                            info = {'mtime': stat.st_mtime, 'size': stat.st_size, 'path': path, 'filename': f}
-                            disk_files[path] = info
-                        except: pass
-
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, path, mtime, size FROM songs")
-            db_rows = {row['path']: row for row in cursor.fetchall()}
-            
-            # 删除不存在的文件
-            # 注意：如果某个点被临时拔出，这里会删除其歌曲。
-            # 简单起见：全量比对，消失即删除。
-            to_delete_paths = set(db_rows.keys()) - set(disk_files.keys())
-            if to_delete_paths:
-                cursor.executemany("DELETE FROM songs WHERE path=?", [(p,) for p in to_delete_paths])
-                conn.commit()
-
-            # 筛选需要更新的文件
-            files_to_process_list = []
-            for path, info in disk_files.items():
-                db_rec = db_rows.get(path)
-                if not db_rec or db_rec['mtime'] != info['mtime'] or db_rec['size'] != info['size']:
-                    files_to_process_list.append(info)
-
-            # 更新状态 scan_total
-            total_files = len(files_to_process_list)
-            SCAN_STATUS.update({'scan_total': total_files, 'scan_processed': 0})
-            
-            to_update_db = []
-            
-            # 3. 多线程处理
-            if total_files > 0:
-                logger.info(f"使用线程池处理 {total_files} 个文件...")
-                
-                def process_file_metadata(info):
-                    # Update current path for UI
-                    SCAN_STATUS['current_path'] = info['path']
-                    
-                    meta = get_metadata(info['path'])
-                    sid = generate_song_id(info['path'])
-                    # 封面逻辑
-                    base_path = os.path.splitext(info['path'])[0]
-                    # 检查本地是否有封面文件
-                    has_cover = 1 if os.path.exists(base_path + ".jpg") or os.path.exists(os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{os.path.basename(base_path)}.jpg")) else 0
-                    
-                    # Fix: 如果没有外部封面，尝试提取内嵌封面
-                    if has_cover == 0:
-                        if extract_embedded_cover(info['path']):
-                            has_cover = 1
-                            
-                    # 确保所有元数据都是字符串类型，避免数据库绑定错误
-                    title = str(meta['title']) if meta['title'] is not None else ''
-                    artist = str(meta['artist']) if meta['artist'] is not None else ''
-                    album = str(meta['album']) if meta['album'] is not None else ''
-                    return (sid, info['path'], info['filename'], title, artist, album, info['mtime'], info['size'], has_cover)
-
-                with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                    futures = {executor.submit(process_file_metadata, item): item for item in files_to_process_list}
-                    for future in concurrent.futures.as_completed(futures):
-                        try:
-                            res = future.result()
-                            to_update_db.append(res)
-                        except Exception: pass
-                        
-                        SCAN_STATUS['scan_processed'] += 1
-                        if SCAN_STATUS['scan_processed'] % 10 == 0:
-                            SCAN_STATUS['current_file'] = f"处理中... {int((SCAN_STATUS['scan_processed']/total_files)*100)}%"
-
-                # 过滤重复文件 (批次内去重 + 数据库去重)
-                final_update_db = []
-                seen_in_batch = set() # (filename, size)
-
-                for item in to_update_db:
-                    # structure: (sid, path, filename, title, artist, album, mtime, size, has_cover)
-                    # item[1]=path, item[2]=filename, item[7]=size
-                    c_path, c_fname, c_size = item[1], item[2], item[7]
-                    
-                    # 1. 批次内查重
-                    if (c_fname, c_size) in seen_in_batch:
-                        logger.info(f"扫描: 跳过批次内重复文件 {c_path}")
-                        continue
-                        
-                    # 2. 数据库查重 (排除自己)
-                    # 注意: 这里使用 conn (外层已开启)
-                    # 需要确保 conn 线程安全? sqlite3 单线程模式下需要注意。
-                    # 但 Flask 这里的 conn 是 thread-local 还是? 
-                    # scan_library_incremental 是后台任务，单线程执行 (executor 是处理 metadata 的)。
-                    # "with get_db() as conn" 在上层。所以是安全的。
-                    try:
-                        dup = conn.execute("SELECT path FROM songs WHERE filename=? AND size=? AND path!=?", (c_fname, c_size, c_path)).fetchone()
-                        if dup:
-                            logger.info(f"扫描: 跳过全局重复文件 {c_path} (已存在: {dup['path']})")
-                            continue
-                    except Exception: pass
-                    
-                    seen_in_batch.add((c_fname, c_size))
-                    final_update_db.append(item)
+        # 上次扫描中途退出（重启/崩溃/被抢占）时沿用其扫描方式继续；已提交的文件 mtime/size 与磁盘一致，不会重复解析
+        checkpoint = _load_scan_checkpoint()
+        if checkpoint:
+            deep = bool(checkpoint.get('deep'))
+            logger.info(f"继续上次中断的扫描 (已提交 {checkpoint.get('committed', 0)} 个文件)")
+        else:
+            # 定期深度校验：完整枚举所有文件，发现原地修改等目录 mtime 无法反映的变更
+            deep = _deep_scan_due()
+            checkpoint = {'deep': deep, 'started_at': time.time(), 'committed': 0}
+        DB.write(_store_scan_checkpoint, checkpoint)
+        manifest = DirectoryManifest(scan_roots, use_manifest=not deep)
+        if manifest.use_manifest:
+            logger.info("使用目录清单进行快速增量扫描")
+        walker = mod.walker.Walker(AUDIO_EXTS, unchanged=manifest.is_unchanged)
+        writer = ScanWriter(checkpoint=checkpoint, lock_file=lock_file)
+
+        # 2. 遍历所有目录 (并行预读目录) 并与数据库按路径归并比对，新增/变更的文件一经发现即提交解析
+        #    (多进程或多线程)，解析结果与删除每 SCAN_WRITE_BATCH 条提交一次；被取消时提交已解析的部分
+        try:
+            with new_tag_extractor() as extractor, get_db() as conn, \
+                    contextlib.closing(mod.libdiff.diff(conn, walker, scan_roots, on_dir=manifest.on_dir,
+                                                        keep=manifest.keeps)) as changes:
+                pool_name = '进程池' if extractor.mode == 'process' else '线程池'
+                logger.info(f"使用{pool_name} ({extractor.workers}) 解析标签")
+                for change in changes:
+                    job.token.check()
+                    if change.op == mod.libdiff.DELETE:
+                        # 删除不存在的文件（包括不在任何扫描根目录下的歌曲）
+                        # 注意：如果某个点被临时拔出，这里会删除其歌曲。
+                        writer.delete(change.path)
+                    else:
+                        extractor.submit(change.record)
+                        job.report(total=extractor.submitted)
+                        _drain_extractor(job, extractor, writer, wait_all=False)
 
-                if final_update_db:
-                    cursor.executemany('''
-                        INSERT OR REPLACE INTO songs (id, path, filename, title, artist, album, mtime, size, has_cover)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', final_update_db)
-                    conn.commit()
+                # 3. 等待剩余的解析结果
+                _drain_extractor(job, extractor, writer, wait_all=True)
+        finally:
+            writer.flush()
+        logger.info(f"共解析 {extractor.submitted} 个文件，写入 {writer.committed} 条，删除 {writer.deleted} 条")
 
+        manifest.save()
+        if deep:
+            _mark_deep_scan()
+        _clear_scan_checkpoint()
         logger.info("扫描完成。")
+        compact_library_changes()
         
-        # --- 自动刮削缺失元数据 (后台独立线程) ---
-        SCAN_STATUS['is_scraping'] = True
-        SCAN_STATUS['current_file'] = "正在准备自动刮削..."
-        threading.Thread(target=auto_scrape_missing_metadata).start()
+        # --- 自动刮削缺失元数据 (排在扫描之后的后台任务) ---
+        submit_scrape()
+        JOBS.submit('cover_gc', key='')
+        JOBS.submit('warm_covers', key='')
         
-        global LIBRARY_VERSION; LIBRARY_VERSION = time.time()
+        bump_library_version()
         
     except Exception as e:
         logger.error(f"扫描失败: {e}")
     finally:
-        SCAN_STATUS['scanning'] = False
-        SCAN_STATUS['current_file'] = ''
+        job.report(message='')
         if os.path.exists(lock_file): 
             try: os.remove(lock_file)
             except: pass
 
-threading.Thread(target=lambda: (init_db(), scan_library_incremental()), daemon=True).start()
-threading.Thread(target=init_watchdog, daemon=True).start()
+def submit_library_scan(priority=PRIORITY_SCAN):
+    return JOBS.submit('scan_library', priority=priority, key='library')
+
+# 全库扫描带检查点，被用户触发的任务抢占后重新排队时从中断处继续
+JOBS.register('scan_library', scan_library_incremental, 'library', priority=PRIORITY_SCAN,
+              persistent=True, preemptible=True)
+
+SONG_ROOTS_KEY = 'song_roots_library'
+
+def sync_song_roots():
+    """补齐升级前歌曲的根目录分区（root_id/rel_path/dir_id）；曲库根目录（启动参数）变化后重新归属"""
+    library = os.path.abspath(MUSIC_LIBRARY_PATH)
+
+    def _sync(conn):
+        row = conn.execute("SELECT value FROM system_settings WHERE key=?", (SONG_ROOTS_KEY,)).fetchone()
+        pending = conn.execute("SELECT 1 FROM songs WHERE root_id IS NULL LIMIT 1").fetchone()
+        if row and row[0] == library and not pending:
+            return 0
+        if row and row[0] != library:
+            conn.execute("UPDATE songs SET root_id=NULL, rel_path=NULL WHERE root_id=?", (mod.roots.LIBRARY_ROOT_ID,))
+        roots = song_roots(conn)
+        changed = sum(mod.roots.assign(conn, roots, root) for root in mod.libdiff.normalize_roots(roots.paths.values()))
+        conn.execute(f"UPDATE songs SET dir_id = {mod.roots.DIR_ID_FUNCTION}(path) WHERE dir_id IS NULL")
+        conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", (SONG_ROOTS_KEY, library))
+        return changed
+
+    try:
+        changed = db_write(_sync)
+        if changed:
+            logger.info(f"已更新 {changed} 首歌曲的根目录归属")
+    except Exception as e:
+        logger.warning(f"更新歌曲根目录归属失败: {e}")
+
+def start_background_jobs():
+    """数据库迁移完成后启动任务引擎与文件监听：恢复上次未完成的任务，并排队启动扫描与指纹补算"""
+    sync_song_roots()
+    JOBS.db = DB
+    JOBS.start()
+    init_watchdog()
+    submit_library_scan()
+    JOBS.submit('backfill_hashes', key='')
+    JOBS.submit('backfill_stream_info', key='')
+    JOBS.submit('migrate_covers', key='')
+    JOBS.submit('backfill_palettes', key='')
+    JOBS.submit('migrate_lyrics', key='')
+
 
 # --- 路由定义 ---
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# --- 事件推送 (SSE) ---
+SSE_KEEPALIVE = 15        # 无事件时的心跳间隔（秒），同时用于检测客户端断开
+
+def _sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/events')
+def event_stream():
+    """
+    服务端推送: 首帧 snapshot 为完整状态，之后按 topic 推送增量
+    topic: scan (SCAN_STATUS)、downloads (DOWNLOAD_TASKS，值为 null 表示任务已移除)、
+           install (INSTALL_STATUS)、jobs (JOBS.status，值为 null 表示任务已移除)、library ({library_version})
+    """
+    sub = EVENTS.subscribe()
+
+    def generate():
+        try:
+            # 先订阅再取快照，快照之后的变更不会丢失（重复的增量可幂等应用）
+            yield "retry: 3000\n\n"
+            yield _sse_message('snapshot', {
+                'scan': SCAN_STATUS.snapshot(),
+                'downloads': DOWNLOAD_TASKS.snapshot(),
+                'install': INSTALL_STATUS.snapshot(),
+                'jobs': JOBS.status.snapshot(),
+                'library': {'library_version': LIBRARY_VERSION},
+            })
+            while True:
+                events = sub.get(timeout=SSE_KEEPALIVE)
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                # 事件均为普通数据的拷贝；发送期间到达的变更在订阅者处合并，下一次取走时成为一帧
+                yield ''.join(_sse_message(topic, data) for topic, data in events)
+        finally:
+            EVENTS.unsubscribe(sub)
+
+    resp = Response(generate(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # 禁止反向代理缓冲
+    return resp
+
 # --- 系统状态接口 ---
+def _library_stats(conn):
+    """
+    读取触发器维护的计数器（songs/total_size/covers/lyrics/playlists）
+    按文件计数，包含列表中被去重隐藏的重复文件（与磁盘占用、歌手/专辑的 song_count 口径一致）
+    """
+    return {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM library_stats")}
+
 @app.route('/api/system/status')
 def get_system_status():
     """返回当前扫描状态和进度"""
     status = dict(SCAN_STATUS)
     status['library_version'] = LIBRARY_VERSION
 
-    # 实时获取准确数量
+    # 计数来自 library_stats，与曲库规模无关
     try:
         with get_db() as conn:
-            music_cnt = conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
-            pl_cnt = conn.execute("SELECT COUNT(*) FROM favorite_playlists").fetchone()[0]
-            status['music_count'] = music_cnt
-            status['playlist_count'] = pl_cnt
+            stats = _library_stats(conn)
+            status['music_count'] = stats.get('songs', 0)
+            status['playlist_count'] = stats.get('playlists', 0)
     except Exception as e:
         logger.error(f"Error counting stats: {e}")
         pass
         
     return jsonify(status)
 
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """后台任务列表（排队/运行中及最近结束的任务）"""
+    return jsonify({'success': True, 'data': JOBS.snapshot()})
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """取消排队或运行中的任务（运行中的任务在下一个检查点结束）"""
+    if not JOBS.cancel(job_id):
+        return jsonify({'success': False, 'error': '任务不存在或已结束'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/system/stats')
+def get_system_stats():
+    """曲库统计：歌曲数、总容量、封面/歌词覆盖数、收藏夹数及各挂载点明细"""
+    try:
+        with get_db() as conn:
+            stats = _library_stats(conn)
+            mounts = [dict(row) for row in conn.execute(
+                "SELECT path, song_count, total_size FROM mount_points ORDER BY created_at")]
+        songs = stats.get('songs', 0)
+        return jsonify({'success': True, 'data': {
+            'songs': songs,
+            'total_size': stats.get('total_size', 0),
+            'covers': stats.get('covers', 0),
+            'lyrics': stats.get('lyrics', 0),
+            'playlists': stats.get('playlists', 0),
+            'thumbnails': THUMBS.stats(),
+            'library': {
+                'path': MUSIC_LIBRARY_PATH,
+                'song_count': songs - sum(m['song_count'] for m in mounts),
+                'total_size': stats.get('total_size', 0) - sum(m['total_size'] for m in mounts),
+            },
+            'mounts': mounts,
+            'library_version': LIBRARY_VERSION,
+        }})
+    except Exception as e:
+        logger.exception(f"获取曲库统计失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+# 查询 songs s 时附带封面 hash 与调色板（_song_to_dict 需要）
+SONG_COVER_SQL = '''(SELECT sc.cover_hash FROM song_covers sc WHERE sc.song_id = s.id) AS cover_hash,
+    (SELECT c.palette FROM song_covers sc JOIN covers c ON c.hash = sc.cover_hash WHERE sc.song_id = s.id) AS cover_palette'''
+
+def _cover_url(song_id, cover_hash=None):
+    # 内容寻址的封面 URL 内容不变则不变；尚未提取的封面按歌曲 id 访问，首次请求时提取
+    if cover_hash:
+        return mod.covers.url(cover_hash)
+    return mod.covers.song_url(song_id)
+
+def _song_to_dict(row):
+    album_art = _cover_url(row['id'], row['cover_hash']) if row['has_cover'] or row['cover_hash'] else None
+    return {
+        'id': row['id'], # 新增 ID
+        'filename': row['filename'], 'title': row['title'],
+        'artist': row['artist'], 'album': row['album'], 'album_art': album_art,
+        # 封面调色板（主色调在前），封面尚未提取或未计算时为 null
+        'palette': mod.covers.decode_palette(row['cover_palette']),
+        'mtime': row['mtime'], 'size': row['size'],
+        # 音频流属性（未解析出时为 null）
+        'duration': row['duration'], 'bitrate': row['bitrate'], 'sample_rate': row['sample_rate'],
+        'bits_per_sample': row['bits_per_sample'], 'channels': row['channels'], 'codec': row['codec'] or None,
+    }
+
+# 列表排序键 -> 排序表达式（须与迁移 v4 中的表达式索引完全一致，否则无法走索引）
+MUSIC_SORT_KEYS = {
+    'title': "IFNULL(title, '')",
+    'artist': "IFNULL(artist, '')",
+    'album': "IFNULL(album, '')",
+    'mtime': "IFNULL(mtime, 0)",
+    'duration': "IFNULL(duration, 0)",  # 迁移 v11
+    'bitrate': "IFNULL(bitrate, 0)",
+}
+# 去重：内容指纹相同的重复文件在列表与搜索中只保留一条（duplicates 表由触发器维护）
+NOT_DUPLICATE_SQL = "NOT EXISTS (SELECT 1 FROM duplicates d WHERE d.song_id = s.id)"
+MUSIC_LIST_FIELDS = ('id', 'filename', 'title', 'artist', 'album', 'album_art', 'palette', 'mtime', 'size',
+                     'duration', 'bitrate', 'sample_rate', 'bits_per_sample', 'channels', 'codec')
+
+def _music_filters(args):
+    """
+    /api/music 的筛选参数 -> (WHERE 条件列表, 参数列表, 规范化后的参数串)
+    lossless=1 只含无损编码；codec=逗号分隔的编码名；min_duration/max_duration 秒；min_bitrate bps
+    """
+    where, params, keys = [], [], []
+    if args.get('lossless') in ('1', 'true'):
+        where.append(f"s.codec IN ({','.join('?' * len(mod.tagreader.LOSSLESS_CODECS))})")
+        params.extend(mod.tagreader.LOSSLESS_CODECS)
+        keys.append('lossless')
+    codecs = [c.strip().lower() for c in (args.get('codec') or '').split(',') if c.strip()]
+    if codecs:
+        where.append(f"s.codec IN ({','.join('?' * len(codecs))})")
+        params.extend(codecs)
+        keys.append(f"codec={','.join(codecs)}")
+    for name, column, op in (('min_duration', 'duration', '>='), ('max_duration', 'duration', '<='),
+                             ('min_bitrate', 'bitrate', '>=')):
+        value = args.get(name)
+        if value:
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f'无效的 {name}')
+            where.append(f"s.{column} {op} ?")
+            params.append(value)
+            keys.append(f"{name}={value!r}")
+    return where, params, '&'.join(keys)
+MUSIC_PAGE_MAX = 1000
+
+def _encode_list_cursor(sort, order, value, song_id):
+    raw = json.dumps([sort, order, value, song_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_list_cursor(cursor, sort, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        c_sort, c_order, value, song_id = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError('无效的 cursor')
+    if c_sort != sort or c_order != order:
+        raise ValueError('cursor 与排序参数不匹配')
+    return value, song_id
+
 @app.route('/api/music', methods=['GET'])
 def get_music_list():
-    logger.info("API请求: 获取音乐列表")
+    """
+    音乐列表
+    参数: sort=title|artist|album|mtime|duration|bitrate, order=asc|desc, limit=每页条数(不传则返回全部),
+         cursor=上一页返回的 next_cursor, fields=逗号分隔的返回字段,
+         筛选 lossless/codec/min_duration/max_duration/min_bitrate（见 _music_filters）
+    响应带 ETag（由 LIBRARY_VERSION 与查询参数生成），If-None-Match 命中时返回 304
+    """
+    sort = request.args.get('sort', 'title')
+    order = request.args.get('order', 'asc').lower()
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit')
+    fields = request.args.get('fields')
+    if sort not in MUSIC_SORT_KEYS or order not in ('asc', 'desc'):
+        return jsonify({'success': False, 'error': '不支持的排序参数'}), 400
+    try:
+        limit = max(1, min(int(limit), MUSIC_PAGE_MAX)) if limit else None
+    except ValueError:
+        return jsonify({'success': False, 'error': '无效的 limit'}), 400
+    if fields:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in MUSIC_LIST_FIELDS]
+        if unknown:
+            return jsonify({'success': False, 'error': f"不支持的字段: {','.join(unknown)}"}), 400
+    if cursor and not limit:
+        limit = MUSIC_PAGE_MAX
     try:
+        filter_where, filter_params, filter_key = _music_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    # 先取版本再查询：查询期间发生的写入会让下次请求拿到新的 ETag
+    version = LIBRARY_VERSION
+    etag_source = f"{version!r}|{sort}|{order}|{limit}|{cursor}|{','.join(fields or ())}|{filter_key}"
+    etag = hashlib.md5(etag_source.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
+
+    logger.debug(f"API请求: 获取音乐列表 sort={sort} order={order} limit={limit}")
+    try:
+        expr = MUSIC_SORT_KEYS[sort]
+        direction = 'DESC' if order == 'desc' else 'ASC'
+        where = [NOT_DUPLICATE_SQL, *filter_where]
+        params = list(filter_params)
+        if cursor:
+            value, after_id = _decode_list_cursor(cursor, sort, order)
+            op = '<' if order == 'desc' else '>'
+            # 等价于 (expr, id) > (?, ?)，拆开写才能让 SQLite 在表达式索引上做范围查找
+            where.append(f"{expr} {op}= ? AND ({expr} {op} ? OR s.id {op} ?)")
+            params.extend([value, value, after_id])
+        sql = f"SELECT s.*, {SONG_COVER_SQL}, {expr} AS sort_value FROM songs s WHERE {' AND '.join(where)} ORDER BY {expr} {direction}, s.id {direction}"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM songs ORDER BY title")
-            songs = []
-            seen = set()
-            
-            for row in cursor.fetchall():
-                # 去重逻辑：如果 标题+歌手+大小 完全一致，视为重复文件，仅保留第一个
-                # 这样可以解决不同目录下存放相同文件导致的列表重复问题
-                unique_key = (row['title'], row['artist'], row['size'])
-                if unique_key in seen:
-                    continue
-                seen.add(unique_key)
-                
-                album_art = None
-                if row['has_cover']:
-                    base_name = os.path.splitext(row['filename'])[0]
-                    # 封面图链接带上 filename 参数仅作缓存区分，实际通过 scan 查找
-                    album_art = f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(row['filename'])}"
-                songs.append({
-                    'id': row['id'], # 新增 ID
-                    'filename': row['filename'], 'title': row['title'],
-                    'artist': row['artist'], 'album': row['album'], 'album_art': album_art,
-                    'mtime': row['mtime'], 'size': row['size']
-                })
-        logger.info(f"返回音乐数量: {len(songs)}")
-        return jsonify({'success': True, 'data': songs})
+            # 先取变更序号再查列表：客户端之后用它调用 /api/music/changes，重复的变更可幂等应用
+            change_seq = _library_change_seq(conn)
+            rows = conn.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = _encode_list_cursor(sort, order, last['sort_value'], last['id'])
+
+        songs = [_song_to_dict(row) for row in rows]
+        if fields:
+            songs = [{f: song[f] for f in fields} for song in songs]
+        logger.debug(f"返回音乐数量: {len(songs)}")
+        resp = jsonify({'success': True, 'data': songs, 'next_cursor': next_cursor,
+                        'library_version': version, 'change_seq': change_seq})
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         logger.exception(f"获取音乐列表失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/music/changes', methods=['GET'])
+def get_music_changes():
+    """
+    增量同步：返回 seq > since 的曲库变更（每首歌只返回最近一次）
+    op 为 insert/update/delete，delete 时 song 为空；列表中被去重隐藏的歌曲也按 delete 返回。
+    since 早于压缩水位 horizon 时返回 resync=true，客户端需重新全量拉取 /api/music。
+    """
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+        limit = max(1, min(int(request.args.get('limit', 500)), 5000))
+    except ValueError:
+        return jsonify({'success': False, 'error': '无效的 since/limit'}), 400
+    try:
+        with get_db() as conn:
+            horizon = _library_changes_horizon(conn)
+            if since < horizon:
+                return jsonify({'success': True, 'resync': True, 'horizon': horizon,
+                                'last_seq': _library_change_seq(conn), 'has_more': False, 'changes': []})
+            rows = conn.execute(f'''
+                SELECT c.seq AS change_seq, c.op AS change_op, c.song_id AS change_song_id, s.*, {SONG_COVER_SQL},
+                       EXISTS (SELECT 1 FROM duplicates d WHERE d.song_id = c.song_id) AS hidden
+                FROM library_changes c LEFT JOIN songs s ON s.id = c.song_id
+                WHERE c.seq > ? ORDER BY c.seq LIMIT ?
+            ''', (since, limit + 1)).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        changes = []
+        for row in rows:
+            if row['id'] is None or row['hidden']:
+                changes.append({'seq': row['change_seq'], 'op': 'delete', 'id': row['change_song_id'], 'song': None})
+            else:
+                changes.append({'seq': row['change_seq'], 'op': row['change_op'], 'id': row['change_song_id'], 'song': _song_to_dict(row)})
+        last_seq = rows[-1]['change_seq'] if rows else since
+        return jsonify({'success': True, 'resync': False, 'horizon': horizon,
+                        'last_seq': last_seq, 'has_more': has_more, 'changes': changes})
+    except Exception as e:
+        logger.exception(f"获取曲库变更失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/music/search', methods=['GET'])
+def search_music():
+    """本地曲库全文检索（标题/歌手/专辑/文件名，支持繁简互搜），按相关度排序"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': True, 'data': []})
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+    except ValueError:
+        limit = 50
+    try:
+        with get_db() as conn:
+            rows = mod.libsearch.search(conn, query, limit, columns=f"s.*, {SONG_COVER_SQL}", where=NOT_DUPLICATE_SQL)
+        return jsonify({'success': True, 'data': [_song_to_dict(row) for row in rows]})
+    except Exception as e:
+        logger.exception(f"曲库搜索失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+# --- 重复文件 (duplicates 表由触发器按内容指纹维护) ---
+DEDUP_INDEX = mod.dedup.DedupIndex()
+
+def _sync_dedup_index():
+    """内存指纹索引：首次使用时全量加载，之后按 library_changes 增量同步"""
+    with get_db() as conn:
+        seq = _library_change_seq(conn)
+        if DEDUP_INDEX.seq is None or DEDUP_INDEX.seq < _library_changes_horizon(conn):
+            DEDUP_INDEX.load(conn.execute("SELECT id, audio_size, content_hash FROM songs").fetchall(), seq)
+        elif seq > DEDUP_INDEX.seq:
+            rows = conn.execute('''
+                SELECT c.song_id, s.audio_size, s.content_hash
+                FROM library_changes c LEFT JOIN songs s ON s.id = c.song_id
+                WHERE c.seq > ? AND c.seq <= ?
+            ''', (DEDUP_INDEX.seq, seq)).fetchall()
+            DEDUP_INDEX.apply(rows, seq)
+
+def find_library_duplicate(audio_size, content_hash, exclude_path=None):
+    """按内容指纹查找库中已存在（且文件仍在）的相同歌曲，返回其路径"""
+    if not content_hash:
+        return None
+    _sync_dedup_index()
+    ids = list(DEDUP_INDEX.find(audio_size, content_hash))
+    if not ids:
+        return None
+    with get_db() as conn:
+        rows = conn.execute(f"SELECT path FROM songs WHERE id IN ({','.join('?' * len(ids))}) ORDER BY rowid", ids).fetchall()
+    for row in rows:
+        if row['path'] != exclude_path and os.path.exists(row['path']):
+            return row['path']
+    return None
+
+def backfill_content_hashes(job):
+    """为升级前入库、尚无内容指纹的歌曲补算指纹（按 rowid 分批提交，被抢占后重新执行时从剩余部分继续）"""
+    last_rowid, filled = 0, 0
+    while True:
+        job.token.check()
+        with get_db() as conn:
+            rows = conn.execute('''
+                SELECT rowid, id, path FROM songs WHERE content_hash IS NULL AND rowid > ?
+                ORDER BY rowid LIMIT ?
+            ''', (last_rowid, SCAN_WRITE_BATCH)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1]['rowid']
+        updates = []
+        for row in rows:
+            audio_size, content_hash = mod.dedup.fingerprint(row['path'])
+            if content_hash:
+                updates.append((audio_size, content_hash, row['id']))
+        if updates:
+            DB.executemany("UPDATE songs SET audio_size=?, content_hash=? WHERE id=?", updates)
+            for audio_size, content_hash, song_id in updates:
+                DEDUP_INDEX.add(song_id, audio_size, content_hash)
+            filled += len(updates)
+        job.report(processed=filled)
+    if filled:
+        logger.info(f"已补算 {filled} 首歌曲的内容指纹")
+        bump_library_version()
+
+JOBS.register('backfill_hashes', backfill_content_hashes, 'library', priority=PRIORITY_BACKGROUND,
+              persistent=True, preemptible=True)
+
+# --- 音频流属性补齐 ---
+STREAM_BACKFILL_KEY = 'stream_info_backfilled'
+
+def backfill_stream_info(job):
+    """为升级前入库的歌曲补齐时长/码率等流属性（一次性迁移任务，完成后记入 system_settings）"""
+    with get_db() as conn:
+        if conn.execute("SELECT 1 FROM system_settings WHERE key=?", (STREAM_BACKFILL_KEY,)).fetchone():
+            return
+    last_rowid, filled = 0, 0
+    while True:
+        job.token.check()
+        with get_db() as conn:
+            rows = conn.execute('''
+                SELECT rowid, id, path FROM songs WHERE codec IS NULL AND rowid > ?
+                ORDER BY rowid LIMIT ?
+            ''', (last_rowid, SCAN_WRITE_BATCH)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1]['rowid']
+        updates = []
+        for row in rows:
+            job.token.check()
+            if not os.path.exists(row['path']):
+                continue
+            tags = mod.tagreader.read_tags(row['path'])
+            # 无法识别的文件记为空编码，不再重复解析
+            updates.append((tags.duration, tags.bitrate, tags.sample_rate, tags.bits_per_sample, tags.channels,
+                            tags.codec or '', row['id']))
+        if updates:
+            DB.executemany('''
+                UPDATE songs SET duration=?, bitrate=?, sample_rate=?, bits_per_sample=?, channels=?, codec=?
+                WHERE id=?
+            ''', updates)
+            filled += len(updates)
+            bump_library_version()
+        job.report(processed=filled)
+    DB.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", (STREAM_BACKFILL_KEY, '1'))
+    if filled:
+        logger.info(f"已补齐 {filled} 首歌曲的音频流属性")
+
+JOBS.register('backfill_stream_info', backfill_stream_info, 'library', priority=PRIORITY_BACKGROUND,
+              persistent=True, preemptible=True)
+
+COVERS_MIGRATED_KEY = 'covers_migrated'
+
+def migrate_covers(job):
+    """
+    将升级前刮削保存的旧封面（covers/<文件名>.jpg）导入内容寻址存储并关联到歌曲，完成后删除已导入的旧文件
+    （一次性迁移任务，完成后记入 system_settings）。内嵌封面与同名图片不在此提取，首次请求时由 song_cover 查找
+    """
+    with get_db() as conn:
+        if conn.execute("SELECT 1 FROM system_settings WHERE key=?", (COVERS_MIGRATED_KEY,)).fetchone():
+            return
+    last_rowid, linked = 0, 0
+    while True:
+        job.token.check()
+        with get_db() as conn:
+            rows = conn.execute('''
+                SELECT rowid, id, filename FROM songs
+                WHERE has_cover = 1 AND cover_source IS NULL AND rowid > ?
+                  AND NOT EXISTS (SELECT 1 FROM song_covers WHERE song_id = songs.id)
+                ORDER BY rowid LIMIT ?
+            ''', (last_rowid, SCAN_WRITE_BATCH)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1]['rowid']
+        links = []
+        for row in rows:
+            job.token.check()
+            legacy = os.path.join(COVER_DIR, f"{os.path.splitext(row['filename'])[0]}.jpg")
+            try:
+                if os.path.exists(legacy):
+                    links.append((row['id'], COVERS.put_file(legacy), mod.covers.SCRAPED))
+            except OSError as e:
+                logger.warning(f"导入封面失败: {legacy} ({e})")
+
+        def _write(conn):
+            mod.covers.link(conn, links)
+            conn.executemany("UPDATE songs SET cover_source=? WHERE id=?", [(source, song_id) for song_id, _, source in links])
+
+        if links:
+            db_write(_write)
+            linked += len(links)
+            bump_library_version()
+        job.report(processed=linked)
+    # 旧封面只按文件名命名，对应歌曲已关联封面的由 song_covers 代替
+    with get_db() as conn:
+        linked_names = {os.path.splitext(r[0])[0] for r in conn.execute(
+            "SELECT s.filename FROM songs s JOIN song_covers sc ON sc.song_id = s.id")}
+    removed = 0
+    with os.scandir(COVER_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('.jpg') and entry.name[:-4] in linked_names:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+    DB.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", (COVERS_MIGRATED_KEY, '1'))
+    if linked or removed:
+        logger.info(f"封面迁移完成: 关联 {linked} 首歌曲，清理旧封面文件 {removed} 个")
+
+JOBS.register('migrate_covers', migrate_covers, 'library', priority=PRIORITY_BACKGROUND,
+              persistent=True, preemptible=True)
+
+def cover_gc(job):
+    """清理不再被任何歌曲引用的封面（文件与 covers 记录），最近写入的封面保留 GC_GRACE 秒"""
+    with get_db() as conn:
+        referenced = {r[0] for r in conn.execute("SELECT DISTINCT cover_hash FROM song_covers")}
+    removed = mod.covers.gc(COVERS, referenced)
+    DB.execute("DELETE FROM covers WHERE NOT EXISTS (SELECT 1 FROM song_covers WHERE cover_hash = covers.hash) "
+               "AND created_at < ?", (time.time() - mod.covers.GC_GRACE,))
+    if removed:
+        logger.info(f"已清理 {removed} 个无引用的封面")
+
+JOBS.register('cover_gc', cover_gc, 'library', priority=PRIORITY_BACKGROUND)
+
+COVER_WARM_LIMIT = 200
+
+def warm_covers(job):
+    """预先提取收藏歌曲与最近加入歌曲的封面（其余封面在首次请求时提取）"""
+    with get_db() as conn:
+        rows = conn.execute('''
+            SELECT id FROM (
+                SELECT s.id, 0 AS grp, MAX(f.created_at) AS ord FROM favorites f JOIN songs s ON s.id = f.song_id
+                WHERE s.has_cover = 1 GROUP BY s.id
+                UNION ALL
+                SELECT id, 1, mtime FROM (SELECT id, mtime FROM songs WHERE has_cover = 1 ORDER BY mtime DESC LIMIT ?)
+            ) c
+            WHERE NOT EXISTS (SELECT 1 FROM song_covers WHERE song_id = c.id)
+            ORDER BY grp, ord DESC LIMIT ?
+        ''', (COVER_WARM_LIMIT, COVER_WARM_LIMIT)).fetchall()
+    warmed = 0
+    for row in rows:
+        job.token.check()
+        if song_cover(row['id']):
+            warmed += 1
+        job.report(processed=warmed, total=len(rows))
+    if warmed:
+        logger.info(f"已预先提取 {warmed} 个封面")
+
+JOBS.register('warm_covers', warm_covers, 'library', priority=PRIORITY_BACKGROUND, preemptible=True)
+
+def backfill_palettes(job):
+    """为尚未计算调色板的封面补算（升级前入库的封面，或入库时未安装 Pillow）"""
+    if not mod.thumbs.available():
+        return
+    filled = 0
+    while True:
+        job.token.check()
+        with get_db() as conn:
+            rows = conn.execute("SELECT hash FROM covers WHERE palette IS NULL LIMIT ?", (SCAN_WRITE_BATCH,)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            job.token.check()
+            # 文件已被清理的封面记为空调色板，不再重复尝试
+            path = COVERS.path(row['hash'])
+            palette = mod.covers.extract_palette(path) if os.path.exists(path) else []
+            updates.append((mod.covers.encode_palette(palette), row['hash']))
+        DB.executemany("UPDATE covers SET palette=? WHERE hash=?", updates)
+        filled += len(updates)
+        bump_library_version()
+        job.report(processed=filled)
+    if filled:
+        logger.info(f"已补算 {filled} 个封面的调色板")
+
+JOBS.register('backfill_palettes', backfill_palettes, 'library', priority=PRIORITY_BACKGROUND,
+              persistent=True, preemptible=True)
+
+LYRICS_MIGRATED_KEY = 'lyrics_migrated'
+
+def migrate_lyrics(job):
+    """
+    将升级前的歌词导入 lyrics 表：音频旁的 .lrc/.yrc、内嵌歌词与旧版 lyrics/ 目录下的歌词文件
+    （一次性迁移任务，按 rowid 分批，进度记入 system_settings，中断后从上次位置继续）。
+    完成后按 lyrics 表重算 has_lyrics
+    """
+    with get_db() as conn:
+        row = conn.execute("SELECT value FROM system_settings WHERE key=?", (LYRICS_MIGRATED_KEY,)).fetchone()
+    if row and row['value'] == 'done':
+        return
+    last_rowid = int(row['value']) if row else 0
+    imported = 0
+    while True:
+        job.token.check()
+        with get_db() as conn:
+            rows = conn.execute('''
+                SELECT rowid, id, path FROM songs
+                WHERE rowid > ? AND NOT EXISTS (SELECT 1 FROM lyrics WHERE song_id = songs.id)
+                ORDER BY rowid LIMIT ?
+            ''', (last_rowid, SCAN_WRITE_BATCH)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1]['rowid']
+        entries = []
+        for row in rows:
+            job.token.check()
+            found = []
+            try:
+                if os.path.exists(row['path']):
+                    found = mod.lyrics.find(row['path'], mod.tagreader.read_tags(row['path']))
+            except Exception as e:
+                logger.warning(f"读取歌词失败: {row['path']} ({e})")
+            formats = {fmt for fmt, _, _ in found}
+            found += [entry for entry in mod.lyrics.find_local(LYRICS_DIR, row['path']) if entry[0] not in formats]
+            entries.extend((row['id'], *entry) for entry in found)
+
+        def _write(conn):
+            mod.lyrics.store(conn, entries)
+            conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)",
+                         (LYRICS_MIGRATED_KEY, str(last_rowid)))
+
+        db_write(_write)
+        imported += len(entries)
+        job.report(processed=imported)
+    # 旧版 has_lyrics 只反映 lyrics/ 目录下的文件，按歌词表统一重算
+    flag = f"EXISTS (SELECT 1 FROM lyrics WHERE song_id = songs.id AND format IN ('{mod.lyrics.LRC}', '{mod.lyrics.YRC}'))"
+    DB.execute(f"UPDATE songs SET has_lyrics = {flag} WHERE has_lyrics IS NOT {flag}")
+    DB.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", (LYRICS_MIGRATED_KEY, 'done'))
+    bump_library_version()
+    if imported:
+        logger.info(f"歌词迁移完成: 导入 {imported} 份歌词")
+
+JOBS.register('migrate_lyrics', migrate_lyrics, 'library', priority=PRIORITY_BACKGROUND,
+              persistent=True, preemptible=True)
+
+@app.route('/api/music/duplicates', methods=['GET'])
+def list_duplicates():
+    """
+    重复文件报告：按内容指纹分组，keep 为列表中保留的一条，duplicates 为被隐藏的其余文件
+    参数: limit, offset（按组分页）
+    """
+    try:
+        limit, offset = _page_args(default_limit=50, max_limit=200)
+    except ValueError:
+        return jsonify({'success': False, 'error': '无效的分页参数'}), 400
+    try:
+        def _entry(row):
+            return {**_song_to_dict(row), 'path': row['path']}
+
+        with get_db() as conn:
+            summary = conn.execute('''
+                SELECT COUNT(DISTINCT d.keep_id) AS groups, COUNT(*) AS files, IFNULL(SUM(s.size), 0) AS size
+                FROM duplicates d JOIN songs s ON s.id = d.song_id
+            ''').fetchone()
+            keeps = conn.execute(f'''
+                SELECT s.*, {SONG_COVER_SQL} FROM songs s WHERE s.id IN (SELECT keep_id FROM duplicates)
+                ORDER BY IFNULL(s.title, ''), s.id LIMIT ? OFFSET ?
+            ''', (limit, offset)).fetchall()
+            groups = []
+            for keep in keeps:
+                dups = conn.execute(f'''
+                    SELECT s.*, {SONG_COVER_SQL} FROM duplicates d JOIN songs s ON s.id = d.song_id
+                    WHERE d.keep_id = ? ORDER BY s.path
+                ''', (keep['id'],)).fetchall()
+                groups.append({'audio_size': keep['audio_size'], 'content_hash': keep['content_hash'],
+                               'keep': _entry(keep), 'duplicates': [_entry(r) for r in dups]})
+        return jsonify({'success': True, 'total_groups': summary['groups'], 'duplicate_files': summary['files'],
+                        'duplicate_size': summary['size'], 'data': groups})
+    except Exception as e:
+        logger.exception(f"获取重复文件失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+# --- 歌手/专辑 (artists/albums 由数据库触发器维护) ---
+def _page_args(default_limit=100, max_limit=500):
+    limit = max(1, min(int(request.args.get('limit', default_limit)), max_limit))
+    offset = max(0, int(request.args.get('offset', 0)))
+    return limit, offset
+
+@app.route('/api/artists', methods=['GET'])
+def list_artists():
+    """歌手列表，参数: sort=name|count, q=名称关键字, limit, offset"""
+    try:
+        limit, offset = _page_args()
+    except ValueError:
+        return jsonify({'success': False, 'error': '无效的分页参数'}), 400
+    order = 'a.song_count DESC, a.name' if request.args.get('sort') == 'count' else 'a.name'
+    where, params = '', []
+    q = request.args.get('q', '').strip()
+    if q:
+        where = "WHERE a.name LIKE ?"
+        params.append(f"%{q}%")
+    try:
+        with get_db() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM artists a {where}", params).fetchone()[0]
+            rows = conn.execute(f'''
+                SELECT a.id, a.name, a.song_count,
+                       (SELECT sc.cover_hash FROM song_artists sa JOIN song_covers sc ON sc.song_id = sa.song_id
+                        WHERE sa.artist_id = a.id LIMIT 1) AS cover_hash,
+                       (SELECT s.id FROM song_artists sa JOIN songs s ON s.id = sa.song_id
+                        WHERE sa.artist_id = a.id AND s.has_cover = 1 LIMIT 1) AS cover_song_id
+                FROM artists a {where} ORDER BY {order} LIMIT ? OFFSET ?
+            ''', params + [limit, offset]).fetchall()
+        data = [{'id': r['id'], 'name': r['name'], 'song_count': r['song_count'],
+                 'album_art': _cover_url(r['cover_song_id'], r['cover_hash']) if r['cover_song_id'] or r['cover_hash'] else None}
+                for r in rows]
+        return jsonify({'success': True, 'data': data, 'total': total})
+    except Exception as e:
+        logger.exception(f"获取歌手列表失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/albums', methods=['GET'])
+def list_albums():
+    """专辑列表，参数: artist_id=仅返回含该歌手曲目的专辑, sort=title|count, q, limit, offset"""
+    try:
+        limit, offset = _page_args()
+        artist_id = request.args.get('artist_id', type=int)
+    except ValueError:
+        return jsonify({'success': False, 'error': '无效的分页参数'}), 400
+    order = 'al.song_count DESC, al.title' if request.args.get('sort') == 'count' else 'al.title, al.artist'
+    conditions, params = [], []
+    if artist_id is not None:
+        conditions.append('''al.id IN (SELECT x.album_id FROM song_artists sa JOIN album_songs x ON x.song_id = sa.song_id
+                                       WHERE sa.artist_id = ?)''')
+        params.append(artist_id)
+    q = request.args.get('q', '').strip()
+    if q:
+        conditions.append("al.title LIKE ?")
+        params.append(f"%{q}%")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    try:
+        with get_db() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM albums al {where}", params).fetchone()[0]
+            rows = conn.execute(f'''
+                SELECT al.id, al.title, al.artist, al.song_count,
+                       (SELECT sc.cover_hash FROM album_songs x JOIN song_covers sc ON sc.song_id = x.song_id
+                        WHERE x.album_id = al.id LIMIT 1) AS cover_hash,
+                       (SELECT s.id FROM album_songs x JOIN songs s ON s.id = x.song_id
+                        WHERE x.album_id = al.id AND s.has_cover = 1 LIMIT 1) AS cover_song_id
+                FROM albums al {where} ORDER BY {order} LIMIT ? OFFSET ?
+            ''', params + [limit, offset]).fetchall()
+        data = [{'id': r['id'], 'title': r['title'], 'artist': r['artist'], 'song_count': r['song_count'],
+                 'album_art': _cover_url(r['cover_song_id'], r['cover_hash']) if r['cover_song_id'] or r['cover_hash'] else None}
+                for r in rows]
+        return jsonify({'success': True, 'data': data, 'total': total})
+    except Exception as e:
+        logger.exception(f"获取专辑列表失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/albums/<int:album_id>/tracks', methods=['GET'])
+def list_album_tracks(album_id):
+    try:
+        with get_db() as conn:
+            album = conn.execute("SELECT id, title, artist, song_count FROM albums WHERE id=?", (album_id,)).fetchone()
+            if not album:
+                return jsonify({'success': False, 'error': '专辑不存在'}), 404
+            rows = conn.execute(f'''
+                SELECT s.*, {SONG_COVER_SQL} FROM album_songs x JOIN songs s ON s.id = x.song_id
+                WHERE x.album_id = ? ORDER BY s.path
+            ''', (album_id,)).fetchall()
+        return jsonify({'success': True, 'album': dict(album), 'data': [_song_to_dict(r) for r in rows]})
+    except Exception as e:
+        logger.exception(f"获取专辑曲目失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/music/play/<song_id>')
 def play_music(song_id):
     try:
@@ -1581,15 +2354,21 @@ def add_mount_point():
         if not check_has_music(path):
             return jsonify({'success': False, 'error': '该目录及其子目录中未发现可识别的音乐文件'})
         
-        with get_db() as conn:
+        def _add(conn):
             if conn.execute("SELECT 1 FROM mount_points WHERE path=?", (path,)).fetchone():
-                return jsonify({'success': False, 'error': '已添加'})
-            conn.execute("INSERT INTO mount_points (path, created_at) VALUES (?, ?)", (path, time.time()))
-            conn.commit()
+                return False
+            conn.execute("INSERT INTO mount_points (id, path, created_at) "
+                         "VALUES ((SELECT IFNULL(MAX(id), 0) + 1 FROM mount_points), ?, ?)", (path, time.time()))
+            # 已在其他根目录下索引过的歌曲改归新挂载点
+            mod.roots.assign(conn, song_roots(conn), path)
+            return True
+
+        if not db_write(_add):
+            return jsonify({'success': False, 'error': '已添加'})
 
         # 刷新监听并触发扫描
         refresh_watchdog_paths()
-        threading.Thread(target=scan_library_incremental, daemon=True).start()
+        submit_library_scan(priority=PRIORITY_USER)
         
         return jsonify({'success': True, 'message': '目录已添加，正在后台处理...'})
     except Exception as e:
@@ -1600,16 +2379,32 @@ def add_mount_point():
 def remove_mount_point():
     try:
         path = request.json.get('path')
-        with get_db() as conn:
-            # 清理该路径下的歌曲
-            conn.execute("DELETE FROM songs WHERE path LIKE ? || '%'", (path,))
-            conn.execute("DELETE FROM mount_points WHERE path=?", (path,))
-            conn.commit()
+        def _remove(conn):
+            row = conn.execute("SELECT id FROM mount_points WHERE path=?", (path,)).fetchone()
+            if row is None:
+                return
+            conn.execute("DELETE FROM mount_points WHERE id=?", (row['id'],))
+            # 该挂载点的歌曲按 root_id 索引删除；挂载点位于其他根目录之下时改归外层根目录，
+            # 嵌套在其中的挂载点有各自的 root_id，不受影响
+            roots = song_roots(conn)
+            outer, _ = roots.locate(os.path.abspath(path))
+            if outer is None:
+                conn.execute("DELETE FROM songs WHERE root_id=?", (row['id'],))
+                rng = mod.libdiff.path_range(os.path.abspath(path))
+                keep = [mod.libdiff.path_range(root) for _, root in roots.within(path)]
+                where = "path >= ? AND path < ?" + " AND NOT (path >= ? AND path < ?)" * len(keep)
+                conn.execute(f"DELETE FROM directories WHERE path = ? OR ({where})",
+                             [os.path.abspath(path), *rng, *(v for r in keep for v in r)])
+            else:
+                conn.execute("UPDATE songs SET root_id=?, rel_path=substr(path, ?) WHERE root_id=?",
+                             (outer, len(mod.libdiff.path_range(roots.paths[outer])[0]) + 1, row['id']))
+
+        db_write(_remove)
             
         refresh_watchdog_paths()
         
         # 触发一次库版本更新
-        global LIBRARY_VERSION; LIBRARY_VERSION = time.time()
+        bump_library_version()
             
         return jsonify({'success': True, 'message': '已移除'})
     except Exception as e: return jsonify({'success': False, 'error': str(e)})
@@ -1682,9 +2477,7 @@ def save_netease_cookie(cookie_str: str):
     global NETEASE_COOKIE
     NETEASE_COOKIE = normalize_cookie_string(cookie_str or '')
     try:
-        with get_db() as conn:
-            conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_cookie', NETEASE_COOKIE))
-            conn.commit()
+        DB.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_cookie', NETEASE_COOKIE))
     except Exception as e:
         logger.warning(f"保存网易云 cookie 失败: {e}")
 
@@ -1711,15 +2504,16 @@ def save_netease_config(download_dir: str = None, api_base: str = None): # Remov
     if api_base: NETEASE_API_BASE = api_base.rstrip('/') or NETEASE_API_BASE_DEFAULT
     # if quality: NETEASE_QUALITY = quality # Removed quality processing
     
+    def _save(conn):
+        if download_dir:
+            conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_download_dir', NETEASE_DOWNLOAD_DIR))
+        if api_base:
+            conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_api_base', NETEASE_API_BASE))
+        # if quality: # Removed quality processing
+        #     conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_quality', NETEASE_QUALITY))
+
     try:
-        with get_db() as conn:
-            if download_dir:
-                conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_download_dir', NETEASE_DOWNLOAD_DIR))
-            if api_base:
-                conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_api_base', NETEASE_API_BASE))
-            # if quality: # Removed quality processing
-            #     conn.execute("INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)", ('netease_quality', NETEASE_QUALITY))
-            conn.commit()
+        db_write(_save)
     except Exception as e:
         logger.warning(f"保存网易云配置失败: {e}")
 
@@ -1954,80 +2748,55 @@ def get_lyrics_api():
         logger.warning("歌词请求缺少title参数")
         return jsonify({'success': False})
     filename = unquote(filename) if filename else None
-    
-    # Resolve actual local path
+
+    # 定位库内歌曲
+    song_id = None
     actual_path = None
+    stored = {}
     if filename:
-        if os.path.isabs(filename) and os.path.exists(filename):
-            actual_path = filename
-        else:
-            try:
-                with get_db() as conn:
-                    # Try to find path by filename in DB
-                    row = conn.execute("SELECT path FROM songs WHERE filename=?", (os.path.basename(filename),)).fetchone()
-                    if row and os.path.exists(row['path']):
-                        actual_path = row['path']
-            except Exception as e:
-                logger.warning(f"查询歌曲路径失败: {e}")
-
-    # 1. 优先读取本地 .lrc 文件
-    lrc_path = None
-    if actual_path:
-        local_dir = os.path.dirname(actual_path)
-        base_name = os.path.splitext(os.path.basename(actual_path))[0]
-        # Check adjacent .lrc first
-        adj_lrc = os.path.join(local_dir, f"{base_name}.lrc")
-        if os.path.exists(adj_lrc): lrc_path = adj_lrc
-        else:
-             # Check lyrics folder
-             lrc_path = os.path.join(MUSIC_LIBRARY_PATH, 'lyrics', f"{base_name}.lrc")
-
-    if lrc_path and os.path.exists(lrc_path):
         try:
-            with open(lrc_path, 'r', encoding='utf-8') as f:
-                logger.info(f"本地歌词命中: {lrc_path}")
-                return jsonify({'success': True, 'lyrics': f.read()})
+            with get_db() as conn:
+                if os.path.isabs(filename):
+                    row = conn.execute("SELECT id, path FROM songs WHERE path=?", (filename,)).fetchone()
+                else:
+                    row = conn.execute("SELECT id, path FROM songs WHERE filename=?", (os.path.basename(filename),)).fetchone()
+                if row:
+                    song_id = row['id']
+                    # 1. 歌词表（扫描、刮削、下载时已入库）
+                    stored = mod.lyrics.load(conn, song_id)
+            if row and os.path.exists(row['path']):
+                actual_path = row['path']
+            elif os.path.isabs(filename) and os.path.exists(filename):
+                actual_path = filename
         except Exception as e:
-            logger.warning(f"读取本地歌词失败: {lrc_path}, 错误: {e}")
+            logger.warning(f"查询歌曲歌词失败: {e}")
+        if mod.lyrics.LRC in stored:
+            return jsonify({'success': True, 'lyrics': stored[mod.lyrics.LRC]['text']})
 
-    # 2. 尝试提取内嵌歌词
+    # 2. 本地歌词：同名 .lrc/.yrc、内嵌歌词、旧版 lyrics/ 目录
     if actual_path:
-        embedded_lrc = extract_embedded_lyrics(actual_path)
-        if embedded_lrc:
-            # Save to cache if possible
-            try:
-                # Prioritize saving to lyrics folder to avoid cluttering music dir if original is there
-                save_dir = os.path.join(MUSIC_LIBRARY_PATH, 'lyrics')
-                os.makedirs(save_dir, exist_ok=True)
-                base_name = os.path.splitext(os.path.basename(actual_path))[0]
-                save_path = os.path.join(save_dir, f"{base_name}.lrc")
-                with open(save_path, 'w', encoding='utf-8') as f:
-                    f.write(embedded_lrc)
-                logger.info(f"内嵌歌词提取并保存: {save_path}")
-            except Exception as e:
-                logger.warning(f"保存内嵌歌词失败: {e}")
-            return jsonify({'success': True, 'lyrics': embedded_lrc})
+        entries = mod.lyrics.find(actual_path, mod.tagreader.read_tags(actual_path))
+        found = {fmt for fmt, _, _ in entries}
+        entries += [entry for entry in mod.lyrics.find_local(LYRICS_DIR, actual_path) if entry[0] not in found]
+        local = {fmt: text for fmt, _, text in entries}
+        # 只补存表中还没有的格式（例如表中只有逐字或翻译歌词时），已有的不重复写入
+        missing = [(song_id, *entry) for entry in entries if entry[0] not in stored]
+        if song_id and missing:
+            db_write(mod.lyrics.store, missing)
+        if mod.lyrics.LRC in local:
+            logger.info(f"本地歌词命中: {actual_path}")
+            return jsonify({'success': True, 'lyrics': local[mod.lyrics.LRC]})
 
     # 3. 网络获取 - Use integrated LrcApi
-    # Determine save path for network lyrics
-    save_lrc_path = None
-    if actual_path:
-        base_name = os.path.splitext(os.path.basename(actual_path))[0]
-        save_lrc_path = os.path.join(MUSIC_LIBRARY_PATH, 'lyrics', f"{base_name}.lrc")
-    elif filename:
-        save_lrc_path = os.path.join(MUSIC_LIBRARY_PATH, 'lyrics', f"{os.path.splitext(os.path.basename(filename))[0]}.lrc")
-
     try:
         logger.info(f"本地调用 LrcApi 搜索歌词: title={title}, artist={artist}")
         result = mod.search_all(title=title, artist=artist, album='')
         best_lrc = result.get('lyrics') if result and result.get('lyrics') else None
         if best_lrc:
-            if save_lrc_path:
+            if song_id:
                 try:
-                    os.makedirs(os.path.dirname(save_lrc_path), exist_ok=True)
-                    with open(save_lrc_path, 'wb') as f:
-                        f.write(best_lrc.encode('utf-8'))
-                    logger.info(f"网络歌词保存: {save_lrc_path}")
+                    save_lyrics(song_id, [(mod.lyrics.LRC, best_lrc)], mod.lyrics.SCRAPED)
+                    logger.info(f"网络歌词保存: {title}")
                 except Exception as e:
                     logger.warning(f"保存网络歌词失败: {e}")
             return jsonify({'success': True, 'lyrics': best_lrc})
@@ -2039,6 +2808,16 @@ def get_lyrics_api():
     logger.warning(f"歌词获取失败: {title} - {artist}")
     return jsonify({'success': False})
 
+@app.route('/api/music/<song_id>/lyrics')
+def get_song_lyrics(song_id):
+    """按歌曲 id 读取已入库的歌词（lrc/yrc/translated），一次主键查询"""
+    with get_db() as conn:
+        stored = mod.lyrics.load(conn, song_id)
+    if not stored:
+        return jsonify({'success': False, 'error': '暂无歌词'}), 404
+    lrc = stored.get(mod.lyrics.LRC)
+    return jsonify({'success': True, 'lyrics': lrc['text'] if lrc else None, 'formats': stored})
+
 @app.route('/api/music/album-art')
 def get_album_art_api():
     title = request.args.get('title')
@@ -2047,34 +2826,33 @@ def get_album_art_api():
     
     if not title or not filename: return jsonify({'success': False})
     filename = unquote(filename)
-    base_name = os.path.splitext(os.path.basename(filename))[0]
-    
-    local_path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-    if os.path.exists(local_path):
-        return jsonify({'success': True, 'album_art': f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"})
 
-    # 优先尝试从音频内嵌封面提取
+    # 库内歌曲已有封面时直接返回
+    song_id = None
     actual_path = None
-    if os.path.isabs(filename) and os.path.exists(filename):
+    try:
+        with get_db() as conn:
+            if os.path.isabs(filename):
+                row = conn.execute("SELECT id, path FROM songs WHERE path=?", (filename,)).fetchone()
+            else:
+                row = conn.execute("SELECT id, path FROM songs WHERE filename=?", (os.path.basename(filename),)).fetchone()
+        if row:
+            cover_hash = song_cover(row['id'])
+            if cover_hash:
+                return jsonify({'success': True, 'album_art': mod.covers.url(cover_hash), 'palette': cover_palette(cover_hash)})
+            song_id = row['id']
+            if os.path.exists(row['path']):
+                actual_path = row['path']
+    except Exception as e:
+        logger.warning(f"查询歌曲路径失败: {e}")
+    if not actual_path and os.path.isabs(filename) and os.path.exists(filename):
         actual_path = filename
-    else:
-        try:
-            with get_db() as conn:
-                row = conn.execute("SELECT path FROM songs WHERE filename=?", (os.path.basename(filename),)).fetchone()
-                if row and os.path.exists(row['path']):
-                    actual_path = row['path']
-        except Exception as e:
-            logger.warning(f"查询歌曲路径失败: {e}")
 
-    if actual_path and extract_embedded_cover(actual_path, base_name):
-        try:
-            if not os.path.isabs(filename):
-                with get_db() as conn:
-                    conn.execute("UPDATE songs SET has_cover=1 WHERE filename=?", (os.path.basename(filename),))
-                    conn.commit()
-        except Exception:
-            pass
-        return jsonify({'success': True, 'album_art': f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"})
+    # 优先尝试从音频内嵌封面提取
+    if actual_path:
+        cover = extract_embedded_cover(actual_path, song_id)
+        if cover:
+            return jsonify({'success': True, 'album_art': mod.covers.url(cover.hash), 'palette': cover_palette(cover.hash)})
 
     # 网络获取并保存 - Use integrated LrcApi
     try:
@@ -2086,9 +2864,9 @@ def get_album_art_api():
             try:
                 resp = requests.get(cover_url, timeout=10, headers=COMMON_HEADERS)
                 if resp.status_code == 200 and resp.headers.get('content-type', '').startswith('image/'):
-                    with open(local_path, 'wb') as f: 
-                        f.write(resp.content)
-                    return jsonify({'success': True, 'album_art': f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"})
+                    cover = set_song_cover(song_id, resp.content) if song_id else COVERS.put(resp.content)
+                    return jsonify({'success': True, 'album_art': mod.covers.url(cover.hash),
+                                    'palette': cover_palette(cover.hash)})
                 else:
                     logger.warning(f"封面下载失败: {resp.status_code}")
             except Exception as dl_err:
@@ -2154,9 +2932,8 @@ def delete_file(song_id):
             except: pass
         
         # 4. 数据库清理 (Watchdog 也会做，但双重保障)
-        with get_db() as conn:
-            conn.execute("DELETE FROM songs WHERE path=?", (target_path,))
-            conn.commit()
+        DB.execute("DELETE FROM songs WHERE path=?", (target_path,))
+        bump_library_version()
             
         return jsonify({'success': True})
     except Exception as e: 
@@ -2215,9 +2992,12 @@ def clear_metadata(song_id=None):
 
         # 如果是库内文件（有song_id），还需要重置数据库状态
         if song_id:
-            with get_db() as conn:
-                conn.execute("UPDATE songs SET has_cover=0 WHERE id=?", (song_id,))
-                conn.commit()
+            def _clear(conn):
+                conn.execute("DELETE FROM song_covers WHERE song_id=?", (song_id,))
+                conn.execute("DELETE FROM lyrics WHERE song_id=?", (song_id,))
+                conn.execute("UPDATE songs SET has_cover=0, has_lyrics=0 WHERE id=?", (song_id,))
+            db_write(_clear)
+            bump_library_version()
             
         logger.info(f"元数据已清除: {filename}, ID: {song_id}, 删除数: {deleted_count}")
         return jsonify({'success': True})
@@ -2226,12 +3006,72 @@ def clear_metadata(song_id=None):
         return jsonify({'success': False, 'error': str(e)})
 
 # --- 辅助接口 ---
+# 封面缩略图缓存（covers/thumbs，扫描与监听均不处理 covers 目录）
+THUMBS = mod.thumbs.ThumbnailCache(os.path.join(MUSIC_LIBRARY_PATH, 'covers', 'thumbs'),
+                                   budget=max(0, args.thumb_cache_mb) * 1024 * 1024)
+COVER_MAX_AGE = 365 * 86400
+if not mod.thumbs.available():
+    logger.info("未安装 Pillow，封面接口只提供原图")
+
+def _resolve_cover(cover_name):
+    """
+    封面名 -> (文件路径, mimetype, 封面 hash, 是否不可变)，找不到时路径为 None，旧文件没有 hash
+    内容哈希直接对应封面存储；song-<id> 为歌曲当前的封面（尚未提取时在此提取）；
+    旧的 <文件名>.jpg 链接先找 covers 下的旧文件，再按 filename 参数找歌曲
+    """
+    if mod.covers.HASH_RE.match(cover_name) and COVERS.has(cover_name):
+        return COVERS.path(cover_name), COVERS.mime(cover_name), cover_name, True
+    song_id = None
+    if cover_name.startswith(mod.covers.SONG_PREFIX):
+        song_id = cover_name[len(mod.covers.SONG_PREFIX):]
+    else:
+        legacy = os.path.join(COVER_DIR, cover_name)
+        if os.path.isfile(legacy):
+            return legacy, 'image/jpeg', None, False
+        filename = request.args.get('filename')
+        if filename:
+            with get_db() as conn:
+                row = conn.execute("SELECT id FROM songs WHERE filename=? LIMIT 1", (os.path.basename(filename),)).fetchone()
+            song_id = row['id'] if row else None
+    cover_hash = song_cover(song_id) if song_id else None
+    if cover_hash:
+        return COVERS.path(cover_hash), COVERS.mime(cover_hash), cover_hash, False
+    return None, None, None, False
+
 @app.route('/api/music/covers/<cover_name>')
 def get_cover(cover_name):
+    """
+    封面图，size=64|256|512|original（其他像素值向上取档，默认原图）
+    缩略图在客户端 Accept 支持时为 WebP，否则为 JPEG；内容哈希 URL 按不可变资源长期缓存，其余（如 song-<id>）每次协商缓存
+    响应头 X-Cover-Palette 为封面调色板（逗号分隔的 #rrggbb，主色调在前）
+    """
     cover_name = unquote(cover_name)
-    path = os.path.join(MUSIC_LIBRARY_PATH, 'covers', cover_name)
-    if os.path.exists(path): return send_file(path, mimetype='image/jpeg')
-    return jsonify({'error': 'Not found'}), 404
+    if os.path.basename(cover_name) != cover_name:
+        return jsonify({'error': 'Not found'}), 404
+    path, mimetype, cover_hash, immutable = _resolve_cover(cover_name)
+    if not path:
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        size = mod.thumbs.parse_size(request.args.get('size'))
+    except ValueError:
+        return jsonify({'error': 'Invalid size'}), 400
+
+    if size:
+        fmt = mod.thumbs.WEBP if 'image/webp' in request.headers.get('Accept', '') else mod.thumbs.JPEG
+        thumb = THUMBS.get(path, size, fmt)
+        if thumb:
+            path = thumb
+            mimetype = 'image/webp' if thumb.endswith('.webp') else 'image/jpeg'
+    resp = send_file(path, mimetype=mimetype, conditional=True)
+    resp.vary.add('Accept')
+    palette = cover_palette(cover_hash) if cover_hash else None
+    if palette:
+        resp.headers['X-Cover-Palette'] = ','.join(palette)
+    if immutable:
+        resp.headers['Cache-Control'] = f'public, max-age={COVER_MAX_AGE}, immutable'
+    else:
+        resp.headers['Cache-Control'] = 'public, no-cache'
+    return resp
 
 @app.route('/api/music/upload', methods=['POST'])
 def upload_file():
@@ -2262,14 +3102,15 @@ def upload_file():
                 if exists:
                     return jsonify({'success': False, 'error': '该文件已存在于当前目录下'})
                 
-                # 全局查重 (文件名 + 大小)
-                file.seek(0, os.SEEK_END)
-                file_size = file.tell()
+            # 全局查重 (内容指纹，忽略标签差异)
+            file.seek(0, os.SEEK_END)
+            file_size = file.tell()
+            try:
+                dup_path = find_library_duplicate(*mod.dedup.fingerprint_file(file.stream, file_size))
+            finally:
                 file.seek(0)
-                
-                dup = conn.execute("SELECT path FROM songs WHERE filename=? AND size=?", (filename, file_size)).fetchone()
-                if dup:
-                    return jsonify({'success': False, 'error': f'音乐库中已存在相同文件: {dup["path"]}'})
+            if dup_path:
+                return jsonify({'success': False, 'error': f'音乐库中已存在相同文件: {dup_path}'})
 
         except Exception as e:
             logger.error(f"查重失败: {e}")
@@ -2296,15 +3137,11 @@ def import_music_by_path():
              # 目标已存在 (文件名冲突)
              pass
 
-        # 全局查重
-        src_size = os.path.getsize(src_path)
-        with get_db() as conn:
-             dup = conn.execute("SELECT path FROM songs WHERE filename=? AND size=?", (filename, src_size)).fetchone()
-             if dup:
-                 # 如果已存在的文件就是目标位置的文件（即重复导入自己），则是允许的（当作刷新）
-                 # 如果 duplicates path != dst_path -> 真正的异地重复 -> 报错
-                 if dup['path'] != os.path.abspath(dst_path):
-                     return jsonify({'success': False, 'error': f'音乐库中已存在相同文件: {dup["path"]}'})
+        # 全局查重 (内容指纹)
+        # 如果已存在的文件就是目标位置的文件（即重复导入自己），则是允许的（当作刷新）
+        dup_path = find_library_duplicate(*mod.dedup.fingerprint(src_path), exclude_path=os.path.abspath(dst_path))
+        if dup_path:
+            return jsonify({'success': False, 'error': f'音乐库中已存在相同文件: {dup_path}'})
 
         if not os.path.exists(dst_path):
             shutil.copy2(src_path, dst_path)
@@ -2359,10 +3196,8 @@ def create_favorite_playlist():
                 return jsonify({'success': False, 'error': f"已存在名为'{name}'的收藏夹"})
         
         playlist_id = f"{time.time()}_{uuid.uuid4().hex[:8]}"
-        with get_db() as conn:
-            conn.execute("INSERT INTO favorite_playlists (id, name, created_at) VALUES (?, ?, ?)", 
-                        (playlist_id, name, time.time()))
-            conn.commit()
+        DB.execute("INSERT INTO favorite_playlists (id, name, created_at) VALUES (?, ?, ?)", 
+                   (playlist_id, name, time.time()))
         logger.info(f"创建收藏夹成功: {name} (ID: {playlist_id})")
         return jsonify({'success': True, 'data': {'id': playlist_id, 'name': name}})
     except Exception as e:
@@ -2385,10 +3220,12 @@ def delete_favorite_playlist(playlist_id):
             playlist_name = conn.execute("SELECT name FROM favorite_playlists WHERE id=?", (playlist_id,)).fetchone()
             playlist_name = playlist_name['name'] if playlist_name else '未知名称'
             
+        def _delete(conn):
             # 删除收藏夹及其包含的所有收藏
             conn.execute("DELETE FROM favorites WHERE playlist_id=?", (playlist_id,))
             conn.execute("DELETE FROM favorite_playlists WHERE id=?", (playlist_id,))
-            conn.commit()
+
+        db_write(_delete)
         logger.info(f"删除收藏夹成功: {playlist_name} (ID: {playlist_id})")
         return jsonify({'success': True})
     except Exception as e:
@@ -2424,10 +3261,8 @@ def add_favorite():
             logger.warning("添加收藏失败: 歌曲ID不能为空")
             return jsonify({'success': False, 'error': "歌曲ID不能为空"})
         
-        with get_db() as conn:
-            conn.execute("INSERT OR IGNORE INTO favorites (song_id, playlist_id, title, artist, created_at) VALUES (?, ?, ?, ?, ?)", 
-                        (song_id, playlist_id, title, artist, time.time()))
-            conn.commit()
+        DB.execute("INSERT OR IGNORE INTO favorites (song_id, playlist_id, title, artist, created_at) VALUES (?, ?, ?, ?, ?)", 
+                   (song_id, playlist_id, title, artist, time.time()))
         logger.info(f"添加到收藏夹成功: 歌曲ID: {song_id} ({title} - {artist}) -> 收藏夹ID: {playlist_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -2447,9 +3282,7 @@ def remove_favorite():
             logger.warning("取消收藏失败: 歌曲ID不能为空")
             return jsonify({'success': False, 'error': "歌曲ID不能为空"})
         
-        with get_db() as conn:
-            conn.execute("DELETE FROM favorites WHERE song_id=? AND playlist_id=?", (song_id, playlist_id))
-            conn.commit()
+        DB.execute("DELETE FROM favorites WHERE song_id=? AND playlist_id=?", (song_id, playlist_id))
         logger.info(f"从收藏夹移除成功: 歌曲ID: {song_id} <- 收藏夹ID: {playlist_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -2489,29 +3322,29 @@ def batch_add_favorites():
             logger.warning("批量添加收藏失败: 收藏夹ID列表不能为空")
             return jsonify({'success': False, 'error': "收藏夹ID列表不能为空"})
         
-        successful_count = 0
-        failed_count = 0
-        
-        with get_db() as conn:
-            try:
-                # 使用事务确保原子性
-                for song_id in song_ids:
-                    for playlist_id in playlist_ids:
-                        try:
-                            song_info = songs.get(song_id, {})
-                            title = song_info.get('title', '')
-                            artist = song_info.get('artist', '')
-                            conn.execute("INSERT OR IGNORE INTO favorites (song_id, playlist_id, title, artist, created_at) VALUES (?, ?, ?, ?, ?)", 
-                                        (song_id, playlist_id, title, artist, time.time()))
-                            successful_count += 1
-                        except Exception as e:
-                            logger.warning(f"添加收藏失败: 歌曲{song_id}到收藏夹{playlist_id}: {e}")
-                            failed_count += 1
-                conn.commit()
-            except Exception as e:
-                logger.error(f"批量添加收藏事务失败: {e}")
-                conn.rollback()
-                return jsonify({'success': False, 'error': "批量添加失败，事务已回滚"})
+        def _batch_add(conn):
+            successful_count = 0
+            failed_count = 0
+            # 写任务在同一事务内执行，确保原子性
+            for song_id in song_ids:
+                for playlist_id in playlist_ids:
+                    try:
+                        song_info = songs.get(song_id, {})
+                        title = song_info.get('title', '')
+                        artist = song_info.get('artist', '')
+                        conn.execute("INSERT OR IGNORE INTO favorites (song_id, playlist_id, title, artist, created_at) VALUES (?, ?, ?, ?, ?)", 
+                                    (song_id, playlist_id, title, artist, time.time()))
+                        successful_count += 1
+                    except Exception as e:
+                        logger.warning(f"添加收藏失败: 歌曲{song_id}到收藏夹{playlist_id}: {e}")
+                        failed_count += 1
+            return successful_count, failed_count
+
+        try:
+            successful_count, failed_count = db_write(_batch_add)
+        except Exception as e:
+            logger.error(f"批量添加收藏事务失败: {e}")
+            return jsonify({'success': False, 'error': "批量添加失败，事务已回滚"})
         
         logger.info(f"批量添加歌曲成功: 成功{successful_count}条，失败{failed_count}条")
         return jsonify({'success': True, 'data': {'successful': successful_count, 'failed': failed_count}})
@@ -2536,50 +3369,49 @@ def batch_remove_favorites():
             logger.warning("批量移除收藏失败: 收藏夹ID列表不能为空")
             return jsonify({'success': False, 'error': "收藏夹ID列表不能为空"})
         
-        successful_count = 0
-        failed_count = 0
+        def _batch_remove(conn):
+            successful_count = 0
+            failed_count = 0
+            # 写任务在同一事务内执行，确保原子性
+            for song_id in song_ids:
+                for playlist_id in playlist_ids:
+                    try:
+                        # 执行DELETE
+                        cursor = conn.execute("DELETE FROM favorites WHERE song_id=? AND playlist_id=?", (song_id, playlist_id))
+                        # 检查是否真的删除了行（rowcount > 0）
+                        if cursor.rowcount > 0:
+                            successful_count += 1
+                            logger.debug(f"成功删除: 歌曲{song_id}从收藏夹{playlist_id}")
+                        else:
+                            # rowcount=0 说明没找到这个记录（可能已经被删除或不存在）
+                            logger.warning(f"记录不存在或已删除: 歌曲{song_id}在收藏夹{playlist_id}")
+                            successful_count += 1  # 视为成功（结果一致）
+                    except Exception as e:
+                        logger.warning(f"移除收藏失败: 歌曲{song_id}从收藏夹{playlist_id}: {e}")
+                        failed_count += 1
+            
+            # 数据库验证：删除后查询确认记录不存在
+            verify_failed = 0
+            for song_id in song_ids:
+                for playlist_id in playlist_ids:
+                    remaining = conn.execute(
+                        "SELECT COUNT(*) as count FROM favorites WHERE song_id=? AND playlist_id=?", 
+                        (song_id, playlist_id)
+                    ).fetchone()
+                    if remaining and remaining['count'] > 0:
+                        verify_failed += 1
+                        logger.error(f"验证失败: 歌曲{song_id}仍在收藏夹{playlist_id}中，DELETE操作未生效！")
+            return successful_count, failed_count, verify_failed
+
+        try:
+            successful_count, failed_count, verify_failed = db_write(_batch_remove)
+        except Exception as e:
+            logger.error(f"批量移除收藏事务失败: {e}")
+            return jsonify({'success': False, 'error': "批量移除失败，事务已回滚"})
         
-        with get_db() as conn:
-            try:
-                # 使用事务确保原子性
-                for song_id in song_ids:
-                    for playlist_id in playlist_ids:
-                        try:
-                            # 执行DELETE
-                            cursor = conn.execute("DELETE FROM favorites WHERE song_id=? AND playlist_id=?", (song_id, playlist_id))
-                            # 检查是否真的删除了行（rowcount > 0）
-                            if cursor.rowcount > 0:
-                                successful_count += 1
-                                logger.debug(f"成功删除: 歌曲{song_id}从收藏夹{playlist_id}")
-                            else:
-                                # rowcount=0 说明没找到这个记录（可能已经被删除或不存在）
-                                logger.warning(f"记录不存在或已删除: 歌曲{song_id}在收藏夹{playlist_id}")
-                                successful_count += 1  # 视为成功（结果一致）
-                        except Exception as e:
-                            logger.warning(f"移除收藏失败: 歌曲{song_id}从收藏夹{playlist_id}: {e}")
-                            failed_count += 1
-                conn.commit()
-                
-                # 数据库验证：删除后查询确认记录不存在
-                verify_failed = 0
-                for song_id in song_ids:
-                    for playlist_id in playlist_ids:
-                        remaining = conn.execute(
-                            "SELECT COUNT(*) as count FROM favorites WHERE song_id=? AND playlist_id=?", 
-                            (song_id, playlist_id)
-                        ).fetchone()
-                        if remaining and remaining['count'] > 0:
-                            verify_failed += 1
-                            logger.error(f"验证失败: 歌曲{song_id}仍在收藏夹{playlist_id}中，DELETE操作未生效！")
-                
-                if verify_failed > 0:
-                    logger.error(f"批量移除验证失败: {verify_failed}条记录验证失败")
-                    return jsonify({'success': False, 'error': f"移除失败，有{verify_failed}条记录删除未生效"})
-                    
-            except Exception as e:
-                logger.error(f"批量移除收藏事务失败: {e}")
-                conn.rollback()
-                return jsonify({'success': False, 'error': "批量移除失败，事务已回滚"})
+        if verify_failed > 0:
+            logger.error(f"批量移除验证失败: {verify_failed}条记录验证失败")
+            return jsonify({'success': False, 'error': f"移除失败，有{verify_failed}条记录删除未生效"})
         
         logger.info(f"批量移除歌曲成功: 成功{successful_count}条，失败{failed_count}条，验证通过")
         return jsonify({'success': True, 'data': {'successful': successful_count, 'failed': failed_count}})
@@ -2613,60 +3445,59 @@ def batch_move_favorites():
             logger.warning("批量移动收藏失败: 源收藏夹和目标收藏夹不能相同")
             return jsonify({'success': False, 'error': "源收藏夹和目标收藏夹不能相同"})
         
-        successful_count = 0
-        failed_count = 0
-        
-        with get_db() as conn:
-            try:
-                # 使用事务确保原子性
-                for song_id in song_ids:
-                    try:
-                        # 先从源收藏夹删除
-                        delete_cursor = conn.execute("DELETE FROM favorites WHERE song_id=? AND playlist_id=?", 
-                                    (song_id, from_playlist_id))
-                        # 再添加到目标收藏夹
-                        conn.execute("INSERT OR IGNORE INTO favorites (song_id, playlist_id, created_at) VALUES (?, ?, ?)", 
-                                    (song_id, to_playlist_id, time.time()))
-                        if delete_cursor.rowcount > 0:
-                            successful_count += 1
-                            logger.debug(f"成功移动: 歌曲{song_id}从{from_playlist_id}到{to_playlist_id}")
-                        else:
-                            logger.warning(f"源记录不存在: 歌曲{song_id}在{from_playlist_id}（可能已移动）")
-                            successful_count += 1  # 视为成功
-                    except Exception as e:
-                        logger.warning(f"移动收藏失败: 歌曲{song_id}从{from_playlist_id}到{to_playlist_id}: {e}")
-                        failed_count += 1
-                conn.commit()
-                
-                # 数据库验证：确保歌曲已从源移除，已添加到目标
-                verify_failed = 0
-                for song_id in song_ids:
-                    # 验证1：歌曲应该不在源收藏夹
-                    remaining_in_source = conn.execute(
-                        "SELECT COUNT(*) as count FROM favorites WHERE song_id=? AND playlist_id=?",
-                        (song_id, from_playlist_id)
-                    ).fetchone()
-                    if remaining_in_source and remaining_in_source['count'] > 0:
-                        verify_failed += 1
-                        logger.error(f"验证失败: 歌曲{song_id}仍在源收藏夹{from_playlist_id}中")
-                    
-                    # 验证2：歌曲应该在目标收藏夹
-                    in_target = conn.execute(
-                        "SELECT COUNT(*) as count FROM favorites WHERE song_id=? AND playlist_id=?",
-                        (song_id, to_playlist_id)
-                    ).fetchone()
-                    if not in_target or in_target['count'] == 0:
-                        verify_failed += 1
-                        logger.error(f"验证失败: 歌曲{song_id}未在目标收藏夹{to_playlist_id}中")
+        def _batch_move(conn):
+            successful_count = 0
+            failed_count = 0
+            # 写任务在同一事务内执行，确保原子性
+            for song_id in song_ids:
+                try:
+                    # 先从源收藏夹删除
+                    delete_cursor = conn.execute("DELETE FROM favorites WHERE song_id=? AND playlist_id=?", 
+                                (song_id, from_playlist_id))
+                    # 再添加到目标收藏夹
+                    conn.execute("INSERT OR IGNORE INTO favorites (song_id, playlist_id, created_at) VALUES (?, ?, ?)", 
+                                (song_id, to_playlist_id, time.time()))
+                    if delete_cursor.rowcount > 0:
+                        successful_count += 1
+                        logger.debug(f"成功移动: 歌曲{song_id}从{from_playlist_id}到{to_playlist_id}")
+                    else:
+                        logger.warning(f"源记录不存在: 歌曲{song_id}在{from_playlist_id}（可能已移动）")
+                        successful_count += 1  # 视为成功
+                except Exception as e:
+                    logger.warning(f"移动收藏失败: 歌曲{song_id}从{from_playlist_id}到{to_playlist_id}: {e}")
+                    failed_count += 1
+            
+            # 数据库验证：确保歌曲已从源移除，已添加到目标
+            verify_failed = 0
+            for song_id in song_ids:
+                # 验证1：歌曲应该不在源收藏夹
+                remaining_in_source = conn.execute(
+                    "SELECT COUNT(*) as count FROM favorites WHERE song_id=? AND playlist_id=?",
+                    (song_id, from_playlist_id)
+                ).fetchone()
+                if remaining_in_source and remaining_in_source['count'] > 0:
+                    verify_failed += 1
+                    logger.error(f"验证失败: 歌曲{song_id}仍在源收藏夹{from_playlist_id}中")
                 
-                if verify_failed > 0:
-                    logger.error(f"批量移动验证失败: {verify_failed}个验证点失败")
-                    return jsonify({'success': False, 'error': f"移动失败，有{verify_failed}个验证点失败"})
-                    
-            except Exception as e:
-                logger.error(f"批量移动收藏事务失败: {e}")
-                conn.rollback()
-                return jsonify({'success': False, 'error': "批量移动失败，事务已回滚"})
+                # 验证2：歌曲应该在目标收藏夹
+                in_target = conn.execute(
+                    "SELECT COUNT(*) as count FROM favorites WHERE song_id=? AND playlist_id=?",
+                    (song_id, to_playlist_id)
+                ).fetchone()
+                if not in_target or in_target['count'] == 0:
+                    verify_failed += 1
+                    logger.error(f"验证失败: 歌曲{song_id}未在目标收藏夹{to_playlist_id}中")
+            return successful_count, failed_count, verify_failed
+
+        try:
+            successful_count, failed_count, verify_failed = db_write(_batch_move)
+        except Exception as e:
+            logger.error(f"批量移动收藏事务失败: {e}")
+            return jsonify({'success': False, 'error': "批量移动失败，事务已回滚"})
+        
+        if verify_failed > 0:
+            logger.error(f"批量移动验证失败: {verify_failed}个验证点失败")
+            return jsonify({'success': False, 'error': f"移动失败，有{verify_failed}个验证点失败"})
         
         logger.info(f"批量移动歌曲成功: 成功{successful_count}条，失败{failed_count}条，验证通过")
         return jsonify({'success': True, 'data': {'successful': successful_count, 'failed': failed_count}})
@@ -2991,6 +3822,7 @@ def run_download_task(task_id, payload):
         with open(file_path, 'wb') as f:
             for chunk in dl_resp.iter_content(chunk_size=8192):
                 if chunk:
+                    mod.jobs.check_cancelled()
                     f.write(chunk)
                     downloaded += len(chunk)
                     if size > 0:
@@ -3024,11 +3856,10 @@ def run_download_task(task_id, payload):
             # Cover
             if cover_bytes: 
                 embed_cover_to_file(file_path, cover_bytes)
-                if fname:
-                    save_cover_file(cover_bytes, os.path.splitext(fname)[0])
+                save_song_cover(file_path, cover_bytes)
             
             # Lyrics
-            lrc, _ = fetch_netease_lyrics(song_id)
+            lrc, _, _ = fetch_netease_lyrics(song_id)
             if lrc:
                 embed_lyrics_to_file(file_path, lrc)
                 
@@ -3104,24 +3935,42 @@ def netease_song_detail():
         DOWNLOAD_TASKS[task_id]['status'] = 'error' # type: ignore
         DOWNLOAD_TASKS[task_id]['message'] = str(e) # type: ignore
     finally:
-        # 10分钟后清理任务状态
-        def clean_task():
-            time.sleep(600)
-            DOWNLOAD_TASKS.pop(task_id, None) # type: ignore
-        threading.Thread(target=clean_task, daemon=True).start()
+        # 结束的任务状态保留 DOWNLOAD_TASK_RETENTION 秒后清理
+        DOWNLOAD_TASKS[task_id]['finished_at'] = time.time()
+
+# 下载任务：超出并发上限的请求排队等待，不再拒绝；排队中的任务在重启后恢复
+DOWNLOAD_TASK_RETENTION = 600
+JOBS.add_pool('download', NETEASE_MAX_CONCURRENT)
+
+def _prune_download_tasks():
+    """移除结束超过 DOWNLOAD_TASK_RETENTION 秒的下载任务状态"""
+    expire = time.time() - DOWNLOAD_TASK_RETENTION
+    for task_id, task in list(DOWNLOAD_TASKS.items()):
+        if task.get('finished_at') and task['finished_at'] < expire:
+            DOWNLOAD_TASKS.pop(task_id, None)
+
+def _download_job(job, task_id, payload):
+    if task_id not in DOWNLOAD_TASKS:
+        # 重启后恢复的排队任务
+        DOWNLOAD_TASKS[task_id] = {'status': 'pending', 'progress': 0,
+                                   'title': payload.get('title', '未知'), 'artist': payload.get('artist', '未知')}
+    try:
+        run_download_task(task_id, payload)
+    except mod.jobs.JobCancelled:
+        DOWNLOAD_TASKS[task_id].update({'status': 'cancelled', 'message': '已取消', 'finished_at': time.time()})
+        raise
+
+JOBS.register('download', _download_job, 'download', persistent=True)
 
 @app.route('/api/netease/download', methods=['POST'])
 def download_netease_music():
-    """根据歌曲ID下载网易云音乐到本地库。(异步)"""
+    """根据歌曲ID下载网易云音乐到本地库。(异步，超出并发上限时排队)"""
     payload = request.json or {}
     song_id = payload.get('id')
     if not song_id:
         return jsonify({'success': False, 'error': '缺少歌曲ID'})
 
-    active = sum(1 for t in DOWNLOAD_TASKS.values() if t.get('status') in ('pending', 'preparing', 'downloading'))
-    if active >= NETEASE_MAX_CONCURRENT:
-        return jsonify({'success': False, 'error': f'并发下载已达上限 ({NETEASE_MAX_CONCURRENT})，请稍后再试'})
-    
+    _prune_download_tasks()
     task_id = f"task_{int(time.time()*1000)}_{os.urandom(4).hex()}"
     DOWNLOAD_TASKS[task_id] = {
         'status': 'pending', 
@@ -3130,7 +3979,8 @@ def download_netease_music():
         'artist': payload.get('artist', '未知')
     }
     
-    threading.Thread(target=run_download_task, args=(task_id, payload), daemon=True).start()
+    job = JOBS.submit('download', {'task_id': task_id, 'payload': payload})
+    DOWNLOAD_TASKS[task_id]['job_id'] = job.id
     return jsonify({'success': True, 'task_id': task_id})
 
 def _normalize_cover_url(url: str):
@@ -3236,6 +4086,7 @@ def run_download_task(task_id, payload):
                 with open(tmp_path, 'wb') as f:
                     for chunk in resp.iter_content(chunk_size=8192):
                         if chunk:
+                            mod.jobs.check_cancelled()
                             f.write(chunk)
                             downloaded += len(chunk)
                             if total_size > 0:
@@ -3249,28 +4100,22 @@ def run_download_task(task_id, payload):
                 except: pass
             
         # 索引文件
-        base_name_for_cover = os.path.splitext(os.path.basename(target_path))[0]
         if cover_bytes:
             embed_cover_to_file(target_path, cover_bytes)
-            save_cover_file(cover_bytes, base_name_for_cover)
         # 保存并内嵌歌词（无需登录）
-        lrc_text, yrc_text = fetch_netease_lyrics(song_id)
+        lrc_text, yrc_text, tlyric_text = fetch_netease_lyrics(song_id)
         if lrc_text:
-            try:
-                os.makedirs(LYRICS_DIR, exist_ok=True)
-                lrc_path = os.path.join(LYRICS_DIR, f"{base_name_for_cover}.lrc")
-                with open(lrc_path, 'w', encoding='utf-8') as f:
-                    f.write(lrc_text)
-            except Exception as e:
-                logger.warning(f"保存歌词失败: {e}")
             embed_lyrics_to_file(target_path, lrc_text)
-        if yrc_text:
-            try:
-                with open(os.path.join(LYRICS_DIR, f"{base_name_for_cover}.yrc"), 'w', encoding='utf-8') as f:
-                    f.write(yrc_text)
-            except Exception as e:
-                logger.warning(f"保存逐字歌词失败: {e}")
         index_single_file(target_path)
+        # 网易云歌词（含逐字与翻译）存入歌词表，覆盖扫描读到的内嵌歌词
+        try:
+            save_lyrics(generate_song_id(target_path), [(mod.lyrics.LRC, lrc_text), (mod.lyrics.YRC, yrc_text),
+                                                        (mod.lyrics.TRANSLATED, tlyric_text)], mod.lyrics.NETEASE)
+        except Exception as e:
+            logger.warning(f"保存歌词失败: {e}")
+        # 未能内嵌封面的格式也关联下载到的封面
+        if cover_bytes:
+            save_song_cover(target_path, cover_bytes)
         
         DOWNLOAD_TASKS[task_id]['status'] = 'success'
         DOWNLOAD_TASKS[task_id]['progress'] = 100
@@ -3281,14 +4126,12 @@ def run_download_task(task_id, payload):
         DOWNLOAD_TASKS[task_id]['status'] = 'error'
         DOWNLOAD_TASKS[task_id]['message'] = str(e)
     finally:
-        # 10分钟后清理任务状态
-        def clean_task():
-            time.sleep(600)
-            DOWNLOAD_TASKS.pop(task_id, None)
-        threading.Thread(target=clean_task, daemon=True).start()
+        # 结束的任务状态保留 DOWNLOAD_TASK_RETENTION 秒后清理
+        DOWNLOAD_TASKS[task_id]['finished_at'] = time.time()
 
 @app.route('/api/netease/task/<task_id>')
 def get_netease_task_status(task_id):
+    _prune_download_tasks()
     task = DOWNLOAD_TASKS.get(task_id)
     if not task:
         return jsonify({'success': False, 'error': '任务不存在'})
@@ -3299,20 +4142,19 @@ def get_external_meta():
     path = request.args.get('path')
     if not path or not os.path.exists(path): return jsonify({'success': False, 'error': '文件未找到'})
     try:
-        meta = get_metadata(path)
+        meta = mod.tagreader.read_tags(path)
         song_id = generate_song_id(path)
         album_art = None
-        base_name = os.path.splitext(os.path.basename(path))[0]
-        cached_cover = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-        cached_cover = os.path.join(MUSIC_LIBRARY_PATH, 'covers', f"{base_name}.jpg")
-        if os.path.exists(cached_cover): album_art = f"/api/music/covers/{quote(base_name)}.jpg?filename={quote(base_name)}"
+        # 同一次解析中已取得内嵌封面，按内容存入封面存储（已存在时不再写入）
+        if meta.cover:
+            album_art = mod.covers.url(COVERS.put(meta.cover).hash)
         
         in_library = False
         with get_db() as conn:
              if conn.execute("SELECT 1 FROM songs WHERE id=?", (song_id,)).fetchone():
                  in_library = True
 
-        return jsonify({'success': True, 'data': {'id': song_id, 'filename': path, 'title': meta['title'] or os.path.basename(path), 'artist': meta['artist'] or '未知艺术家', 'album': meta['album'] or '', 'album_art': album_art, 'in_library': in_library}})
+        return jsonify({'success': True, 'data': {'id': song_id, 'filename': path, 'title': meta.title or os.path.basename(path), 'artist': meta.artist or '未知艺术家', 'album': meta.album or '', 'album_art': album_art, 'in_library': in_library}})
     except Exception as e: return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/music/external/play')
@@ -3322,92 +4164,101 @@ def play_external_file():
     return jsonify({'error': '文件未找到'}), 404
 
 # --- 安装状态管理 ---
-INSTALL_STATUS = {
+INSTALL_STATUS = mod.events.ObservableDict(EVENTS, 'install', {
     'status': 'idle', # idle, running, success, error
     'progress': 0,
     'step': '',
     'error': None
-}
+})
 
 @app.route('/api/netease/install/status')
 def get_install_status():
     return jsonify(INSTALL_STATUS)
 
+def run_netease_install(job):
+    """安装任务：拉取并启动网易云 API 容器，进度写入 INSTALL_STATUS"""
+    import subprocess
+
+    try:
+        # 1. 检查 Docker 是否可用
+        INSTALL_STATUS.update({'progress': 10, 'step': '检查 Docker 环境...'})
+        subprocess.run(["docker", "--version"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # 2. 检查由我们创建的容器是否已存在
+        container_name = "2fmusic-ncm-api"
+        INSTALL_STATUS.update({'progress': 20, 'step': f'检查容器 {container_name}...'})
+
+        check_proc = subprocess.run(
+            ["docker", "ps", "-a", "--filter", f"name={container_name}", "--format", "{{.Names}}"],
+            capture_output=True, text=True
+        )
+
+        if container_name in check_proc.stdout.strip():
+            # 容器已存在，尝试启动
+            INSTALL_STATUS.update({'progress': 60, 'step': '容器已存在，正在启动...'})
+            logger.info("容器已存在，尝试启动...")
+            subprocess.run(["docker", "start", container_name], check=True)
+        else:
+            # 容器不存在，拉取并运行
+            INSTALL_STATUS.update({'progress': 30, 'step': '正在拉取镜像 (耗时较长)...'})
+            logger.info("正在拉取镜像 moefurina/ncm-api...")
+            subprocess.run(["docker", "pull", "moefurina/ncm-api:latest"], check=True)
+
+            INSTALL_STATUS.update({'progress': 70, 'step': '镜像拉取完成，正在启动容器...'})
+            logger.info("正在启动容器...")
+            # 映射端口 23236:3000
+            subprocess.run([
+                "docker", "run", "-d", 
+                "-p", "23236:3000", 
+                "--name", container_name, 
+                "--restart", "always",
+                "moefurina/ncm-api"
+            ], check=True)
+
+        INSTALL_STATUS.update({'status': 'success', 'progress': 100, 'step': '服务启动成功！'})
+        logger.info("网易云服务安装/启动指令执行完成")
+
+    except subprocess.CalledProcessError as e:
+        msg = f"操作失败: {e}"
+        logger.error(msg)
+        INSTALL_STATUS.update({'status': 'error', 'error': msg, 'step': '发生错误'})
+    except FileNotFoundError:
+        msg = "未找到 Docker，请确保已安装 Docker Desktop"
+        logger.error(msg)
+        INSTALL_STATUS.update({'status': 'error', 'error': msg, 'step': '环境缺失'})
+    except Exception as e:
+        msg = f"未知错误: {str(e)}"
+        logger.exception(msg)
+        INSTALL_STATUS.update({'status': 'error', 'error': msg, 'step': '系统异常'})
+
+JOBS.register('install', run_netease_install, 'system')
+
 @app.route('/api/netease/install_service', methods=['POST'])
 def install_netease_service():
     """尝试自动拉取并运行网易云 API 容器"""
-    import subprocess
-    global INSTALL_STATUS
-    
     if INSTALL_STATUS['status'] == 'running':
          return jsonify({'success': False, 'error': '安装任务正在进行中'})
 
-    INSTALL_STATUS = {'status': 'running', 'progress': 0, 'step': '准备安装...', 'error': None}
+    INSTALL_STATUS.replace({'status': 'running', 'progress': 0, 'step': '准备安装...', 'error': None})
     logger.info("API请求: 安装网易云服务")
     
-    def run_install():
-        global INSTALL_STATUS
-        try:
-            # 1. 检查 Docker 是否可用
-            INSTALL_STATUS.update({'progress': 10, 'step': '检查 Docker 环境...'})
-            subprocess.run(["docker", "--version"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
-            # 2. 检查由我们创建的容器是否已存在
-            container_name = "2fmusic-ncm-api"
-            INSTALL_STATUS.update({'progress': 20, 'step': f'检查容器 {container_name}...'})
-            
-            check_proc = subprocess.run(
-                ["docker", "ps", "-a", "--filter", f"name={container_name}", "--format", "{{.Names}}"],
-                capture_output=True, text=True
-            )
-            
-            if container_name in check_proc.stdout.strip():
-                # 容器已存在，尝试启动
-                INSTALL_STATUS.update({'progress': 60, 'step': '容器已存在，正在启动...'})
-                logger.info("容器已存在，尝试启动...")
-                subprocess.run(["docker", "start", container_name], check=True)
-            else:
-                # 容器不存在，拉取并运行
-                INSTALL_STATUS.update({'progress': 30, 'step': '正在拉取镜像 (耗时较长)...'})
-                logger.info("正在拉取镜像 moefurina/ncm-api...")
-                subprocess.run(["docker", "pull", "moefurina/ncm-api:latest"], check=True)
-                
-                INSTALL_STATUS.update({'progress': 70, 'step': '镜像拉取完成，正在启动容器...'})
-                logger.info("正在启动容器...")
-                # 映射端口 23236:3000
-                subprocess.run([
-                    "docker", "run", "-d", 
-                    "-p", "23236:3000", 
-                    "--name", container_name, 
-                    "--restart", "always",
-                    "moefurina/ncm-api"
-                ], check=True)
-            
-            INSTALL_STATUS.update({'status': 'success', 'progress': 100, 'step': '服务启动成功！'})
-            logger.info("网易云服务安装/启动指令执行完成")
-            
-        except subprocess.CalledProcessError as e:
-            msg = f"操作失败: {e}"
-            logger.error(msg)
-            INSTALL_STATUS.update({'status': 'error', 'error': msg, 'step': '发生错误'})
-        except FileNotFoundError:
-            msg = "未找到 Docker，请确保已安装 Docker Desktop"
-            logger.error(msg)
-            INSTALL_STATUS.update({'status': 'error', 'error': msg, 'step': '环境缺失'})
-        except Exception as e:
-            msg = f"未知错误: {str(e)}"
-            logger.exception(msg)
-            INSTALL_STATUS.update({'status': 'error', 'error': msg, 'step': '系统异常'})
-
-    # 异步执行，避免阻塞
-    threading.Thread(target=run_install, daemon=True).start()
+    JOBS.submit('install', key='')
     
     return jsonify({'success': True, 'message': '安装任务已启动'})
 
+# 解析子进程须在启动任何后台线程之前 fork（见 mod.extractor），之后各次扫描共用
+if SCAN_MODE == 'process':
+    mod.extractor.start_process_pool(SCAN_WORKERS)
+
+# 数据库初始化只在此执行一次，且先于任何会访问数据库的后台线程（损坏重建时会替换全局 DB）
+init_db()
+
+# 所有任务类型注册完成后再启动任务引擎（恢复的任务需要对应的处理函数）
+threading.Thread(target=start_background_jobs, daemon=True).start()
+
 if __name__ == '__main__':
     logger.info(f"服务启动，端口: {args.port} ...")
     try:
-        init_db()
         app.run(host='0.0.0.0', port=args.port, threaded=True, use_reloader=False)
     except Exception as e:
         logger.exception(f"服务启动失败: {e}")
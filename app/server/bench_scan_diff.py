@@ -0,0 +1,124 @@
+"""
+扫描比对内存基准：归并比对 (mod.libdiff) 与 全量字典比对 的峰值内存/耗时随曲库规模的变化
+
+用法: python bench_scan_diff.py [--sizes 10000 50000 200000] [--dir /tmp/2fmusic-bench]
+
+每个规模生成一个由空文件组成的目录树与对应的 songs 表（约 5% 新增、5% 变更、5% 删除），
+每种比对方式在独立子进程中运行，峰值 RSS 取自 getrusage（Linux 下单位为 KB）。
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+
+FILES_PER_DIR = 200
+
+
+def build(root, db_path, count):
+    """生成 count 个文件的目录树与数据库"""
+    if os.path.exists(os.path.join(root, '.done')):
+        return
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE IF EXISTS songs")
+    conn.execute("CREATE TABLE songs (id TEXT PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER)")
+    rows = []
+    for i in range(count):
+        d = os.path.join(root, f"artist{i // (FILES_PER_DIR * 50):04d}", f"album{i // FILES_PER_DIR:05d}")
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(d, exist_ok=True)
+        path = os.path.join(d, f"Artist - Track {i:07d}.mp3")
+        if i % 20 == 1:
+            # 数据库中有、磁盘上已删除
+            rows.append((str(i), path, 0.0, 0))
+            continue
+        with open(path, 'wb'):
+            pass
+        st = os.stat(path)
+        if i % 20 == 2:
+            continue  # 磁盘上新增
+        mtime = st.st_mtime - 1 if i % 20 == 3 else st.st_mtime  # 变更
+        rows.append((str(i), path, mtime, st.st_size))
+    conn.executemany("INSERT INTO songs VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    open(os.path.join(root, '.done'), 'w').close()
+
+
+def run(method, root, db_path):
+    from mod import libdiff, walker
+
+    start = time.time()
+    counts = {'insert': 0, 'update': 0, 'delete': 0}
+    files = walker.Walker(('.mp3',))
+    conn = sqlite3.connect(db_path)
+    if method == 'merge':
+        for change in libdiff.diff(conn, files, [root]):
+            counts[change.op] += 1
+    else:
+        # 改造前的做法：整表读入字典，遍历时收集已见路径，最后做集合差
+        db_rows = {path: (mtime, size) for path, mtime, size in conn.execute("SELECT path, mtime, size FROM songs")}
+        seen = set()
+        for info in files.iter_files([root]):
+            seen.add(info.path)
+            rec = db_rows.get(info.path)
+            if not rec:
+                counts['insert'] += 1
+            elif rec[0] != info.mtime or rec[1] != info.size:
+                counts['update'] += 1
+        counts['delete'] = len(set(db_rows) - seen)
+    print(json.dumps({
+        'seconds': round(time.time() - start, 2),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        **counts,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='2FMusic scan diff benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument('--dir', default='/tmp/2fmusic-bench')
+    parser.add_argument('--run', choices=['merge', 'dict'], help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run, args.root, args.db)
+        return
+
+    # 只导入依赖的空进程，作为 RSS 基线
+    baseline = subprocess.run([sys.executable, '-c',
+                               f"import sys, resource; sys.path.insert(0, {os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')!r}); "
+                               "sys.path.insert(0, '.'); from mod import libdiff; "
+                               "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"],
+                              capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    print(f"基线 (仅导入): {int(baseline.stdout.strip() or 0) // 1024} MB")
+    print(f"{'文件数':>10} {'方式':>6} {'峰值RSS(MB)':>12} {'耗时(s)':>8} {'新增':>8} {'变更':>8} {'删除':>8}")
+    for size in args.sizes:
+        root = os.path.join(args.dir, f"lib{size}")
+        db_path = os.path.join(args.dir, f"lib{size}.db")
+        os.makedirs(args.dir, exist_ok=True)
+        build(root, db_path, size)
+        for method in ('merge', 'dict'):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', method, '--root', root, '--db', db_path],
+                                 capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if out.returncode != 0:
+                print(out.stderr)
+                continue
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{size:>10} {method:>6} {r['peak_rss_kb'] / 1024:>12.1f} {r['seconds']:>8} "
+                  f"{r['insert']:>8} {r['update']:>8} {r['delete']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,19 @@
 from . import searchx
 from . import search_util
-search_all = search_util.search_song_best
\ No newline at end of file
+from . import catalog
+from . import covers
+from . import db
+from . import dedup
+from . import events
+from . import extractor
+from . import jobs
+from . import libdiff
+from . import libsearch
+from . import lyrics
+from . import roots
+from . import schema
+from . import tagreader
+from . import thumbs
+from . import walker
+from . import watcher
+search_all = search_util.search_song_best
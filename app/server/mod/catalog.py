@@ -0,0 +1,138 @@
+"""
+歌手/专辑归类索引
+
+songs 写入时由触发器同步 artists / albums 及关联表 song_artists / album_songs，
+多歌手字符串按 textcompare 的歌手分隔符拆分（不按空格拆分，避免 "Taylor Swift" 被拆开）。
+专辑以 (专辑名, 第一歌手) 区分，歌手/专辑名比较不区分大小写。
+"""
+
+import json
+
+from mod.textcompare import ARTIST_DELIMITERS, split_artists
+
+# 注册到 SQLite 连接上的函数名（触发器中使用）
+SPLIT_FUNCTION = 'split_artists_json'
+PRIMARY_FUNCTION = 'primary_artist'
+
+INDEX_DELIMITERS = [d for d in ARTIST_DELIMITERS if d != ' ']
+
+
+def artist_names(text) -> list:
+    """拆分歌手字符串，忽略大小写去重并保持顺序"""
+    names, seen = [], set()
+    for name in split_artists(str(text or ''), INDEX_DELIMITERS):
+        key = name.casefold()
+        if key not in seen:
+            seen.add(key)
+            names.append(name)
+    return names
+
+
+def split_artists_json(text) -> str:
+    return json.dumps(artist_names(text), ensure_ascii=False)
+
+
+def primary_artist(text) -> str:
+    names = artist_names(text)
+    return names[0] if names else ''
+
+
+def _link_sql(row):
+    """将 row (new/old) 对应歌曲挂到歌手/专辑并累加计数"""
+    return f'''
+        INSERT OR IGNORE INTO artists (name) SELECT value FROM json_each({SPLIT_FUNCTION}({row}.artist));
+        INSERT OR IGNORE INTO song_artists (song_id, artist_id, position)
+            SELECT {row}.id, a.id, j.key FROM json_each({SPLIT_FUNCTION}({row}.artist)) j JOIN artists a ON a.name = j.value;
+        UPDATE artists SET song_count = song_count + 1
+            WHERE id IN (SELECT artist_id FROM song_artists WHERE song_id = {row}.id);
+        INSERT OR IGNORE INTO albums (title, artist)
+            SELECT {row}.album, {PRIMARY_FUNCTION}({row}.artist) WHERE IFNULL({row}.album, '') <> '';
+        INSERT OR IGNORE INTO album_songs (song_id, album_id)
+            SELECT {row}.id, id FROM albums WHERE title = {row}.album AND artist = {PRIMARY_FUNCTION}({row}.artist);
+        UPDATE albums SET song_count = song_count + 1
+            WHERE id = (SELECT album_id FROM album_songs WHERE song_id = {row}.id);
+    '''
+
+
+def _unlink_sql(row):
+    """解除 row 对应歌曲的关联，计数归零的歌手/专辑随之删除"""
+    return f'''
+        UPDATE artists SET song_count = song_count - 1
+            WHERE id IN (SELECT artist_id FROM song_artists WHERE song_id = {row}.id);
+        DELETE FROM song_artists WHERE song_id = {row}.id;
+        DELETE FROM artists WHERE song_count <= 0;
+        UPDATE albums SET song_count = song_count - 1
+            WHERE id = (SELECT album_id FROM album_songs WHERE song_id = {row}.id);
+        DELETE FROM album_songs WHERE song_id = {row}.id;
+        DELETE FROM albums WHERE song_count <= 0;
+    '''
+
+
+def create_tables(conn):
+    """创建归类表、同步触发器并根据现有 songs 填充"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS artists (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL COLLATE NOCASE UNIQUE,
+            song_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS albums (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL COLLATE NOCASE,
+            artist TEXT NOT NULL COLLATE NOCASE,
+            song_count INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (title, artist)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS song_artists (
+            song_id TEXT NOT NULL,
+            artist_id INTEGER NOT NULL,
+            position INTEGER DEFAULT 0,
+            PRIMARY KEY (song_id, artist_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS album_songs (
+            song_id TEXT PRIMARY KEY,
+            album_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_song_artists_artist ON song_artists (artist_id, song_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_album_songs_album ON album_songs (album_id, song_id)")
+    # 删除计数归零的行时走索引，避免每次删除歌曲都扫描整张表
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_artists_count ON artists (song_count)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_albums_count ON albums (song_count)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_albums_artist ON albums (artist)")
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_catalog_ai AFTER INSERT ON songs BEGIN {_link_sql('new')} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_catalog_ad AFTER DELETE ON songs BEGIN {_unlink_sql('old')} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_catalog_au AFTER UPDATE OF artist, album ON songs
+        WHEN old.artist IS NOT new.artist OR old.album IS NOT new.album
+        BEGIN {_unlink_sql('old')} {_link_sql('new')} END
+    ''')
+
+    # 填充现有数据
+    conn.execute(f'''
+        INSERT OR IGNORE INTO artists (name)
+        SELECT j.value FROM songs s, json_each({SPLIT_FUNCTION}(s.artist)) j
+    ''')
+    conn.execute(f'''
+        INSERT OR IGNORE INTO song_artists (song_id, artist_id, position)
+        SELECT s.id, a.id, j.key FROM songs s, json_each({SPLIT_FUNCTION}(s.artist)) j JOIN artists a ON a.name = j.value
+    ''')
+    conn.execute(f'''
+        INSERT OR IGNORE INTO albums (title, artist)
+        SELECT album, {PRIMARY_FUNCTION}(artist) FROM songs WHERE IFNULL(album, '') <> ''
+    ''')
+    conn.execute(f'''
+        INSERT OR IGNORE INTO album_songs (song_id, album_id)
+        SELECT s.id, al.id FROM songs s JOIN albums al ON al.title = s.album AND al.artist = {PRIMARY_FUNCTION}(s.artist)
+    ''')
+    conn.execute("UPDATE artists SET song_count = (SELECT COUNT(*) FROM song_artists WHERE artist_id = artists.id)")
+    conn.execute("UPDATE albums SET song_count = (SELECT COUNT(*) FROM album_songs WHERE album_id = albums.id)")
+    conn.execute("DELETE FROM artists WHERE song_count <= 0")
+    conn.execute("DELETE FROM albums WHERE song_count <= 0")
@@ -0,0 +1,229 @@
+"""
+内容寻址的封面存储
+
+封面按内容哈希保存为 covers/store/<hash[:2]>/<hash>，同一专辑各曲目相同的内嵌封面只存一份，
+不同目录下同名文件的封面也不会互相覆盖。歌曲与封面的对应关系记录在 song_covers 表，
+covers 表记录每个封面的格式与大小（无引用的封面由 gc 清理）。
+
+封面 URL 为 /api/music/covers/<hash>，内容不变则 URL 不变，可长期缓存。
+扫描时只记录封面位置（songs.cover_source），尚未提取的封面 URL 为 /api/music/covers/song-<song_id>，
+首次请求时提取入库。
+
+每个封面的调色板（主色调在前）只计算一次，随 covers 记录保存，客户端无需解码图片即可设置主题色。
+调色板依赖 Pillow；未安装时为空，由后台任务在安装后补齐。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import NamedTuple, Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = 'store'  # covers/ 下的子目录
+SONG_PREFIX = 'song-'  # 按歌曲 id 访问（尚未提取）的封面名前缀
+HASH_RE = re.compile(r'^[0-9a-f]{32}$')
+# 最近写入/命中的封面（可能尚未关联到歌曲）不会被 gc 清理
+GC_GRACE = 3600
+
+PALETTE_SIZE = 5
+PALETTE_SAMPLE = 64  # 取色前缩小到的边长
+
+# 来源：embedded = 音频内嵌，file = 音频旁的同名图片，scraped = 刮削/下载所得
+EMBEDDED = 'embedded'
+FILE = 'file'
+SCRAPED = 'scraped'
+
+
+class Cover(NamedTuple):
+    hash: str
+    mime: str
+    size: int
+    palette: Optional[str] = None  # encode_palette() 的结果，未计算时为 None
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def sniff_mime(head: bytes) -> str:
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'image/jpeg'
+
+
+def extract_palette(path, count=PALETTE_SIZE):
+    """
+    缩小后按中位切分量化出 count 种颜色，按像素占比从高到低返回 ['#rrggbb', ...]
+    未安装 Pillow 时返回 None，图片无法解析时返回 []
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            img.draft('RGB', (PALETTE_SAMPLE, PALETTE_SAMPLE))
+            img = img.convert('RGB')
+            img.thumbnail((PALETTE_SAMPLE, PALETTE_SAMPLE))
+            quantized = img.quantize(colors=count, method=Image.Quantize.MEDIANCUT)
+        colors = quantized.getpalette()
+        return ['#%02x%02x%02x' % tuple(colors[index * 3:index * 3 + 3])
+                for _, index in sorted(quantized.getcolors(), reverse=True)]
+    except Exception as e:
+        logger.warning(f"提取封面调色板失败: {path} ({e})")
+        return []
+
+
+def encode_palette(palette):
+    return json.dumps(palette) if palette is not None else None
+
+
+def decode_palette(value):
+    """数据库中的调色板 -> 颜色列表，未计算或为空时返回 None"""
+    return (json.loads(value) or None) if value else None
+
+
+def url(cover_hash):
+    return f"/api/music/covers/{cover_hash}" if cover_hash else None
+
+
+def song_url(song_id):
+    return f"/api/music/covers/{SONG_PREFIX}{song_id}"
+
+
+class CoverStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, cover_hash) -> str:
+        return os.path.join(self.root, cover_hash[:2], cover_hash)
+
+    def has(self, cover_hash) -> bool:
+        return os.path.exists(self.path(cover_hash))
+
+    def put(self, data: bytes) -> Cover:
+        """保存封面（已存在相同内容时不再写入），返回 Cover"""
+        cover = Cover(content_hash(data), sniff_mime(data[:12]), len(data))
+        path = self.path(cover.hash)
+        try:
+            # 已存在：只刷新 mtime，关联到歌曲前不会被 gc 当作无引用删除
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return cover
+
+    def put_file(self, source) -> Cover:
+        with open(source, 'rb') as f:
+            return self.put(f.read())
+
+    def mime(self, cover_hash) -> str:
+        with open(self.path(cover_hash), 'rb') as f:
+            return sniff_mime(f.read(12))
+
+    def iter_hashes(self):
+        """(hash, mtime)；跳过写入中的临时文件"""
+        try:
+            shards = os.scandir(self.root)
+        except FileNotFoundError:
+            return
+        with shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as it:
+                    for entry in it:
+                        if HASH_RE.match(entry.name):
+                            yield entry.name, entry.stat().st_mtime
+
+
+def create_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS covers (
+            hash TEXT PRIMARY KEY,
+            mime TEXT,
+            size INTEGER,
+            created_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS song_covers (
+            song_id TEXT PRIMARY KEY,
+            cover_hash TEXT NOT NULL,
+            source TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_song_covers_hash ON song_covers (cover_hash)")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS songs_covers_ad AFTER DELETE ON songs BEGIN "
+                 "DELETE FROM song_covers WHERE song_id = old.id; END")
+
+
+def link(conn, links):
+    """
+    在写事务中关联歌曲与封面
+
+    :param links: (song_id, Cover, source) 序列
+    """
+    now = time.time()
+    conn.executemany('''
+        INSERT INTO covers (hash, mime, size, created_at, palette) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(hash) DO UPDATE SET palette = IFNULL(covers.palette, excluded.palette)
+    ''', [(cover.hash, cover.mime, cover.size, now, cover.palette) for _, cover, _ in links])
+    conn.executemany('''
+        INSERT INTO song_covers (song_id, cover_hash, source) VALUES (?, ?, ?)
+        ON CONFLICT(song_id) DO UPDATE SET cover_hash=excluded.cover_hash, source=excluded.source
+    ''', [(song_id, cover.hash, source) for song_id, cover, source in links])
+
+
+def gc(store, referenced, grace=GC_GRACE):
+    """删除不在 referenced（被 song_covers 引用的 hash 集合）中的封面文件，返回删除数"""
+    cutoff = time.time() - grace
+    removed = 0
+    for cover_hash, mtime in list(store.iter_hashes()):
+        if cover_hash not in referenced and mtime < cutoff:
+            try:
+                os.remove(store.path(cover_hash))
+                removed += 1
+            except OSError as e:
+                logger.warning(f"删除封面失败: {cover_hash} ({e})")
+    return removed
+
+
+class SingleFlight:
+    """同一 key 的并发调用只执行一次，其余调用等待并共享结果（执行出错时等待方得到 None）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> [Event, 结果]
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = [threading.Event(), None]
+        if not leader:
+            call[0].wait()
+            return call[1]
+        try:
+            call[1] = fn()
+            return call[1]
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call[0].set()
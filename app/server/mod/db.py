@@ -0,0 +1,331 @@
+"""
+SQLite 连接管理
+
+- 读：连接池（WAL 模式下读不会被写阻塞），通过 with 语句借出/归还
+- 写：单一写线程串行执行写任务，队列中积压的任务合并到同一事务提交（每个任务独立 SAVEPOINT）
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# 连接级 PRAGMA（journal_mode 由写连接设置，WAL 为持久化属性）
+DEFAULT_PRAGMAS = (
+    ('synchronous', 'NORMAL'),      # WAL 下 NORMAL 已足够安全
+    ('cache_size', -16000),         # 约 16MB 页缓存
+    ('mmap_size', 268435456),       # 256MB 内存映射读
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 30000),
+)
+
+
+class _PooledConnection:
+    """with 语句包装：进入时借出连接，退出时归还连接池。"""
+
+    def __init__(self, database):
+        self._database = database
+        self._conn = None
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._conn = self._database._acquire()
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._database._release(conn)
+        return False
+
+
+class Database:
+    """
+    SQLite 数据库访问入口
+
+    :param path: 数据库文件路径
+    :param pool_size: 读连接池上限（超出部分用完即关闭）
+    :param batch_size: 写线程单次事务最多合并的写任务数
+    """
+
+    def __init__(self, path: str, pool_size: int = 8, batch_size: int = 64, pragmas=DEFAULT_PRAGMAS):
+        self.path = path
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.pragmas = tuple(pragmas)
+        self._functions = {}
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._write_queue = queue.Queue()
+        self._writer = None
+        self._writer_conn = None
+        self._writer_error = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
+
+    # --- 连接 ---
+    def create_function(self, name: str, num_params: int, func, deterministic: bool = True):
+        """注册自定义 SQL 函数，对之后创建的所有连接生效（应在首次使用前调用）。"""
+        self._functions[name] = (num_params, func, deterministic)
+
+    def _connect(self, writer: bool = False) -> sqlite3.Connection:
+        # 写连接使用自动提交模式，由写线程显式管理 BEGIN/COMMIT
+        conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False,
+                               isolation_level=None if writer else '')
+        conn.row_factory = sqlite3.Row
+        if writer:
+            conn.execute("PRAGMA journal_mode=WAL")
+        for key, value in self.pragmas:
+            conn.execute(f"PRAGMA {key}={value}")
+        if not writer:
+            # 读连接禁止写入，所有写操作必须经过写队列
+            conn.execute("PRAGMA query_only=ON")
+        for name, (num_params, func, deterministic) in self._functions.items():
+            conn.create_function(name, num_params, func, deterministic=deterministic)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def connection(self) -> _PooledConnection:
+        """借出只读连接：with db.connection() as conn: ..."""
+        return _PooledConnection(self)
+
+    # --- 写队列 ---
+    def _ensure_writer(self):
+        # 调用方须持有 _writer_lock
+        if self._writer and self._writer.is_alive():
+            return
+        ready = threading.Event()
+        self._writer_error = None
+        self._writer = threading.Thread(target=self._writer_loop, args=(ready,), name='db-writer', daemon=True)
+        self._writer.start()
+        ready.wait()
+        if self._writer_error is not None:
+            # 写连接创建失败时写线程已退出，直接报错而不是让任务留在无人处理的队列里；
+            # 下次提交会重新尝试创建写线程
+            error, self._writer_error = self._writer_error, None
+            raise error
+
+    def _writer_loop(self, ready: threading.Event):
+        try:
+            self._writer_conn = self._connect(writer=True)
+        except Exception as e:
+            logger.error(f"数据库写连接创建失败: {e}")
+            self._writer_conn = None
+            self._writer_error = e
+            ready.set()
+            return
+        ready.set()
+        conn = self._writer_conn
+        try:
+            while True:
+                item = self._write_queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                stop = False
+                while len(batch) < self.batch_size:
+                    try:
+                        nxt = self._write_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is None:
+                        stop = True
+                        break
+                    batch.append(nxt)
+                self._run_batch(conn, batch)
+                if stop:
+                    break
+        except BaseException as e:
+            # 事务控制语句本身失败（连接损坏等）：放弃当前连接，队列中尚未执行的任务全部报错，
+            # 下次提交时重新创建写线程与连接
+            logger.error(f"数据库写线程异常退出: {e}")
+            with self._writer_lock:
+                self._writer = None
+                self._fail_pending(e)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self._writer_conn = None
+
+    def _fail_pending(self, error: BaseException):
+        while True:
+            try:
+                item = self._write_queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                future = item[3]
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(error)
+
+    def _run_batch(self, conn: sqlite3.Connection, batch):
+        """在同一事务内依次执行写任务；单个任务失败只回滚自身的 SAVEPOINT。"""
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for _, _, _, future in batch:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            return
+        try:
+            for fn, args, kwargs, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    result = fn(conn, *args, **kwargs)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((future, result, None))
+        except BaseException as e:
+            # SAVEPOINT / ROLLBACK TO / RELEASE 失败时整个事务作废：回滚并让本批所有未完成的任务报错
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            for _, _, _, future in batch:
+                if future.done():
+                    continue
+                if future.running() or future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            raise
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"数据库事务提交失败: {e}")
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            outcomes = [(future, None, err or e) for future, _, err in outcomes]
+        # 提交之后再通知调用方，保证返回时改动已对读连接可见
+        for future, result, err in outcomes:
+            if err is not None:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """提交写任务 fn(conn, *args, **kwargs)，返回 Future。任务内不要调用 commit/rollback。"""
+        if self._closed:
+            raise sqlite3.ProgrammingError('数据库已关闭')
+        future = Future()
+        if threading.current_thread() is self._writer:
+            # 写线程内嵌套调用：直接在当前事务中执行
+            future.set_running_or_notify_cancel()
+            conn = self._writer_conn
+            try:
+                conn.execute("SAVEPOINT nested_job")
+                try:
+                    result = fn(conn, *args, **kwargs)
+                except BaseException:
+                    conn.execute("ROLLBACK TO nested_job")
+                    conn.execute("RELEASE nested_job")
+                    raise
+                conn.execute("RELEASE nested_job")
+            except BaseException as e:
+                # 包括 SAVEPOINT 语句本身失败：始终让 Future 得到结果，由外层任务决定如何处理
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            return future
+        # 加锁保证入队时写线程仍在运行：写线程异常退出时在同一把锁下清空队列
+        with self._writer_lock:
+            self._ensure_writer()
+            self._write_queue.put((fn, args, kwargs, future))
+        return future
+
+    def write(self, fn, *args, **kwargs):
+        """同步执行写任务并返回其结果（异常原样抛出）。"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def execute(self, sql: str, params=()) -> int:
+        """执行单条写语句，返回受影响行数。"""
+        return self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    def executemany(self, sql: str, seq_of_params) -> int:
+        seq_of_params = list(seq_of_params)
+        return self.write(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    # --- 结构迁移 ---
+    def schema_version(self) -> int:
+        with self.connection() as conn:
+            try:
+                row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+            except sqlite3.OperationalError:
+                return 0
+        return row[0] or 0
+
+    def migrate(self, migrations) -> int:
+        """
+        按版本号顺序执行尚未应用的迁移步骤，每个步骤在独立事务中完成
+
+        :param migrations: [(version, name, step(conn)), ...]
+        :return: 迁移后的结构版本
+        """
+        def _ensure_table(conn):
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT,
+                    applied_at REAL
+                )
+            ''')
+
+        def _apply(conn, version, name, step):
+            row = conn.execute("SELECT 1 FROM schema_version WHERE version=?", (version,)).fetchone()
+            if row:
+                return False
+            step(conn)
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                         (version, name, time.time()))
+            return True
+
+        self.write(_ensure_table)
+        for version, name, step in sorted(migrations, key=lambda m: m[0]):
+            if self.write(_apply, version, name, step):
+                logger.info(f"数据库结构迁移完成: v{version} {name}")
+        return self.schema_version()
+
+    def close(self):
+        """停止写线程并关闭所有连接。"""
+        self._closed = True
+        writer = self._writer
+        if writer and writer.is_alive():
+            self._write_queue.put(None)
+            if threading.current_thread() is not writer:
+                writer.join(timeout=10)
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,243 @@
+"""
+重复文件识别
+
+内容指纹为 (音频数据长度, 音频数据首尾各 HASH_BYTES 字节的哈希)：跳过 ID3v2/ID3v1/APEv2 标签与
+FLAC 元数据块，WAV 只取 data 块、MP4 只取 mdat 原子，只改了标签/封面的同一音频仍判为重复。
+其他格式按整个文件计算。
+
+- songs.audio_size / songs.content_hash 在扫描解析时写入
+- duplicates 表由触发器维护：同一指纹的歌曲中 rowid 最小的保留，其余各记一行 (song_id, keep_id)
+- DedupIndex 为内存中的 指纹 -> 歌曲 索引，用于上传/导入等入库前的查重
+"""
+
+import hashlib
+import os
+import struct
+import threading
+
+HASH_BYTES = 64 * 1024
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _skip_id3v2(f, start, end):
+    """跳过开头的 ID3v2 标签（可能有多个）"""
+    while start + 10 <= end:
+        f.seek(start)
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b'ID3':
+            break
+        start += 10 + _syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+    return start
+
+
+def _trim_trailing_tags(f, start, end):
+    """去掉结尾的 ID3v1 / APEv2 标签"""
+    while end - start >= 32:
+        if end - start >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b'TAG':
+                end -= 128
+                continue
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[:8] == b'APETAGEX':
+            tag_size, _, flags = struct.unpack('<III', footer[12:24])
+            end -= tag_size + (32 if flags & 0x80000000 else 0)
+            continue
+        break
+    return start, max(start, end)
+
+
+def _flac_payload(f, start, end):
+    pos = start + 4
+    while pos + 4 <= end:
+        f.seek(pos)
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        pos += 4 + int.from_bytes(header[1:4], 'big')
+        if header[0] & 0x80:
+            break
+    return min(pos, end), end
+
+
+def _riff_payload(f, start, end):
+    pos = start + 12
+    while pos + 8 <= end:
+        f.seek(pos)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        if chunk_id == b'data':
+            return pos + 8, min(end, pos + 8 + chunk_size)
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return start, end
+
+
+def _mp4_payload(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        atom_size, atom_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if atom_size == 1:
+            atom_size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif atom_size == 0:
+            atom_size = end - pos
+        if atom_size < header:
+            break
+        if atom_type == b'mdat':
+            return pos + header, min(end, pos + atom_size)
+        pos += atom_size
+    return start, end
+
+
+def audio_payload(f, size):
+    """返回文件中音频数据所在区间 (offset, length)，f 为可 seek 的二进制文件对象"""
+    start, end = _skip_id3v2(f, 0, size), size
+    f.seek(start)
+    magic = f.read(12)
+    if magic[:4] == b'fLaC':
+        start, end = _flac_payload(f, start, end)
+    elif magic[:4] == b'RIFF' and magic[8:12] == b'WAVE':
+        start, end = _riff_payload(f, start, end)
+    elif magic[4:8] == b'ftyp':
+        start, end = _mp4_payload(f, start, end)
+    start, end = _trim_trailing_tags(f, start, end)
+    return start, end - start
+
+
+def fingerprint_file(f, size):
+    """计算已打开文件的内容指纹 (audio_size, content_hash)"""
+    offset, length = audio_payload(f, size)
+    digest = hashlib.blake2b(digest_size=16)
+    f.seek(offset)
+    if length <= HASH_BYTES * 2:
+        digest.update(f.read(length))
+    else:
+        digest.update(f.read(HASH_BYTES))
+        f.seek(offset + length - HASH_BYTES)
+        digest.update(f.read(HASH_BYTES))
+    return length, digest.hexdigest()
+
+
+def fingerprint(path):
+    """计算文件内容指纹，无法读取时返回 (None, None)"""
+    try:
+        with open(path, 'rb') as f:
+            return fingerprint_file(f, os.fstat(f.fileno()).st_size)
+    except (OSError, struct.error):
+        return None, None
+
+
+def _regroup_sql(row):
+    """重新计算 row 所在指纹分组：rowid 最小的保留，其余指向它（未变化的行不重写）"""
+    match = f"audio_size = {row}.audio_size AND content_hash = {row}.content_hash"
+    keeper = f"(SELECT id FROM songs WHERE {match} ORDER BY rowid LIMIT 1)"
+    return f'''
+        DELETE FROM duplicates WHERE song_id IN (SELECT id FROM songs WHERE {match}) AND keep_id IS NOT {keeper};
+        INSERT OR IGNORE INTO duplicates (song_id, keep_id)
+            SELECT id, {keeper} FROM songs WHERE {match} AND id <> {keeper};
+    '''
+
+
+def create_tables(conn):
+    """创建 duplicates 表及同步触发器并根据现有指纹填充"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS duplicates (
+            song_id TEXT PRIMARY KEY,
+            keep_id TEXT NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_keep ON duplicates (keep_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_content ON songs (audio_size, content_hash)")
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_dedup_ai AFTER INSERT ON songs
+        WHEN new.content_hash IS NOT NULL
+        BEGIN {_regroup_sql('new')} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_dedup_au AFTER UPDATE OF audio_size, content_hash ON songs
+        WHEN old.audio_size IS NOT new.audio_size OR old.content_hash IS NOT new.content_hash
+        BEGIN
+            DELETE FROM duplicates WHERE song_id = old.id;
+            {_regroup_sql('old')} {_regroup_sql('new')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_dedup_ad AFTER DELETE ON songs BEGIN
+            DELETE FROM duplicates WHERE song_id = old.id;
+            {_regroup_sql('old')}
+        END
+    ''')
+    rebuild(conn)
+
+
+def rebuild(conn):
+    """根据 songs 的指纹全量重建 duplicates"""
+    conn.execute("DELETE FROM duplicates")
+    conn.execute('''
+        INSERT INTO duplicates (song_id, keep_id)
+        SELECT s.id, k.id FROM songs s
+        JOIN (SELECT audio_size, content_hash, id, MIN(rowid) FROM songs
+              WHERE content_hash IS NOT NULL GROUP BY audio_size, content_hash HAVING COUNT(*) > 1) k
+          ON s.audio_size = k.audio_size AND s.content_hash = k.content_hash
+        WHERE s.id <> k.id
+    ''')
+
+
+class DedupIndex:
+    """
+    内存中的 (audio_size, content_hash) -> {song_id} 索引
+
+    首次使用时从 songs 全量加载，之后按 library_changes 增量同步（sync 传入变更日志中的新记录）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._keys = {}
+        self.seq = None
+
+    def load(self, rows, seq):
+        """rows: (id, audio_size, content_hash)"""
+        with self._lock:
+            self._groups.clear()
+            self._keys.clear()
+            for song_id, audio_size, content_hash in rows:
+                self._set(song_id, (audio_size, content_hash) if content_hash else None)
+            self.seq = seq
+
+    def apply(self, changes, seq):
+        """changes: (song_id, audio_size, content_hash)，歌曲已删除时后两项为 None"""
+        with self._lock:
+            for song_id, audio_size, content_hash in changes:
+                self._set(song_id, (audio_size, content_hash) if content_hash else None)
+            self.seq = seq
+
+    def add(self, song_id, audio_size, content_hash):
+        with self._lock:
+            self._set(song_id, (audio_size, content_hash) if content_hash else None)
+
+    def _set(self, song_id, key):
+        old = self._keys.pop(song_id, None)
+        if old is not None:
+            members = self._groups.get(old)
+            if members:
+                members.discard(song_id)
+                if not members:
+                    del self._groups[old]
+        if key is not None:
+            self._keys[song_id] = key
+            self._groups.setdefault(key, set()).add(song_id)
+
+    def find(self, audio_size, content_hash) -> set:
+        """返回相同指纹的歌曲 id 集合"""
+        with self._lock:
+            return set(self._groups.get((audio_size, content_hash), ()))
+
+    def __len__(self):
+        return len(self._keys)
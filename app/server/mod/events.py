@@ -0,0 +1,164 @@
+"""
+进程内事件总线（供 /api/events SSE 推送使用）
+
+- 发布方只需 publish(topic, data)，没有订阅者时几乎无开销
+- 每个订阅者按 topic 合并尚未取走的事件：字典增量深度合并，其他数据后到覆盖先到，
+  因此扫描中的高频进度更新在推送端只会产生少量消息
+- ObservableDict 在键被修改时自动发布增量，可直接替换原有的全局状态字典；
+  修改与取快照都持有总线锁，发布出去的增量是普通数据的拷贝，序列化时不会遇到被并发修改的字典
+"""
+
+import threading
+
+
+def _plain(value):
+    """转为不再被修改的普通数据（ObservableDict 与嵌套的 dict/list 逐层拷贝）"""
+    if isinstance(value, dict):
+        return {key: _plain(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _merge(base, delta):
+    """将增量 delta 深度合并进 base（值为 None 表示该键被删除，原样保留供客户端处理）"""
+    if not isinstance(base, dict) or not isinstance(delta, dict):
+        return delta
+    merged = dict(base)
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class Subscription:
+    """单个订阅者的待发送事件（按 topic 合并）"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = {}
+
+    def _push(self, topic, data, merge):
+        with self._cond:
+            if merge and topic in self._pending:
+                self._pending[topic] = _merge(self._pending[topic], data)
+            else:
+                self._pending.pop(topic, None)  # 重新插入，保持按最近更新排序
+                self._pending[topic] = data
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """等待并取走所有待发送事件，返回 [(topic, data), ...]；超时返回空列表"""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            events = list(self._pending.items())
+            self._pending.clear()
+        return events
+
+
+class EventBus:
+    def __init__(self):
+        # 同时保护订阅者列表与挂在本总线上的 ObservableDict（修改与取快照互斥）
+        self._lock = threading.RLock()
+        self._subscribers = ()
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription()
+        with self._lock:
+            self._subscribers = self._subscribers + (sub,)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, topic: str, data, merge: bool = False):
+        """
+        发布事件
+
+        :param merge: data 为字典增量时置 True，与该订阅者尚未取走的同 topic 事件合并
+        """
+        for sub in self._subscribers:
+            sub._push(topic, data, merge)
+
+
+class ObservableDict(dict):
+    """
+    修改时向事件总线发布增量的字典
+
+    嵌套的字典值会被包装为 ObservableDict，修改内层键时发布 {外层键: {内层键: 值}}，
+    删除键时发布 {键: None}。
+    """
+
+    def __init__(self, bus: EventBus, topic: str, data=None, _path=()):
+        super().__init__()
+        self._bus = bus
+        self._topic = topic
+        self._path = _path
+        if data:
+            for key, value in dict(data).items():
+                super().__setitem__(key, self._wrap(key, value))
+
+    def _wrap(self, key, value):
+        if isinstance(value, dict) and not isinstance(value, ObservableDict):
+            return ObservableDict(self._bus, self._topic, value, self._path + (key,))
+        return value
+
+    def _publish(self, delta):
+        delta = _plain(delta)
+        for key in reversed(self._path):
+            delta = {key: delta}
+        self._bus.publish(self._topic, delta, merge=True)
+
+    def __setitem__(self, key, value):
+        with self._bus._lock:
+            value = self._wrap(key, value)
+            super().__setitem__(key, value)
+            self._publish({key: value})
+
+    def __delitem__(self, key):
+        with self._bus._lock:
+            super().__delitem__(key)
+            self._publish({key: None})
+
+    def update(self, *args, **kwargs):
+        with self._bus._lock:
+            changes = {key: self._wrap(key, value) for key, value in dict(*args, **kwargs).items()}
+            super().update(changes)
+            if changes:
+                self._publish(changes)
+
+    def pop(self, key, *default):
+        with self._bus._lock:
+            existed = key in self
+            value = super().pop(key, *default)
+            if existed:
+                self._publish({key: None})
+            return value
+
+    def setdefault(self, key, default=None):
+        with self._bus._lock:
+            if key not in self:
+                self[key] = default
+            return super().__getitem__(key)
+
+    def replace(self, data):
+        """整体替换内容（客户端收到的增量中被移除的键为 None）"""
+        with self._bus._lock:
+            removed = {key: None for key in self if key not in data}
+            super().clear()
+            changes = {key: self._wrap(key, value) for key, value in dict(data).items()}
+            super().update(changes)
+            self._publish({**removed, **changes})
+
+    def snapshot(self) -> dict:
+        """在总线锁内返回普通数据的深拷贝，用于序列化"""
+        with self._bus._lock:
+            return _plain(self)
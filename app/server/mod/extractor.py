@@ -0,0 +1,268 @@
+"""
+扫描时的标签解析阶段
+
+mutagen 的解析是纯 Python 代码、持有 GIL，线程池在多核机器上也只能用满一个核心。
+Extractor 将待解析文件按批发送给子进程池，子进程完成标签解析，只回传紧凑的结果元组，
+主进程只负责汇总与写库。封面在扫描时只记录所在位置，首次请求时才提取（见 load_cover）。
+
+子进程池仅在支持 fork 的平台启用（spawn 会重新执行主程序的模块级代码），
+不支持、创建失败或进程池异常退出时退化为线程池。
+
+fork 只能在进程内还没有其他线程时进行：子进程只复制 fork 所在的线程，其他线程持有的锁
+（日志、数据库写队列、import 锁等）在子进程中永远不会释放；Python 3.12 起还会给出 DeprecationWarning。
+因此子进程池由 start_process_pool() 在启动任何后台线程之前一次性创建，之后各次扫描共用，
+运行期间不再 fork（进程池异常退出后改用线程池）。
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from mod import covers, dedup, lyrics, tagreader
+
+logger = logging.getLogger(__name__)
+
+MODES = ('process', 'thread')
+PROCESS_BATCH_SIZE = 16
+
+
+def _cover_files(path, cover_dir):
+    """(音频旁的同名 .jpg, 旧版按文件名保存的 covers/<base_name>.jpg)"""
+    base_path = os.path.splitext(path)[0]
+    return base_path + ".jpg", os.path.join(cover_dir, f"{os.path.basename(base_path)}.jpg")
+
+
+def locate_cover(path, cover_dir, record):
+    """
+    判断歌曲封面所在位置，返回来源（covers.FILE/EMBEDDED/SCRAPED）或 None，不读取也不保存图片
+
+    优先级：音频旁的同名 .jpg > 内嵌封面 > 旧版按文件名保存的 covers/<base_name>.jpg（此前刮削所得）
+    """
+    adjacent, legacy = _cover_files(path, cover_dir)
+    if os.path.exists(adjacent):
+        return covers.FILE
+    if record.cover:
+        return covers.EMBEDDED
+    if os.path.exists(legacy):
+        return covers.SCRAPED
+    return None
+
+
+def load_cover(path, cover_dir, source=None):
+    """
+    读取 locate_cover 记录的位置上的封面，返回 (图片数据, 来源) 或 None（文件已变化时找不到）
+    来源未知（升级前入库的歌曲）时按 locate_cover 的优先级逐一查找
+    """
+    adjacent, legacy = _cover_files(path, cover_dir)
+    for candidate, file_path in ((covers.FILE, adjacent), (covers.EMBEDDED, None), (covers.SCRAPED, legacy)):
+        if source and source != candidate:
+            continue
+        if file_path is None:
+            data = tagreader.read_tags(path).cover if os.path.exists(path) else None
+        elif os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        else:
+            data = None
+        if data:
+            return data, candidate
+    return None
+
+
+def extract_file(path, cover_dir):
+    """
+    解析单个文件，返回 (title, artist, album, has_cover, audio_size, content_hash,
+    duration, bitrate, sample_rate, bits_per_sample, channels, codec, cover_source, lyrics)
+
+    audio_size/content_hash 为去重用的内容指纹，其后为音频流属性，cover_source 为 locate_cover 的结果，
+    lyrics 为同名歌词文件与内嵌歌词 [(format, source, text)]（见 mod.lyrics.find）
+    """
+    record = tagreader.read_tags(path)
+    cover_source = locate_cover(path, cover_dir, record)
+    audio_size, content_hash = dedup.fingerprint(path)
+    return (record.title, record.artist, record.album or '', 1 if cover_source else 0, audio_size, content_hash,
+            record.duration, record.bitrate, record.sample_rate, record.bits_per_sample, record.channels, record.codec,
+            cover_source, lyrics.find(path, record))
+
+
+def extract_batch(paths, cover_dir):
+    """解析一批文件，单个文件失败时对应位置为 None"""
+    results = []
+    for path in paths:
+        try:
+            results.append(extract_file(path, cover_dir))
+        except Exception as e:
+            logger.warning(f"解析标签失败: {path} ({e})")
+            results.append(None)
+    return results
+
+
+# start_process_pool() 创建的共享进程池及其进程数
+_process_pool = None
+_process_workers = 0
+
+
+def process_pool_available() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def _watch_parent(parent_pid):
+    while os.getppid() == parent_pid:
+        time.sleep(2)
+    os._exit(0)
+
+
+def _init_worker(parent_pid):
+    """子进程初始化：不继承主进程的停止信号处理（由主进程关闭进程池），主进程被强制结束时随之退出"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    threading.Thread(target=_watch_parent, args=(parent_pid,), name='parent-watch', daemon=True).start()
+
+
+def start_process_pool(workers=0):
+    """
+    创建扫描共用的解析子进程池并立即 fork 出全部子进程，须在启动任何后台线程之前调用（见模块说明）
+    进程内已有其他线程、平台不支持 fork 或只有一个核心时不创建，扫描使用线程池。返回进程数（0 表示未创建）
+    """
+    global _process_pool, _process_workers
+    workers = workers or os.cpu_count() or 1
+    if _process_pool is not None or not process_pool_available() or workers <= 1:
+        return 0
+    if threading.active_count() > 1:
+        logger.warning(f"已有 {threading.active_count()} 个线程在运行，fork 不安全，标签解析改用线程池")
+        return 0
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=_init_worker, initargs=(os.getpid(),))
+        # fork 上下文在首次提交时一次性启动全部子进程（此时进程内仍只有当前线程）
+        pool.submit(os.getpid).result()
+    except (OSError, ValueError) as e:
+        logger.warning(f"创建解析进程池失败，改用线程池: {e}")
+        return 0
+    _process_pool, _process_workers = pool, workers
+    return workers
+
+
+def stop_process_pool():
+    """服务停止时关闭共享进程池（正在解析的批次不再等待）"""
+    global _process_pool
+    pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _discard_process_pool(pool):
+    """共享进程池异常退出：之后的扫描都使用线程池（运行期间不再重新 fork）"""
+    global _process_pool
+    if _process_pool is pool:
+        _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Extractor:
+    """
+    边提交边解析：submit() 逐个接收 FileRecord（攒满一批后发送），results() 按完成顺序产出结果
+
+    :param cover_dir: 内嵌封面输出目录
+    :param workers: 线程数，0 表示按 CPU 核数自动选择（进程数由 start_process_pool 决定）
+    :param mode: 'process' 优先使用共享的子进程池（未创建时使用线程池），'thread' 只使用线程池
+    """
+
+    def __init__(self, cover_dir, workers=0, mode='process'):
+        self.cover_dir = cover_dir
+        self.submitted = 0
+        self._batch = []
+        self._pending = {}  # Future -> [FileRecord]
+        self._pool = None
+        cpus = os.cpu_count() or 1
+        if mode == 'process' and _process_pool is not None:
+            self._pool = _process_pool
+            self.mode = 'process'
+            self.workers = _process_workers
+            self.batch_size = PROCESS_BATCH_SIZE
+            self.max_pending = self.workers * 2
+        else:
+            self._use_threads(workers or min(32, cpus + 4))
+
+    def _use_threads(self, workers):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extractor')
+        self.mode = 'thread'
+        self.workers = workers
+        self.batch_size = 1
+        self.max_pending = workers * 4
+
+    def _fallback(self):
+        """进程池异常退出（子进程被杀等）后切换到线程池，未完成的批次重新提交"""
+        if self.mode != 'process':
+            return
+        logger.warning("解析进程池异常退出，改用线程池")
+        _discard_process_pool(self._pool)
+        self._use_threads(self.workers)
+
+    def _send(self, batch):
+        try:
+            future = self._pool.submit(extract_batch, [info.path for info in batch], self.cover_dir)
+        except BrokenProcessPool:
+            self._fallback()
+            future = self._pool.submit(extract_batch, [info.path for info in batch], self.cover_dir)
+        self._pending[future] = batch
+
+    def submit(self, info):
+        self._batch.append(info)
+        self.submitted += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._send(batch)
+
+    def results(self, wait_all=True):
+        """
+        产出已完成的解析结果 (info, extract_file 的结果或 None)
+
+        :param wait_all: True 时等待已提交的文件全部完成；False 时只取走已完成的批次，
+                         在途批次过多时先等待其中一批完成（背压，限制内存与排队长度）
+        """
+        if wait_all:
+            self.flush()
+        while self._pending:
+            if wait_all or len(self._pending) >= self.max_pending:
+                done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+            else:
+                done = [future for future in self._pending if future.done()]
+                if not done:
+                    return
+            for future in done:
+                batch = self._pending.pop(future)
+                try:
+                    rows = future.result()
+                except BrokenProcessPool:
+                    self._fallback()
+                    self._send(batch)
+                    continue
+                except Exception as e:
+                    logger.warning(f"解析批次失败: {e}")
+                    rows = [None] * len(batch)
+                yield from zip(batch, rows)
+
+    def close(self):
+        if self.mode == 'process':
+            # 共享进程池不关闭，只撤回本次扫描尚未开始的批次（被取消时）
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+        else:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
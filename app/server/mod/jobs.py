@@ -0,0 +1,398 @@
+"""
+后台任务调度
+
+取代散落各处的 threading.Thread(...).start()：任务按类型注册到 JobEngine，每种类型属于一个工作池，
+池内固定并发上限，排队任务按 优先级（数值小者优先）+ 提交顺序出队。
+
+- 取消：每个任务带 CancelToken，处理函数在循环中调用 token.check()，被取消时抛出 JobCancelled。
+  JobCancelled 继承 BaseException，不会被处理函数中常见的 `except Exception` 吞掉
+- 抢占：高优先级任务入队而池内已满时，通知池内可抢占的低优先级任务让出；被抢占的任务重新排队，
+  因此可抢占任务的处理函数应能从中断处继续（或重复执行无副作用）
+- 进度：job.report(...) 更新 status（ObservableDict，经事件总线推送）并通知监听者
+- 持久化：persistent 类型的任务在 jobs 表中保留到结束，进程重启后未完成的任务重新排队
+- 同一类型、同一 key 的任务已在排队时不重复提交，直接返回排队中的任务
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from mod.events import ObservableDict
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+PREEMPTED = 'preempted'  # CancelToken.reason
+
+HISTORY_SIZE = 50  # status 中保留的已结束任务数
+
+_local = threading.local()
+
+
+class JobCancelled(BaseException):
+    """任务被取消或被抢占（reason 见 CancelToken.reason）"""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason='cancelled'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        """已取消时抛出 JobCancelled，供处理函数在循环中调用"""
+        if self._event.is_set():
+            raise JobCancelled(self.reason)
+
+    def wait(self, timeout) -> bool:
+        """可被取消打断的 sleep，被取消时返回 True"""
+        return self._event.wait(timeout)
+
+
+class JobType:
+    def __init__(self, kind, handler, pool, priority, persistent, preemptible):
+        self.kind = kind
+        self.handler = handler
+        self.pool = pool
+        self.priority = priority
+        self.persistent = persistent
+        self.preemptible = preemptible
+
+
+class Job:
+    """
+    一次任务执行；处理函数以 handler(job, **job.params) 调用
+
+    progress 为处理函数通过 report() 上报的字段（约定 total/processed/failed/message/path）
+    """
+
+    def __init__(self, job_id, kind, params, priority, key=None, created_at=None):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.key = key
+        self.created_at = created_at or time.time()
+        self.state = QUEUED
+        self.token = CancelToken()
+        self.progress = {}
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._engine = None
+        self._seq = None
+
+    def report(self, **fields):
+        """上报进度"""
+        self.progress.update(fields)
+        if self._engine is not None:
+            self._engine._progress(self, fields)
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id, 'kind': self.kind, 'key': self.key, 'priority': self.priority, 'state': self.state,
+            'progress': dict(self.progress), 'error': self.error, 'created_at': self.created_at,
+            'started_at': self.started_at, 'finished_at': self.finished_at,
+        }
+
+
+class _Pool:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.queue = []  # (priority, seq, Job)
+        self.running = set()
+        self.threads = []
+
+
+def current_job():
+    """当前线程正在执行的任务，不在任务线程中时为 None"""
+    return getattr(_local, 'job', None)
+
+
+def check_cancelled():
+    """当前线程的任务已取消时抛出 JobCancelled（不在任务线程中时什么也不做）"""
+    job = current_job()
+    if job is not None:
+        job.token.check()
+
+
+class JobEngine:
+    """
+    :param bus: 事件总线，任务状态以 'jobs' topic 推送
+    :param db: mod.db.Database，用于持久化（需已迁移出 jobs 表）；None 时不持久化
+    """
+
+    def __init__(self, bus=None, db=None):
+        self.db = db
+        self.status = ObservableDict(bus, 'jobs') if bus is not None else {}
+        self._types = {}
+        self._pools = {}
+        self._jobs = {}
+        self._history = []
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._started = False
+
+    # --- 注册 ---
+    def add_pool(self, name, size):
+        with self._cond:
+            pool = self._pools[name] = _Pool(name, max(1, int(size)))
+            if self._started:
+                self._spawn(pool)
+        return pool
+
+    def register(self, kind, handler, pool, priority=50, persistent=False, preemptible=False):
+        """
+        注册任务类型
+
+        :param priority: 默认优先级（数值越小越优先），提交时可覆盖
+        :param persistent: 未完成的任务是否在重启后恢复
+        :param preemptible: 运行中是否可被同池的更高优先级任务抢占
+        """
+        if pool not in self._pools:
+            self.add_pool(pool, 1)
+        self._types[kind] = JobType(kind, handler, pool, priority, persistent, preemptible)
+
+    def add_listener(self, fn):
+        """fn(job) 在任务状态变化与进度上报时调用（在任务线程中执行，应尽快返回）"""
+        self._listeners.append(fn)
+
+    # --- 提交/取消 ---
+    def submit(self, kind, params=None, priority=None, key=None) -> Job:
+        jtype = self._types[kind]
+        with self._cond:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.kind == kind and job.key == key and job.state == QUEUED:
+                        if priority is not None and priority < job.priority:
+                            self._reprioritize(job, priority)
+                        return job
+            job = Job(f"{kind}-{int(time.time() * 1000)}-{os.urandom(3).hex()}", kind, params or {},
+                      jtype.priority if priority is None else priority, key)
+            self._enqueue(job)
+        self._persist(job)
+        self._changed(job)
+        logger.info(f"任务入队: {job.kind} ({job.id}) 优先级 {job.priority}")
+        return job
+
+    def cancel(self, job_id) -> bool:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED:
+                return False
+            job.token.cancel()
+            if job.state != QUEUED:
+                return True  # 运行中的任务在处理函数下次检查时结束
+            self._finish(job, CANCELLED)
+        self._persist(job)
+        self._changed(job)
+        return True
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def find(self, kind, key=None, states=(QUEUED, RUNNING)) -> list:
+        with self._cond:
+            return [job for job in self._jobs.values()
+                    if job.kind == kind and job.state in states and (key is None or job.key == key)]
+
+    def snapshot(self) -> list:
+        with self._cond:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in sorted(jobs, key=lambda j: j.created_at)]
+
+    # --- 启动 ---
+    def start(self):
+        """恢复持久化的未完成任务并启动各池的工作线程（应在所有任务类型注册后、数据库迁移后调用）"""
+        restored = self._load()
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            pending = [job for job in self._jobs.values() if self._types[job.kind].persistent]
+            duplicates = []
+            for job in list(restored):
+                if job.key is not None and any(j.kind == job.kind and j.key == job.key and j.state == QUEUED
+                                               for j in self._jobs.values()):
+                    restored.remove(job)
+                    duplicates.append(job)
+                    continue
+                self._enqueue(job)
+            for pool in self._pools.values():
+                self._spawn(pool)
+        for job in pending:
+            self._persist(job)  # 启动前提交的任务此时才能写库
+        for job in duplicates:
+            job.state = CANCELLED
+            self._persist(job)
+        for job in restored:
+            self._changed(job)
+        if restored:
+            logger.info(f"已恢复 {len(restored)} 个未完成的后台任务")
+
+    def _load(self) -> list:
+        if self.db is None:
+            return []
+        try:
+            with self.db.connection() as conn:
+                rows = conn.execute("SELECT id, kind, job_key, params, priority, created_at FROM jobs "
+                                    "WHERE state IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)).fetchall()
+        except Exception as e:
+            logger.warning(f"读取任务表失败: {e}")
+            return []
+        jobs = []
+        for job_id, kind, key, params, priority, created_at in rows:
+            if kind not in self._types or job_id in self._jobs:
+                continue
+            try:
+                params = json.loads(params) if params else {}
+            except ValueError:
+                params = {}
+            jobs.append(Job(job_id, kind, params, priority, key, created_at))
+        return jobs
+
+    def _spawn(self, pool):
+        for i in range(len(pool.threads), pool.size):
+            thread = threading.Thread(target=self._worker, args=(pool,), name=f"job-{pool.name}-{i}", daemon=True)
+            pool.threads.append(thread)
+            thread.start()
+
+    # --- 调度 ---
+    def _enqueue(self, job):
+        """加入所属池的队列；池已满时请求抢占（调用方持有 _cond）"""
+        job._engine = self
+        job.state = QUEUED
+        if job._seq is None:
+            job._seq = next(self._seq)
+        self._jobs[job.id] = job
+        pool = self._pools[self._types[job.kind].pool]
+        heapq.heappush(pool.queue, (job.priority, job._seq, job))
+        if len(pool.running) >= pool.size:
+            victims = [r for r in pool.running
+                       if self._types[r.kind].preemptible and r.priority > job.priority and not r.token.cancelled]
+            if victims:
+                victim = max(victims, key=lambda r: r.priority)
+                logger.info(f"任务 {victim.kind} ({victim.id}) 让出给更高优先级的 {job.kind}")
+                victim.token.cancel(PREEMPTED)
+        self._cond.notify_all()
+
+    def _reprioritize(self, job, priority):
+        pool = self._pools[self._types[job.kind].pool]
+        pool.queue = [entry for entry in pool.queue if entry[2] is not job]
+        heapq.heapify(pool.queue)
+        job.priority = priority
+        self._enqueue(job)
+
+    def _next(self, pool):
+        with self._cond:
+            while True:
+                while pool.queue:
+                    _, _, job = heapq.heappop(pool.queue)
+                    if job.state == QUEUED:
+                        job.state = RUNNING
+                        job.started_at = time.time()
+                        pool.running.add(job)
+                        return job
+                self._cond.wait()
+
+    def _worker(self, pool):
+        while True:
+            job = self._next(pool)
+            self._persist(job)
+            self._changed(job)
+            self._run(pool, job)
+
+    def _run(self, pool, job):
+        jtype = self._types[job.kind]
+        _local.job = job
+        state, requeue = DONE, False
+        try:
+            jtype.handler(job, **job.params)
+        except JobCancelled:
+            if job.token.reason == PREEMPTED:
+                requeue = True
+            else:
+                state = CANCELLED
+                logger.info(f"任务已取消: {job.kind} ({job.id})")
+        except Exception as e:
+            state = FAILED
+            job.error = str(e)
+            logger.exception(f"任务执行失败: {job.kind} ({job.id}): {e}")
+        finally:
+            _local.job = None
+
+        with self._cond:
+            pool.running.discard(job)
+            if requeue:
+                job.token = CancelToken()
+                job.started_at = None
+                self._enqueue(job)
+            else:
+                self._finish(job, state)
+        self._persist(job)
+        self._changed(job)
+
+    def _finish(self, job, state):
+        """记录任务结束（调用方持有 _cond，之后在锁外持久化并发布），只保留最近 HISTORY_SIZE 个已结束任务"""
+        job.state = state
+        job.finished_at = time.time()
+        self._history.append(job.id)
+        while len(self._history) > HISTORY_SIZE:
+            old = self._jobs.pop(self._history.pop(0), None)
+            if old is not None:
+                self.status.pop(old.id, None)
+
+    # --- 状态发布与持久化 ---
+    def _changed(self, job):
+        self.status[job.id] = job.to_dict()
+        self._notify(job)
+
+    def _progress(self, job, fields):
+        entry = self.status.get(job.id)
+        if entry is not None:
+            entry['progress'].update(fields)
+        self._notify(job)
+
+    def _notify(self, job):
+        for fn in self._listeners:
+            try:
+                fn(job)
+            except Exception as e:
+                logger.warning(f"任务状态监听失败: {e}")
+
+    def _persist(self, job):
+        if self.db is None or not self._started or not self._types[job.kind].persistent:
+            return
+        try:
+            if job.state in FINISHED:
+                self.db.execute("DELETE FROM jobs WHERE id=?", (job.id,))
+            else:
+                self.db.execute('''
+                    INSERT INTO jobs (id, kind, job_key, params, priority, state, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET priority=excluded.priority, state=excluded.state,
+                                                  updated_at=excluded.updated_at
+                ''', (job.id, job.kind, job.key, json.dumps(job.params, ensure_ascii=False), job.priority,
+                      job.state, job.created_at, time.time()))
+        except Exception as e:
+            logger.warning(f"保存任务状态失败: {job.id} ({e})")
@@ -0,0 +1,130 @@
+"""
+曲库与磁盘的有序归并比对
+
+磁盘侧为 Walker.iter_files() 按路径排序产出的 FileRecord 流，数据库侧按 path 键集分页读取
+（`WHERE path > ? ORDER BY path LIMIT n`），两者做归并连接，逐条产出新增/变更/删除，
+内存占用与曲库规模无关。
+
+数据库侧不持有长时间的读事务：比对期间扫描结果分批提交，长读事务会让 WAL 无法回卷、随扫描不断增长。
+比对期间提交的行位于归并位置之前（或与磁盘侧一致），不影响比对结果。
+
+Python 字符串比较按码点，与 SQLite BINARY 排序（UTF-8 字节序）一致。
+"""
+
+import os
+from typing import NamedTuple, Optional
+
+from mod.walker import FileRecord
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+DB_PAGE_SIZE = 1000
+
+
+class Change(NamedTuple):
+    op: str
+    path: str
+    record: Optional[FileRecord]  # 删除时为 None
+
+
+def _prefix(root):
+    return root.rstrip(os.sep) + os.sep
+
+
+def normalize_roots(roots) -> list:
+    """
+    规范化扫描根目录：转为绝对路径，去掉位于其他根目录之下的根（外层遍历已包含），
+    按 路径+分隔符 排序，使依次遍历各根目录得到的文件流整体有序
+    """
+    result = []
+    for root in sorted({os.path.abspath(r) for r in roots if r}, key=_prefix):
+        if result and _prefix(root).startswith(_prefix(result[-1])):
+            continue
+        result.append(root)
+    return result
+
+
+def path_range(root):
+    """root 目录下所有路径的半开区间 [lo, hi)，可直接用于 path 索引范围查询"""
+    lo = _prefix(root)
+    return lo, lo[:-1] + chr(ord(os.sep) + 1)
+
+
+def under(path, roots) -> bool:
+    return any(path.startswith(_prefix(r)) for r in roots)
+
+
+def _iter_range(conn, lo, hi, page_size):
+    """按 path 键集分页读取 [lo, hi) 范围（None 表示不限）内的行，每页一条独立的查询"""
+    after = None
+    while True:
+        conditions, params = [], []
+        if after is not None:
+            conditions.append("path > ?")
+            params.append(after)
+        elif lo is not None:
+            conditions.append("path >= ?")
+            params.append(lo)
+        if hi is not None:
+            conditions.append("path < ?")
+            params.append(hi)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = conn.execute(f"SELECT path, mtime, size FROM songs {where} ORDER BY path LIMIT ?",
+                            (*params, page_size)).fetchall()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1][0]
+
+
+def iter_db_rows(conn, roots=None, page_size=DB_PAGE_SIZE):
+    """
+    按 path 升序流式读取 (path, mtime, size)
+
+    :param roots: 仅读取这些根目录（需已 normalize_roots）下的歌曲；None 表示全部
+    """
+    if roots is None:
+        yield from _iter_range(conn, None, None, page_size)
+        return
+    for root in roots:
+        yield from _iter_range(conn, *path_range(root), page_size)
+
+
+def merge(files, rows, keep=None):
+    """
+    归并两个按路径升序的序列，产出 Change
+
+    :param files: FileRecord 迭代器（磁盘）
+    :param rows: (path, mtime, size) 迭代器（数据库）
+    :param keep: 可选 keep(path) -> bool，数据库中有而磁盘未列出的路径是否保留（不产出删除）；
+                 调用时磁盘侧已遍历过该路径所在目录
+    """
+    files, rows = iter(files), iter(rows)
+    f, r = next(files, None), next(rows, None)
+    while f is not None or r is not None:
+        if r is None or (f is not None and f.path < r[0]):
+            yield Change(INSERT, f.path, f)
+            f = next(files, None)
+        elif f is None or r[0] < f.path:
+            if keep is None or not keep(r[0]):
+                yield Change(DELETE, r[0], None)
+            r = next(rows, None)
+        else:
+            if r[1] != f.mtime or r[2] != f.size:
+                yield Change(UPDATE, f.path, f)
+            f, r = next(files, None), next(rows, None)
+
+
+def diff(conn, walker, roots, on_dir=None, keep=None, whole_library=True):
+    """
+    比对磁盘与数据库，产出 Change
+
+    :param conn: 只读连接；数据库侧分页读取，不持有跨页的读事务
+    :param whole_library: True 时数据库侧为全部歌曲，不在任何根目录下的歌曲也会产出删除；
+                          False 时只比对 roots 范围内的歌曲
+    """
+    roots = normalize_roots(roots)
+    files = walker.iter_files(roots, on_dir=on_dir)
+    yield from merge(files, iter_db_rows(conn, None if whole_library else roots), keep)
@@ -0,0 +1,118 @@
+"""
+本地曲库全文检索（SQLite FTS5）
+
+索引文本与查询词统一经过 fold() 归一化：繁体转简体、转小写，
+中日韩字符逐字切分（unicode61 分词器不会切分连续的汉字），
+查询时连续的汉字组成短语匹配，其他词做前缀匹配。
+"""
+
+import re
+
+from mod.ttscn import t2s
+
+# 注册到 SQLite 连接上的归一化函数名（触发器中使用）
+FOLD_FUNCTION = 'fold_text'
+
+_CJK = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_CJK_RUN_RE = re.compile(f'[{_CJK}]+')
+_TOKEN_RE = re.compile(f'([{_CJK}]+)|([^\\W_]+)')
+
+
+def fold(text) -> str:
+    """归一化待索引文本。"""
+    if not text:
+        return ''
+    text = t2s(str(text)).lower()
+    return _CJK_RUN_RE.sub(lambda m: ' ' + ' '.join(m.group(0)) + ' ', text)
+
+
+def build_match_query(query: str):
+    """
+    将用户输入转换为 FTS5 MATCH 表达式，无有效词时返回 None
+
+    例: "周杰倫 qing" -> '"周 杰 伦" "qing"*'
+    """
+    if not query:
+        return None
+    terms = []
+    for cjk, word in _TOKEN_RE.findall(t2s(str(query)).lower()):
+        if cjk:
+            terms.append('"' + ' '.join(cjk) + '"')
+        elif word:
+            terms.append('"' + word.replace('"', '""') + '"*')
+    return ' '.join(terms) or None
+
+
+def create_index(conn) -> bool:
+    """创建 songs_fts 及同步触发器并填充现有数据；当前 SQLite 不支持 FTS5 时返回 False。"""
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(
+                title, artist, album, filename,
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except Exception:
+        return False
+
+    # songs_fts 的 rowid 与 songs 的 rowid 一一对应
+    values = ', '.join(f"{FOLD_FUNCTION}(new.{col})" for col in ('title', 'artist', 'album', 'filename'))
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_fts_ai AFTER INSERT ON songs BEGIN
+            DELETE FROM songs_fts WHERE rowid = new.rowid;
+            INSERT INTO songs_fts (rowid, title, artist, album, filename) VALUES (new.rowid, {values});
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS songs_fts_ad AFTER DELETE ON songs BEGIN
+            DELETE FROM songs_fts WHERE rowid = old.rowid;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_fts_au AFTER UPDATE OF title, artist, album, filename ON songs BEGIN
+            DELETE FROM songs_fts WHERE rowid = old.rowid;
+            INSERT INTO songs_fts (rowid, title, artist, album, filename) VALUES (new.rowid, {values});
+        END
+    ''')
+    rebuild_index(conn)
+    return True
+
+
+def rebuild_index(conn):
+    """根据 songs 全量重建检索索引。"""
+    conn.execute("DELETE FROM songs_fts")
+    cols = ', '.join(f"{FOLD_FUNCTION}({col})" for col in ('title', 'artist', 'album', 'filename'))
+    conn.execute(f"INSERT INTO songs_fts (rowid, title, artist, album, filename) SELECT rowid, {cols} FROM songs")
+
+
+def has_index(conn) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='songs_fts'").fetchone()
+    return row is not None
+
+
+def search(conn, query: str, limit: int = 50, columns: str = 's.*', where: str = None):
+    """
+    检索曲库，按相关度排序返回 songs 行
+
+    标题权重最高，其次歌手、专辑、文件名。不支持 FTS5 时退化为 LIKE 匹配。
+    :param columns: 返回的列（songs 表别名为 s）
+    :param where: 附加的过滤条件（songs 表别名为 s）
+    """
+    extra = f" AND ({where})" if where else ''
+    if has_index(conn):
+        match = build_match_query(query)
+        if not match:
+            return []
+        return conn.execute(f'''
+            SELECT {columns} FROM songs_fts f JOIN songs s ON s.rowid = f.rowid
+            WHERE songs_fts MATCH ?{extra}
+            ORDER BY bm25(songs_fts, 10.0, 5.0, 3.0, 1.0)
+            LIMIT ?
+        ''', (match, limit)).fetchall()
+
+    pattern = f"%{query.strip()}%"
+    return conn.execute(f'''
+        SELECT {columns} FROM songs s
+        WHERE (title LIKE ? OR artist LIKE ? OR album LIKE ? OR filename LIKE ?){extra}
+        ORDER BY title LIMIT ?
+    ''', (pattern, pattern, pattern, pattern, limit)).fetchall()
@@ -0,0 +1,140 @@
+"""
+歌词存储
+
+歌词按歌曲 id 保存在 lyrics 表，每首歌每种格式一行，正文以 zlib 压缩存储：
+lrc = 行级歌词，yrc = 网易云逐字歌词，translated = 翻译歌词。
+
+来源：file = 音频旁的同名 .lrc/.yrc，embedded = 音频内嵌，local = 旧版 lyrics/ 目录下按文件名保存的歌词，
+scraped = 刮削/在线搜索所得，netease = 网易云下载。前两者在扫描时读取，文件变化后重新读取。
+
+songs.has_lyrics 由触发器维护（有 lrc 或 yrc 时为 1），需要刮削歌词的歌曲可直接按该字段查询。
+"""
+
+import logging
+import os
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+LRC = 'lrc'
+YRC = 'yrc'
+TRANSLATED = 'translated'
+FORMATS = (LRC, YRC, TRANSLATED)
+
+FILE = 'file'
+EMBEDDED = 'embedded'
+LOCAL = 'local'
+SCRAPED = 'scraped'
+NETEASE = 'netease'
+SCAN_SOURCES = (FILE, EMBEDDED)
+
+# 歌词文件扩展名 -> 格式
+FILE_EXTS = {'.lrc': LRC, '.yrc': YRC}
+
+
+def compress(text: str) -> bytes:
+    return zlib.compress(text.encode('utf-8'))
+
+
+def decompress(blob: bytes) -> str:
+    return zlib.decompress(blob).decode('utf-8')
+
+
+def read_text(path):
+    """读取歌词文件，兼容旧版按 GBK 保存的文件"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('gb18030', errors='replace')
+
+
+def _read_files(base_path, source):
+    entries = []
+    for ext, fmt in FILE_EXTS.items():
+        path = base_path + ext
+        if not os.path.exists(path):
+            continue
+        try:
+            text = read_text(path)
+        except OSError as e:
+            logger.warning(f"读取歌词失败: {path} ({e})")
+            continue
+        if text.strip():
+            entries.append((fmt, source, text))
+    return entries
+
+
+def find(path, record=None):
+    """
+    扫描阶段读取音频旁的 .lrc/.yrc 与内嵌歌词，返回 [(format, source, text)]
+    同名 .lrc 优先于内嵌歌词
+
+    :param record: 已解析的 TagRecord（内嵌歌词）
+    """
+    entries = _read_files(os.path.splitext(path)[0], FILE)
+    if record is not None and record.lyrics and not any(fmt == LRC for fmt, _, _ in entries):
+        entries.append((LRC, EMBEDDED, record.lyrics))
+    return entries
+
+
+def find_local(lyrics_dir, filename):
+    """旧版按文件名保存在 lyrics/ 目录下的歌词，返回 [(format, source, text)]"""
+    return _read_files(os.path.join(lyrics_dir, os.path.splitext(os.path.basename(filename))[0]), LOCAL)
+
+
+def create_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lyrics (
+            song_id TEXT NOT NULL,
+            format TEXT NOT NULL,
+            source TEXT,
+            content BLOB,
+            fetched_at REAL,
+            PRIMARY KEY (song_id, format)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE TRIGGER IF NOT EXISTS songs_lyrics_ad AFTER DELETE ON songs BEGIN "
+                 "DELETE FROM lyrics WHERE song_id = old.id; END")
+
+    # has_lyrics：有行级或逐字歌词（只有翻译不算）
+    def flag(song_id):
+        return f"EXISTS (SELECT 1 FROM lyrics WHERE song_id = {song_id} AND format IN ('{LRC}', '{YRC}'))"
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS lyrics_flag_ai AFTER INSERT ON lyrics
+        WHEN new.format IN ('{LRC}', '{YRC}')
+        BEGIN UPDATE songs SET has_lyrics = 1 WHERE id = new.song_id AND IFNULL(has_lyrics, 0) = 0; END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS lyrics_flag_ad AFTER DELETE ON lyrics
+        WHEN old.format IN ('{LRC}', '{YRC}')
+        BEGIN
+            UPDATE songs SET has_lyrics = {flag('old.song_id')}
+            WHERE id = old.song_id AND has_lyrics IS NOT {flag('old.song_id')};
+        END
+    ''')
+
+
+def store(conn, entries, fetched_at=None):
+    """
+    在写事务中保存歌词（同一歌曲同一格式覆盖旧内容）
+
+    :param entries: (song_id, format, source, text) 序列，空内容跳过
+    """
+    now = fetched_at or time.time()
+    conn.executemany('''
+        INSERT INTO lyrics (song_id, format, source, content, fetched_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(song_id, format) DO UPDATE SET
+            source=excluded.source, content=excluded.content, fetched_at=excluded.fetched_at
+    ''', [(song_id, fmt, source, compress(text), now)
+          for song_id, fmt, source, text in entries if text and text.strip()])
+
+
+def load(conn, song_id):
+    """{format: {'text', 'source', 'fetched_at'}}，没有歌词时为空字典"""
+    rows = conn.execute("SELECT format, source, content, fetched_at FROM lyrics WHERE song_id = ?",
+                        (song_id,)).fetchall()
+    return {row[0]: {'text': decompress(row[2]), 'source': row[1], 'fetched_at': row[3]} for row in rows}
@@ -0,0 +1,93 @@
+"""
+歌曲按扫描根目录分区
+
+每首歌记录所属根目录 root_id（曲库根目录为 0，挂载点为 mount_points.id）、相对根目录的路径 rel_path
+以及所在目录的 dir_id（目录绝对路径的哈希）。根目录相互嵌套时歌曲归属最内层的根目录。
+
+挂载点范围内的扫描/刮削/删除/计数按 root_id 索引查询，不再使用 `path LIKE ? || '%'`
+（无法使用索引，且 /music/a 会误匹配 /music/ab）。
+"""
+
+import hashlib
+import os
+
+from mod.libdiff import path_range
+
+LIBRARY_ROOT_ID = 0
+DIR_ID_FUNCTION = 'dir_id'
+
+
+def _prefix(root):
+    return root.rstrip(os.sep) + os.sep
+
+
+def dir_id(path):
+    """path 所在目录的 id（目录路径的 63 位哈希，与目录是否已入清单无关）"""
+    if path is None:
+        return None
+    digest = hashlib.blake2b(os.path.dirname(path).encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+class RootIndex:
+    """
+    根目录 -> root_id 的映射（在写事务内按需加载，挂载点增删后重新加载）
+
+    :param library_root: 曲库根目录（root_id 为 0）
+    :param mounts: (id, path) 序列
+    """
+
+    def __init__(self, library_root, mounts=()):
+        roots = [(LIBRARY_ROOT_ID, os.path.abspath(library_root))]
+        roots.extend((mount_id, os.path.abspath(path)) for mount_id, path in mounts if path and mount_id is not None)
+        # 最内层（前缀最长）的根目录在前
+        self.roots = sorted(roots, key=lambda r: len(_prefix(r[1])), reverse=True)
+        self.paths = {root_id: path for root_id, path in self.roots}
+
+    @classmethod
+    def load(cls, conn, library_root):
+        return cls(library_root, conn.execute("SELECT id, path FROM mount_points").fetchall())
+
+    def locate(self, path):
+        """返回 (root_id, rel_path)，不在任何根目录下时为 (None, None)"""
+        for root_id, root in self.roots:
+            prefix = _prefix(root)
+            if path.startswith(prefix):
+                return root_id, path[len(prefix):]
+        return None, None
+
+    def columns(self, path):
+        """songs 的 (root_id, rel_path, dir_id)"""
+        return (*self.locate(path), dir_id(path))
+
+    def within(self, path):
+        """path 本身及其下的根目录 [(root_id, root)]"""
+        path = os.path.abspath(path)
+        prefix = _prefix(path)
+        return [(root_id, root) for root_id, root in self.roots if root == path or root.startswith(prefix)]
+
+    def scope(self, path):
+        """path 为根目录时返回它及嵌套在其中的根目录 id 列表，否则返回 None（调用方改用 path 范围查询）"""
+        if os.path.abspath(path) not in self.paths.values():
+            return None
+        return [root_id for root_id, _ in self.within(path)]
+
+    def song_filter(self, path, column='root_id'):
+        """path 目录下歌曲的 WHERE 条件与参数：根目录按 root_id，其他目录按 path 索引范围"""
+        ids = self.scope(path)
+        if ids is not None:
+            return f"{column} IN ({','.join('?' * len(ids))})", ids
+        return "path >= ? AND path < ?", list(path_range(os.path.abspath(path)))
+
+
+def assign(conn, index, scope):
+    """
+    按 index 重新计算 scope 根目录下歌曲的 root_id/rel_path：由外到内逐层覆盖，每层一次 path 索引范围更新，
+    嵌套的根目录最后写入。dir_id 只依赖歌曲路径，不受根目录变化影响
+    """
+    changed = 0
+    for root_id, root in reversed(index.within(scope)):
+        changed += conn.execute(
+            "UPDATE songs SET root_id = ?, rel_path = substr(path, ?) WHERE path >= ? AND path < ?",
+            (root_id, len(_prefix(root)) + 1, *path_range(root))).rowcount
+    return changed
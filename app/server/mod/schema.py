@@ -0,0 +1,403 @@
+"""
+数据库结构迁移步骤
+
+每个步骤为 (版本号, 说明, step(conn))，按版本号顺序执行且只执行一次，
+由 Database.migrate 在独立事务中应用。新增结构变更时在列表末尾追加新版本，
+不要修改已发布的步骤。
+"""
+
+import logging
+
+from mod import catalog, covers, dedup, libsearch, lyrics
+
+logger = logging.getLogger(__name__)
+
+
+def _column_names(conn, table: str):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _v1_base_tables(conn):
+    # 早期版本的 songs 表没有 path 列，无法兼容（歌曲索引可通过扫描重建）
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+    if 'songs' in tables and 'path' not in _column_names(conn, 'songs'):
+        conn.execute("DROP TABLE IF EXISTS songs")
+        conn.execute("DROP TABLE IF EXISTS mount_files")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS songs (
+            id TEXT PRIMARY KEY,
+            path TEXT UNIQUE,
+            filename TEXT,
+            title TEXT,
+            artist TEXT,
+            album TEXT,
+            mtime REAL,
+            size INTEGER,
+            has_cover INTEGER DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS favorite_playlists (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            is_default INTEGER DEFAULT 0,
+            created_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+           song_id TEXT,
+           playlist_id TEXT,
+           title TEXT DEFAULT '',
+           artist TEXT DEFAULT '',
+           created_at REAL,
+           PRIMARY KEY (song_id, playlist_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mount_points (
+            path TEXT PRIMARY KEY,
+            created_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _v2_query_indexes(conn):
+    # 查重 (filename=? AND size=? AND path!=?) 与按文件名查路径：覆盖索引，无需回表
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_filename_size ON songs (filename, size, path)")
+    # 音乐列表 ORDER BY title
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_title ON songs (title)")
+    # 收藏夹歌曲 WHERE playlist_id=?（主键为 song_id 在前，无法用于该查询）
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_favorites_playlist ON favorites (playlist_id, song_id)")
+
+
+def _v3_search_index(conn):
+    # 依赖连接上注册的 fold_text 函数；SQLite 未编译 FTS5 时跳过，检索退化为 LIKE
+    if not libsearch.create_index(conn):
+        logger.warning("当前 SQLite 不支持 FTS5，曲库搜索将使用 LIKE 匹配")
+
+
+def _v4_list_pagination_indexes(conn):
+    # /api/music 键集分页：每个排序键一个 (IFNULL(键), id) 表达式索引，查询须使用完全相同的表达式
+    conn.execute("DROP INDEX IF EXISTS idx_songs_title")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_sort_title ON songs (IFNULL(title, ''), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_sort_artist ON songs (IFNULL(artist, ''), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_sort_album ON songs (IFNULL(album, ''), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_sort_mtime ON songs (IFNULL(mtime, 0), id)")
+    # 列表去重 (标题+歌手+大小 相同只保留 rowid 最小的一条)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_dedup ON songs (title, artist, size)")
+
+
+def _v5_library_changes(conn):
+    # 曲库变更日志：由触发器在写入同一事务内记录，每首歌只保留最近一条（seq 单调递增）
+    now = "((julianday('now') - 2440587.5) * 86400.0)"
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS library_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            song_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changed_at REAL
+        )
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_library_changes_song ON library_changes (song_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_library_changes_op ON library_changes (op, seq)")
+
+    def log_change(song_id, op):
+        return (f"DELETE FROM library_changes WHERE song_id = {song_id}; "
+                f"INSERT INTO library_changes (song_id, op, changed_at) VALUES ({song_id}, '{op}', {now});")
+
+    # 列表按 标题+歌手+大小 去重，被隐藏的重复歌曲需要在保留的那条删除/改名后重新出现
+    def log_twin(prefix):
+        return (f"DELETE FROM library_changes WHERE song_id = (SELECT id FROM songs WHERE title IS {prefix}.title "
+                f"AND artist IS {prefix}.artist AND size IS {prefix}.size ORDER BY rowid LIMIT 1); "
+                f"INSERT INTO library_changes (song_id, op, changed_at) SELECT id, 'update', {now} "
+                f"FROM songs WHERE title IS {prefix}.title AND artist IS {prefix}.artist AND size IS {prefix}.size "
+                f"ORDER BY rowid LIMIT 1;")
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_changes_ai AFTER INSERT ON songs BEGIN {log_change('new.id', 'insert')} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_changes_au AFTER UPDATE ON songs
+        WHEN old.path IS NOT new.path OR old.filename IS NOT new.filename OR old.title IS NOT new.title
+          OR old.artist IS NOT new.artist OR old.album IS NOT new.album OR old.mtime IS NOT new.mtime
+          OR old.size IS NOT new.size OR old.has_cover IS NOT new.has_cover
+        BEGIN {log_change('new.id', 'update')} {log_twin('old')} END
+    ''')
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_changes_ad AFTER DELETE ON songs BEGIN {log_change('old.id', 'delete')} {log_twin('old')} END")
+
+
+def _v6_library_stats(conn):
+    # 状态接口使用的计数器，由触发器随写入增量维护，心跳查询不再 COUNT(*) 全表
+    if 'has_lyrics' not in _column_names(conn, 'songs'):
+        conn.execute("ALTER TABLE songs ADD COLUMN has_lyrics INTEGER DEFAULT 0")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS library_stats (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO library_stats (key, value)
+        SELECT 'songs', COUNT(*) FROM songs
+        UNION ALL SELECT 'total_size', IFNULL(SUM(size), 0) FROM songs
+        UNION ALL SELECT 'covers', COUNT(*) FROM songs WHERE has_cover = 1
+        UNION ALL SELECT 'lyrics', COUNT(*) FROM songs WHERE has_lyrics = 1
+        UNION ALL SELECT 'playlists', COUNT(*) FROM favorite_playlists
+    ''')
+
+    def add(sign, row):
+        return (f"UPDATE library_stats SET value = value {sign} 1 WHERE key = 'songs'; "
+                f"UPDATE library_stats SET value = value {sign} IFNULL({row}.size, 0) WHERE key = 'total_size'; "
+                f"UPDATE library_stats SET value = value {sign} 1 WHERE key = 'covers' AND {row}.has_cover = 1; "
+                f"UPDATE library_stats SET value = value {sign} 1 WHERE key = 'lyrics' AND {row}.has_lyrics = 1;")
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_stats_ai AFTER INSERT ON songs BEGIN {add('+', 'new')} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_stats_ad AFTER DELETE ON songs BEGIN {add('-', 'old')} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_stats_au AFTER UPDATE OF size, has_cover, has_lyrics ON songs BEGIN
+            {add('-', 'old')} {add('+', 'new')}
+        END
+    ''')
+    conn.execute("CREATE TRIGGER IF NOT EXISTS playlists_stats_ai AFTER INSERT ON favorite_playlists BEGIN "
+                 "UPDATE library_stats SET value = value + 1 WHERE key = 'playlists'; END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS playlists_stats_ad AFTER DELETE ON favorite_playlists BEGIN "
+                 "UPDATE library_stats SET value = value - 1 WHERE key = 'playlists'; END")
+
+    # 挂载点歌曲数/容量：按路径前缀（含分隔符，避免 /music/a 匹配 /music/ab）归属
+    columns = _column_names(conn, 'mount_points')
+    if 'song_count' not in columns:
+        conn.execute("ALTER TABLE mount_points ADD COLUMN song_count INTEGER DEFAULT 0")
+    if 'total_size' not in columns:
+        conn.execute("ALTER TABLE mount_points ADD COLUMN total_size INTEGER DEFAULT 0")
+
+    def under(child, mount='mount_points'):
+        base = f"rtrim({mount}.path, '/\\')"
+        return f"substr({child}.path, 1, length({base}) + 1) IN ({base} || '/', {base} || '\\')"
+
+    def add_mount(sign, row):
+        return (f"UPDATE mount_points SET song_count = song_count {sign} 1, "
+                f"total_size = total_size {sign} IFNULL({row}.size, 0) WHERE {under(row)};")
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_mount_stats_ai AFTER INSERT ON songs BEGIN {add_mount('+', 'new')} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_mount_stats_ad AFTER DELETE ON songs BEGIN {add_mount('-', 'old')} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_mount_stats_au AFTER UPDATE OF path, size ON songs BEGIN
+            {add_mount('-', 'old')} {add_mount('+', 'new')}
+        END
+    ''')
+    recount = (f"UPDATE mount_points SET "
+               f"song_count = (SELECT COUNT(*) FROM songs s WHERE {under('s')}), "
+               f"total_size = (SELECT IFNULL(SUM(s.size), 0) FROM songs s WHERE {under('s')})")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS mount_points_stats_ai AFTER INSERT ON mount_points BEGIN "
+                 f"{recount} WHERE rowid = new.rowid; END")
+    conn.execute(recount)
+
+
+def _v7_catalog(conn):
+    # 依赖连接上注册的 split_artists_json / primary_artist 函数
+    catalog.create_tables(conn)
+
+
+def _v8_directories(conn):
+    # 目录 mtime 清单：增量扫描时跳过自上次扫描后未变化的目录
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            file_count INTEGER DEFAULT 0,
+            last_scanned REAL
+        )
+    ''')
+
+
+def _v9_duplicates(conn):
+    # 按内容指纹识别重复文件，取代列表中按 标题+歌手+大小 的实时去重
+    columns = _column_names(conn, 'songs')
+    if 'audio_size' not in columns:
+        conn.execute("ALTER TABLE songs ADD COLUMN audio_size INTEGER")
+    if 'content_hash' not in columns:
+        conn.execute("ALTER TABLE songs ADD COLUMN content_hash TEXT")
+    conn.execute("DROP INDEX IF EXISTS idx_songs_dedup")
+    dedup.create_tables(conn)
+
+    # 变更日志：去掉 v5 中按 标题+歌手+大小 推断被隐藏歌曲的部分，改为随 duplicates 的增删记录
+    now = "((julianday('now') - 2440587.5) * 86400.0)"
+
+    def log_change(song_id, op):
+        return (f"DELETE FROM library_changes WHERE song_id = {song_id}; "
+                f"INSERT INTO library_changes (song_id, op, changed_at) VALUES ({song_id}, '{op}', {now});")
+
+    conn.execute("DROP TRIGGER IF EXISTS songs_changes_au")
+    conn.execute("DROP TRIGGER IF EXISTS songs_changes_ad")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_changes_au AFTER UPDATE ON songs
+        WHEN old.path IS NOT new.path OR old.filename IS NOT new.filename OR old.title IS NOT new.title
+          OR old.artist IS NOT new.artist OR old.album IS NOT new.album OR old.mtime IS NOT new.mtime
+          OR old.size IS NOT new.size OR old.has_cover IS NOT new.has_cover
+        BEGIN {log_change('new.id', 'update')} END
+    ''')
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS songs_changes_ad AFTER DELETE ON songs BEGIN {log_change('old.id', 'delete')} END")
+    # 歌曲被隐藏/重新出现（歌曲本身已删除时不覆盖其 delete 记录）
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS duplicates_changes_ai AFTER INSERT ON duplicates BEGIN {log_change('new.song_id', 'update')} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS duplicates_changes_ad AFTER DELETE ON duplicates
+        WHEN EXISTS (SELECT 1 FROM songs WHERE id = old.song_id)
+        BEGIN {log_change('old.song_id', 'update')} END
+    ''')
+
+
+def _v10_jobs(conn):
+    # 后台任务队列（mod.jobs）：持久化类型的任务在此保留到结束，重启后恢复排队
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            job_key TEXT,
+            params TEXT,
+            priority INTEGER DEFAULT 50,
+            state TEXT NOT NULL,
+            created_at REAL,
+            updated_at REAL
+        )
+    ''')
+
+
+def _v11_stream_info(conn):
+    # 音频流属性（时长/码率/采样率/位深/声道/编码），由扫描写入，升级前的歌曲由后台任务补齐
+    columns = _column_names(conn, 'songs')
+    for name, decl in (('duration', 'REAL'), ('bitrate', 'INTEGER'), ('sample_rate', 'INTEGER'),
+                       ('bits_per_sample', 'INTEGER'), ('channels', 'INTEGER'), ('codec', 'TEXT')):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE songs ADD COLUMN {name} {decl}")
+    # /api/music 按时长/码率排序的键集分页索引（表达式须与 MUSIC_SORT_KEYS 一致）
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_sort_duration ON songs (IFNULL(duration, 0), id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_sort_bitrate ON songs (IFNULL(bitrate, 0), id)")
+
+    # 变更日志：流属性变化（补齐）也记为 update，增量同步的客户端可拿到时长等信息
+    now = "((julianday('now') - 2440587.5) * 86400.0)"
+    conn.execute("DROP TRIGGER IF EXISTS songs_changes_au")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS songs_changes_au AFTER UPDATE ON songs
+        WHEN old.path IS NOT new.path OR old.filename IS NOT new.filename OR old.title IS NOT new.title
+          OR old.artist IS NOT new.artist OR old.album IS NOT new.album OR old.mtime IS NOT new.mtime
+          OR old.size IS NOT new.size OR old.has_cover IS NOT new.has_cover
+          OR old.duration IS NOT new.duration OR old.bitrate IS NOT new.bitrate OR old.codec IS NOT new.codec
+          OR old.sample_rate IS NOT new.sample_rate OR old.bits_per_sample IS NOT new.bits_per_sample
+          OR old.channels IS NOT new.channels
+        BEGIN
+            DELETE FROM library_changes WHERE song_id = new.id;
+            INSERT INTO library_changes (song_id, op, changed_at) VALUES (new.id, 'update', {now});
+        END
+    ''')
+
+
+def _v12_song_roots(conn):
+    # 歌曲按扫描根目录分区（mod.roots）：root_id/rel_path/dir_id 由写入方计算，升级前的歌曲在启动时补齐
+    if 'id' not in _column_names(conn, 'mount_points'):
+        conn.execute("ALTER TABLE mount_points ADD COLUMN id INTEGER")
+    conn.execute("UPDATE mount_points SET id = rowid WHERE id IS NULL")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_mount_points_id ON mount_points (id)")
+    columns = _column_names(conn, 'songs')
+    for name, decl in (('root_id', 'INTEGER'), ('rel_path', 'TEXT'), ('dir_id', 'INTEGER')):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE songs ADD COLUMN {name} {decl}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_root ON songs (root_id, rel_path)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_dir ON songs (dir_id)")
+
+    # 挂载点歌曲数/容量改为按 root_id 归属（每次写入只更新一行挂载点，不再逐个比较路径前缀）；
+    # 计数清零，由补齐 root_id 时的 UPDATE 触发器重新累加
+    for name in ('songs_mount_stats_ai', 'songs_mount_stats_ad', 'songs_mount_stats_au', 'mount_points_stats_ai'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    def add_mount(sign, row):
+        return (f"UPDATE mount_points SET song_count = song_count {sign} 1, "
+                f"total_size = total_size {sign} IFNULL({row}.size, 0) WHERE id = {row}.root_id;")
+
+    conn.execute(f"CREATE TRIGGER songs_mount_stats_ai AFTER INSERT ON songs BEGIN {add_mount('+', 'new')} END")
+    conn.execute(f"CREATE TRIGGER songs_mount_stats_ad AFTER DELETE ON songs BEGIN {add_mount('-', 'old')} END")
+    conn.execute(f'''
+        CREATE TRIGGER songs_mount_stats_au AFTER UPDATE OF root_id, size ON songs BEGIN
+            {add_mount('-', 'old')} {add_mount('+', 'new')}
+        END
+    ''')
+    conn.execute("UPDATE mount_points SET song_count = 0, total_size = 0")
+
+
+def _v13_cover_store(conn):
+    # 内容寻址封面存储（mod.covers）：歌曲与封面的对应关系，升级前的封面由后台任务迁移
+    covers.create_tables(conn)
+    # 封面变化时 album_art URL 随之变化，记入变更日志
+    now = "((julianday('now') - 2440587.5) * 86400.0)"
+
+    def log_change(song_id):
+        return (f"DELETE FROM library_changes WHERE song_id = {song_id}; "
+                f"INSERT INTO library_changes (song_id, op, changed_at) VALUES ({song_id}, 'update', {now});")
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS song_covers_changes_ai AFTER INSERT ON song_covers BEGIN {log_change('new.song_id')} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS song_covers_changes_au AFTER UPDATE OF cover_hash ON song_covers
+        WHEN old.cover_hash IS NOT new.cover_hash
+        BEGIN {log_change('new.song_id')} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS song_covers_changes_ad AFTER DELETE ON song_covers
+        WHEN EXISTS (SELECT 1 FROM songs WHERE id = old.song_id)
+        BEGIN {log_change('old.song_id')} END
+    ''')
+
+
+def _v14_cover_source(conn):
+    # 扫描只记录封面位置（音频旁图片/内嵌/旧版 covers 目录），首次请求时才提取入库
+    if 'cover_source' not in _column_names(conn, 'songs'):
+        conn.execute("ALTER TABLE songs ADD COLUMN cover_source TEXT")
+    conn.execute("UPDATE songs SET cover_source = (SELECT source FROM song_covers WHERE song_id = songs.id) "
+                 "WHERE cover_source IS NULL")
+
+
+
+def _v15_cover_palette(conn):
+    # 封面调色板（mod.covers.extract_palette 结果的 JSON），NULL 表示尚未计算
+    if 'palette' not in _column_names(conn, 'covers'):
+        conn.execute("ALTER TABLE covers ADD COLUMN palette TEXT")
+    # 调色板随歌曲返回，补算后记入使用该封面的歌曲的变更日志
+    now = "((julianday('now') - 2440587.5) * 86400.0)"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS covers_palette_changes_au AFTER UPDATE OF palette ON covers
+        WHEN old.palette IS NOT new.palette
+        BEGIN
+            DELETE FROM library_changes WHERE song_id IN (SELECT song_id FROM song_covers WHERE cover_hash = new.hash);
+            INSERT INTO library_changes (song_id, op, changed_at)
+                SELECT song_id, 'update', {now} FROM song_covers WHERE cover_hash = new.hash;
+        END
+    ''')
+
+
+def _v16_lyrics(conn):
+    # 歌词按歌曲 id 保存（mod.lyrics），has_lyrics 改由触发器维护；已有的歌词文件由后台任务导入
+    lyrics.create_tables(conn)
+
+
+MIGRATIONS = [
+    (1, '基础表结构', _v1_base_tables),
+    (2, '歌曲/收藏查询索引', _v2_query_indexes),
+    (3, '曲库全文检索索引', _v3_search_index),
+    (4, '音乐列表分页索引', _v4_list_pagination_indexes),
+    (5, '曲库变更日志', _v5_library_changes),
+    (6, '曲库统计计数器', _v6_library_stats),
+    (7, '歌手/专辑归类表', _v7_catalog),
+    (8, '目录扫描清单', _v8_directories),
+    (9, '重复文件指纹', _v9_duplicates),
+    (10, '后台任务队列', _v10_jobs),
+    (11, '音频流属性', _v11_stream_info),
+    (12, '歌曲按根目录分区', _v12_song_roots),
+    (13, '封面内容寻址存储', _v13_cover_store),
+    (14, '封面按需提取', _v14_cover_source),
+    (15, '封面调色板', _v15_cover_palette),
+    (16, '歌词存储', _v16_lyrics),
+]
@@ -0,0 +1,174 @@
+"""
+音频标签读取（不依赖 app 全局状态，可在扫描子进程中使用）
+
+read_tags() 对文件只做一次 mutagen 解析，一并取出文本标签、内嵌封面、内嵌歌词与音频流信息，
+扫描、封面/歌词接口与外部文件信息接口都基于它，避免同一文件被反复打开解析。
+"""
+
+import logging
+import os
+from typing import NamedTuple, Optional
+
+from mutagen import File
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_ARTIST = "未知艺术家"
+
+# 各标签格式中的字段名：ID3、MP4、Vorbis/APEv2、ASF
+_TEXT_KEYS = {
+    'title': ('TIT2', '©nam', 'title', 'Title'),
+    'artist': ('TPE1', '©ART', 'artist', 'Author'),
+    'album': ('TALB', '©alb', 'album', 'WM/AlbumTitle'),
+}
+_LYRICS_KEYS = ('©lyr', 'lyrics', 'LYRICS', 'unsyncedlyrics', 'UNSYNCEDLYRICS')
+
+# mutagen 文件类型 -> 编码名（MP4 按 info.codec 区分 AAC / ALAC）
+_CODECS = {
+    'MP3': 'mp3', 'EasyMP3': 'mp3', 'FLAC': 'flac', 'OggFLAC': 'flac', 'OggVorbis': 'vorbis', 'OggOpus': 'opus',
+    'OggSpeex': 'speex', 'WAVE': 'pcm', 'AIFF': 'pcm', 'AAC': 'aac', 'ASF': 'wma', 'WavPack': 'wavpack',
+    'MonkeysAudio': 'ape', 'TrueAudio': 'tta', 'DSF': 'dsd', 'DSDIFF': 'dsd',
+}
+LOSSLESS_CODECS = ('flac', 'alac', 'pcm', 'wavpack', 'ape', 'tta', 'dsd')
+
+
+class TagRecord(NamedTuple):
+    title: str
+    artist: str
+    album: Optional[str]
+    cover: Optional[bytes]      # 内嵌封面原始数据
+    lyrics: Optional[str]       # 内嵌歌词
+    duration: Optional[float]   # 秒
+    bitrate: Optional[int]      # bps
+    sample_rate: Optional[int]
+    channels: Optional[int]
+    bits_per_sample: Optional[int]
+    codec: Optional[str]
+
+    @property
+    def has_lyrics(self) -> bool:
+        return bool(self.lyrics)
+
+
+def _text(value):
+    """将标签值（ID3 帧 / 列表 / ASF 属性等）转为字符串"""
+    if value is None:
+        return None
+    if hasattr(value, 'text'):
+        value = value.text
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return None
+        value = value[0]
+    # 确保返回值是字符串类型，处理ASFUnicodeAttribute等特殊类型
+    return value if isinstance(value, str) else str(value)
+
+
+def _get(tags, key):
+    try:
+        return tags.get(key)
+    except Exception:
+        return None
+
+
+def _text_tag(tags, field):
+    for key in _TEXT_KEYS[field]:
+        val = _text(_get(tags, key))
+        if val:
+            return val
+    return None
+
+
+def _cover(audio, tags):
+    if tags is not None:
+        # MP3 / ID3
+        if hasattr(tags, 'getall'):
+            for tag in tags.getall('APIC'):
+                if getattr(tag, 'data', None):
+                    return tag.data
+        # M4A / MP4
+        covr = _get(tags, 'covr')
+        if covr:
+            val = covr[0] if isinstance(covr, (list, tuple)) else covr
+            try:
+                return bytes(val)
+            except Exception:
+                pass
+    # FLAC / 其他
+    pics = getattr(audio, 'pictures', None) or []
+    if pics:
+        return pics[0].data
+    return None
+
+
+def _lyrics(tags):
+    if tags is None:
+        return None
+    # MP3 / ID3 (USLT)
+    if hasattr(tags, 'getall'):
+        for frame in tags.getall('USLT'):
+            if frame.text:
+                return frame.text
+    # FLAC / Vorbis Comments、M4A / MP4
+    for key in _LYRICS_KEYS:
+        val = _text(_get(tags, key))
+        if val:
+            return val
+    return None
+
+
+def _codec(audio):
+    name = type(audio).__name__
+    if name in ('MP4', 'EasyMP4'):
+        codec = getattr(audio.info, 'codec', '') or ''
+        if codec.startswith('mp4a'):
+            return 'aac'
+        return codec or 'mp4'
+    return _CODECS.get(name, name.lower())
+
+
+def read_tags(file_path) -> TagRecord:
+    """
+    解析一次文件，返回 TagRecord
+
+    标题缺失时按文件名 "歌手 - 标题" 推断，歌手缺失时为 "未知艺术家"；
+    文件无法解析时只有推断出的标题/歌手，其余字段为 None。
+    """
+    title = artist = album = cover = lyrics = codec = None
+    info = None
+    try:
+        audio = File(file_path)
+        if audio is not None:
+            tags = audio.tags
+            if tags is not None:
+                title = _text_tag(tags, 'title')
+                artist = _text_tag(tags, 'artist')
+                album = _text_tag(tags, 'album')
+            cover = _cover(audio, tags)
+            lyrics = _lyrics(tags)
+            info = getattr(audio, 'info', None)
+            codec = _codec(audio)
+    except Exception as e:
+        logger.error(f"提取元数据失败: {file_path}, 错误: {e}")
+
+    filename = os.path.splitext(os.path.basename(file_path))[0]
+    if not title:
+        if ' - ' in filename:
+            parts = filename.split(' - ', 1)
+            if not artist:
+                artist = parts[0].strip()
+            title = parts[1].strip()
+        else:
+            title = filename
+    if not artist:
+        artist = UNKNOWN_ARTIST
+
+    def stream(attr):
+        val = getattr(info, attr, None)
+        return val if val else None
+
+    record = TagRecord(title, artist, album, cover, lyrics,
+                       stream('length'), stream('bitrate'), stream('sample_rate'),
+                       stream('channels'), stream('bits_per_sample'), codec)
+    logger.debug(f"文件 {file_path} 元数据: {record.title} / {record.artist} / {record.album}")
+    return record
@@ -98,14 +98,22 @@ def association(text_1: str, text_2: str) -> float:
     return similar_ratio
 
 
+# 使用这些分隔符对artists进行分割
+ARTIST_DELIMITERS = [",", "\\", "&", " ", "+", "|", "、", "，", "/"]
+
+
+def split_artists(text: str, delimiters=ARTIST_DELIMITERS) -> list:
+    """使用re分割多歌手字符串为列表，去除空项与首尾空白"""
+    delimiter_pattern = '|'.join(map(re.escape, delimiters))        # 构建正则表达式（自动转义）
+    return [item.strip() for item in re.split(delimiter_pattern, text or '') if item.strip()]
+
+
 def assoc_artists(text_1: str, text_2: str) -> float:
     if text_1 == "":
         return 0.5
-    delimiters = [",", "\\", "&", " ", "+", "|", "、", "，", "/"]    # 使用这些分隔符对artists进行分割
-    delimiter_pattern = '|'.join(map(re.escape, delimiters))        # 构建正则表达式（自动转义）
-    # 对文本进行繁简转换，使用re分割字符串为列表，并使用list-filter函数去除空项
-    text_li_1 = list(filter(None, re.split(delimiter_pattern, t2s(text_1))))
-    text_li_2 = list(filter(None, re.split(delimiter_pattern, t2s(text_2))))
+    # 对文本进行繁简转换后分割
+    text_li_1 = split_artists(t2s(text_1))
+    text_li_2 = split_artists(t2s(text_2))
     ar_ratio = calculate_duplicate_rate(text_li_1, text_li_2)
     return ar_ratio
 
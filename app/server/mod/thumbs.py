@@ -0,0 +1,187 @@
+"""
+封面缩略图缓存
+
+封面原图按到手时的尺寸保存（网易云封面为 1024px），列表里 48px 的小图也会拉取整张原图。
+ThumbnailCache 按需生成 64/256/512 三档缩略图（WebP，客户端不支持时为 JPEG），
+按源文件路径+mtime+大小 命名，源封面更新后自动生成新文件，旧文件由 LRU 淘汰。
+
+缓存目录总大小受 budget 限制，超出时按最近访问时间淘汰至 90%。
+缩放依赖 Pillow；未安装时只提供原图。
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = features = None
+
+logger = logging.getLogger(__name__)
+
+SIZES = (64, 256, 512)
+ORIGINAL = 'original'
+WEBP = 'webp'
+JPEG = 'jpeg'
+# 命中时刷新 mtime 的最小间隔（秒），重启后按 mtime 恢复 LRU 顺序
+TOUCH_INTERVAL = 3600
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def webp_supported() -> bool:
+    return Image is not None and features.check('webp')
+
+
+def parse_size(value):
+    """
+    size 参数 -> 缩略图档位（像素）；'original'/空 返回 None
+    任意像素值向上取最近的档位（超过最大档位时为原图），无法识别时抛出 ValueError
+    """
+    if value in (None, '', ORIGINAL):
+        return None
+    size = int(value)
+    if size <= 0:
+        raise ValueError(value)
+    for step in SIZES:
+        if size <= step:
+            return step
+    return None
+
+
+class ThumbnailCache:
+    """
+    :param cache_dir: 缩略图目录（每档一个子目录）
+    :param budget: 缓存总大小上限（字节），0 表示不限制
+    """
+
+    def __init__(self, cache_dir, budget=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._entries = None  # OrderedDict: path -> (size, 最近访问时间)，最久未访问的在前
+        self._total = 0
+        self._inflight = {}   # path -> Event，同一缩略图只生成一次
+
+    def _load(self):
+        """首次使用时按 mtime 恢复缓存目录的 LRU 顺序（调用方持有锁）"""
+        entries = []
+        for step in SIZES:
+            folder = os.path.join(self.cache_dir, str(step))
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_file() and not entry.name.endswith('.tmp'):
+                            st = entry.stat()
+                            entries.append((st.st_mtime, entry.path, st.st_size))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        self._entries = OrderedDict((path, (size, mtime)) for mtime, path, size in entries)
+        self._total = sum(size for _, _, size in entries)
+
+    def path_for(self, source, size, fmt):
+        st = os.stat(source)
+        key = hashlib.blake2b(f"{source}|{st.st_mtime_ns}|{st.st_size}".encode('utf-8', 'surrogateescape'),
+                              digest_size=12).hexdigest()
+        return os.path.join(self.cache_dir, str(size), f"{key}.{'webp' if fmt == WEBP else 'jpg'}")
+
+    def get(self, source, size, fmt=JPEG):
+        """返回 source 对应档位缩略图的路径（不存在时生成），无法生成时返回 None（调用方改用原图）"""
+        if Image is None:
+            return None
+        if fmt == WEBP and not webp_supported():
+            fmt = JPEG
+        path = self.path_for(source, size, fmt)
+        while True:
+            with self._lock:
+                if self._entries is None:
+                    self._load()
+                entry = self._entries.get(path)
+                if entry is not None:
+                    if os.path.exists(path):
+                        self._hit(path, entry)
+                        return path
+                    # 被外部删除
+                    del self._entries[path]
+                    self._total -= entry[0]
+                waiter = self._inflight.get(path)
+                if waiter is None:
+                    waiter = self._inflight[path] = threading.Event()
+                    break
+            # 其他请求正在生成同一张缩略图
+            waiter.wait()
+            if not os.path.exists(path):
+                return None
+        try:
+            written = self._render(source, path, size, fmt)
+            with self._lock:
+                if written:
+                    self._entries[path] = (written, os.path.getmtime(path))
+                    self._total += written
+                    self._evict()
+            return path if written else None
+        finally:
+            with self._lock:
+                self._inflight.pop(path).set()
+
+    def _hit(self, path, entry):
+        self._entries.move_to_end(path)
+        now = time.time()
+        if now - entry[1] >= TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self._entries[path] = (entry[0], now)
+
+    def _render(self, source, path, size, fmt):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with Image.open(source) as img:
+                img.draft('RGB', (size, size))  # JPEG 在解码时直接按比例缩小
+                img = img.convert('RGB')
+                img.thumbnail((size, size), Image.LANCZOS)
+                if fmt == WEBP:
+                    img.save(tmp, 'WEBP', quality=80, method=4)
+                else:
+                    img.save(tmp, 'JPEG', quality=82, optimize=True, progressive=True)
+            os.replace(tmp, path)
+            return os.path.getsize(path)
+        except Exception as e:
+            logger.warning(f"生成缩略图失败: {source} ({e})")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return 0
+
+    def _evict(self):
+        """超出预算时删除最久未访问的缩略图，降到预算的 90%（调用方持有锁）"""
+        if not self.budget or self._total <= self.budget:
+            return
+        target = self.budget * 0.9
+        removed = 0
+        while self._entries and self._total > target:
+            path, (size, _) = self._entries.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._total -= size
+            removed += 1
+        logger.info(f"缩略图缓存超出上限，已淘汰 {removed} 个文件")
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            return {'files': len(self._entries), 'bytes': self._total, 'budget': self.budget,
+                    'available': available()}
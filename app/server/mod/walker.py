@@ -0,0 +1,120 @@
+"""
+基于 os.scandir 的并行目录遍历
+
+目录读取（网络挂载上主要耗时在 I/O 往返）交给线程池预读，结果仍按确定的深度优先顺序产出：
+- walk() 逐个产出 DirListing（目录先序，子目录按 名称+分隔符 排序）
+- iter_files() 展开为 FileRecord 流，顺序与对完整路径做字符串排序一致
+  （即与 SQLite `ORDER BY path` 一致），可直接与数据库做有序比对
+- 可传入 unchanged(path, mtime) 判定目录自上次扫描后未变化，此类目录只列出子目录，不再 stat 其中的文件
+"""
+
+import collections
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# 程序自动生成的目录，不参与扫描
+DEFAULT_EXCLUDE = ('lyrics', 'covers')
+
+
+class FileRecord(NamedTuple):
+    path: str
+    filename: str
+    mtime: float
+    size: int
+
+
+class DirListing(NamedTuple):
+    path: str
+    mtime: float
+    files: list     # [FileRecord]，按文件名排序
+    subdirs: list   # [子目录完整路径]，按 名称+分隔符 排序
+    unchanged: bool = False  # 目录未变化，files 未读取（为空）
+
+
+def _subdir_key(path):
+    return os.path.basename(path) + os.sep
+
+
+def scan_dir(path, exts, exclude=DEFAULT_EXCLUDE, unchanged=None) -> DirListing:
+    """读取单个目录：匹配扩展名的文件（使用 DirEntry.stat）与子目录；无法读取时返回空列表"""
+    files, subdirs = [], []
+    try:
+        # 先取目录 mtime 再列目录：列目录期间发生的变更会在下次扫描时被发现
+        mtime = os.stat(path).st_mtime
+        skip_files = unchanged is not None and unchanged(path, mtime)
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in exclude:
+                            subdirs.append(entry.path)
+                    elif not skip_files and entry.name.lower().endswith(exts):
+                        st = entry.stat()
+                        files.append(FileRecord(entry.path, entry.name, st.st_mtime, st.st_size))
+                except OSError:
+                    pass
+    except OSError as e:
+        logger.warning(f"读取目录失败: {path} ({e})")
+        return DirListing(path, 0, [], [])
+    files.sort(key=lambda f: f.filename)
+    subdirs.sort(key=_subdir_key)
+    return DirListing(path, mtime, files, subdirs, skip_files)
+
+
+class Walker:
+    """
+    :param exts: 需要收集的文件扩展名（小写，tuple）
+    :param workers: 每个扫描根目录使用的读目录线程数
+    :param prefetch: 最多提前读取的目录数（限制内存与并发 I/O）
+    :param unchanged: 可选 unchanged(path, mtime) -> bool，在读目录线程中调用，需线程安全
+    """
+
+    def __init__(self, exts, exclude=DEFAULT_EXCLUDE, workers=8, prefetch=64, unchanged=None):
+        self.exts = tuple(exts)
+        self.exclude = tuple(exclude)
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self.unchanged = unchanged
+
+    def walk(self, root):
+        """按深度优先先序产出 root 下每个目录的 DirListing"""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='walker') as pool:
+            # 待处理目录按产出顺序排列，元素为路径（未提交）或 Future（已在预读）
+            pending = collections.deque([root])
+            while pending:
+                for i in range(min(len(pending), self.prefetch)):
+                    if isinstance(pending[i], str):
+                        pending[i] = pool.submit(scan_dir, pending[i], self.exts, self.exclude, self.unchanged)
+                listing = pending.popleft().result()
+                pending.extendleft(reversed(listing.subdirs))
+                yield listing
+
+    def iter_files(self, roots, on_dir=None):
+        """
+        依次遍历各根目录，按路径排序产出 FileRecord
+
+        :param on_dir: 可选 on_dir(listing)，每个目录在其下的文件产出之前回调一次
+        """
+        for root in roots:
+            if not os.path.isdir(root):
+                continue
+            listings = self.walk(root)
+            yield from self._flatten(next(listings), listings, on_dir)
+
+    def _flatten(self, listing, listings, on_dir):
+        if on_dir is not None:
+            on_dir(listing)
+        # 文件与子目录交错排序：子目录内的路径以 "名称/" 为前缀参与比较
+        entries = [(f.filename, f) for f in listing.files]
+        entries.extend((_subdir_key(d), None) for d in listing.subdirs)
+        entries.sort(key=lambda e: e[0])
+        for _, record in entries:
+            if record is not None:
+                yield record
+            else:
+                # walk() 按相同的子目录顺序产出，下一个即为该子目录
+                yield from self._flatten(next(listings), listings, on_dir)
@@ -0,0 +1,323 @@
+"""
+文件监听事件的合并与批量处理
+
+监听线程只负责 EventCoalescer.add()（按路径去重后立即返回），后台分发线程按时间窗口取出一批事件：
+首个事件到达后再等待 window 秒收集后续事件，累计达到 max_batch 条或距首个事件超过 max_wait 秒时立即提交。
+新增/修改的文件需在 settle 秒内大小与 mtime 不再变化才提交（正在复制的文件留到之后的批次），
+提交时以 handler({path: action}) 调用，由调用方完成解析与单事务写库。
+
+WatchManager 按根目录选择监听方式：本地磁盘使用 watchdog 原生监听，网络挂载（NFS/SMB 等，
+原生监听看不到其他主机的修改）使用 PollingWatcher 比较目录 mtime 快照；增删挂载点时只调整变化的根目录。
+"""
+
+import logging
+import os
+import threading
+import time
+
+from mod import libdiff, walker
+
+logger = logging.getLogger(__name__)
+
+CREATED = 'created'
+DELETED = 'deleted'
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+    except OSError:
+        return None
+
+
+class EventCoalescer:
+    """
+    :param handler: handler(batch)，batch 为 {path: CREATED | DELETED}，在分发线程中调用
+    :param window: 收到事件后继续收集的时间（秒）
+    :param max_wait: 一批事件从首个到达到提交的最长等待时间（秒）
+    :param max_batch: 单批最多事件数
+    :param settle: 文件大小/mtime 保持不变多久后视为写入完成（秒）
+    """
+
+    def __init__(self, handler, window=1.0, max_wait=5.0, max_batch=500, settle=1.0):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.settle = settle
+        self._cond = threading.Condition()
+        self._pending = {}   # path -> action（保持到达顺序）
+        self._settling = {}  # path -> (stat_key, 最近一次变化时间)
+        self._first_at = None
+        self._last_at = None
+        self._hold_until = 0  # 上一批留下仍在写入的文件时，下一个窗口前不再检查
+        self._thread = None
+
+    def add(self, path, action):
+        """记录一个事件（同一路径只保留最后的动作）"""
+        with self._cond:
+            self._pending.pop(path, None)
+            self._pending[path] = action
+            if action == DELETED:
+                self._settling.pop(path, None)
+            now = time.monotonic()
+            if self._first_at is None:
+                self._first_at = now
+            self._last_at = now
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='watch-coalescer', daemon=True)
+                self._thread.start()
+
+    def _deadline(self):
+        if len(self._pending) >= self.max_batch:
+            deadline = 0
+        else:
+            deadline = min(self._last_at + self.window, self._first_at + self.max_wait)
+        return max(deadline, self._hold_until)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    delay = self._deadline() - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                batch = self._take()
+            if not batch:
+                continue  # 全部在写入中，下一个窗口再检查
+            try:
+                self.handler(batch)
+            except Exception as e:
+                logger.exception(f"处理文件变更批次失败: {e}")
+
+    def _take(self):
+        """取出可提交的事件（调用方持有锁）；仍在写入的文件保留在队列中"""
+        now = time.monotonic()
+        batch, waiting = {}, {}
+        for path, action in self._pending.items():
+            if len(batch) >= self.max_batch:
+                waiting[path] = action
+                continue
+            if action == CREATED:
+                key = _stat_key(path)
+                if key is None:
+                    # 已被删除或移走
+                    self._settling.pop(path, None)
+                    batch[path] = DELETED
+                    continue
+                prev = self._settling.get(path)
+                if prev is None or prev[0] != key:
+                    self._settling[path] = (key, now)
+                    if self.settle > 0:
+                        waiting[path] = action
+                        continue
+                elif now - prev[1] < self.settle:
+                    waiting[path] = action
+                    continue
+                self._settling.pop(path, None)
+            batch[path] = action
+        self._pending = waiting
+        if waiting:
+            self._first_at = self._last_at = now
+            self._hold_until = now + self.window
+        else:
+            self._first_at = self._last_at = None
+        return batch
+
+
+# --- 监听方式 ---
+# 网络文件系统上 inotify 等原生监听看不到其他主机的修改，改用轮询
+NETWORK_FS_TYPES = {
+    'nfs', 'nfs4', 'cifs', 'smb', 'smbfs', 'smb3', 'afs', 'ceph', 'glusterfs', '9p', 'davfs', 'ncpfs',
+    'fuse.sshfs', 'fuse.rclone', 'fuse.s3fs', 'fuse.glusterfs', 'fuse.davfs2',
+}
+
+NATIVE = 'native'
+POLL = 'poll'
+MODES = ('auto', NATIVE, POLL)
+
+
+def _unescape_mount(path):
+    # /proc/mounts 中空格等字符以八进制转义
+    return path.replace('\\040', ' ').replace('\\011', '\t').replace('\\012', '\n').replace('\\134', '\\')
+
+
+def mount_fstype(path):
+    """path 所在挂载点的文件系统类型（读取 /proc/self/mounts），无法判断时返回 None"""
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    try:
+        with open('/proc/self/mounts', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mnt = _unescape_mount(parts[1])
+                prefix = mnt.rstrip('/') + '/'
+                if (path == mnt or path.startswith(prefix)) and len(mnt) >= len(best):
+                    best, fstype = mnt, parts[2]
+    except OSError:
+        return None
+    return fstype
+
+
+def is_network_path(path) -> bool:
+    if os.name == 'nt':
+        return path.startswith('\\\\')  # UNC 共享路径
+    fstype = mount_fstype(path)
+    return fstype is not None and fstype.lower() in NETWORK_FS_TYPES
+
+
+class PollingWatcher:
+    """
+    目录 mtime 快照轮询
+
+    快照只记录每个目录的 mtime、子目录与匹配扩展名的文件名。每轮对已知目录各 stat 一次，
+    只有 mtime 变化的目录才重新列出（新增/删除/改名都会更新所在目录的 mtime），
+    与上次的文件名集合比较后以 emit(path, CREATED | DELETED) 上报。
+    原地修改文件内容不会改变目录 mtime，由定期深度扫描兜底。
+    """
+
+    def __init__(self, root, emit, exts, interval=60.0, exclude=walker.DEFAULT_EXCLUDE):
+        self.root = root
+        self.emit = emit
+        self.exts = tuple(exts)
+        self.interval = interval
+        self.exclude = tuple(exclude)
+        self._dirs = {}  # path -> (mtime, subdirs, frozenset(文件名))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='watch-poll', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        self.poll(initial=True)
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"轮询目录失败: {self.root} ({e})")
+
+    def poll(self, initial=False):
+        seen = set()
+        stack = [self.root]
+        while stack and not self._stop.is_set():
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            seen.add(path)
+            state = self._dirs.get(path)
+            if state is None or state[0] != mtime:
+                listing = walker.scan_dir(path, self.exts, self.exclude)
+                names = frozenset(f.filename for f in listing.files)
+                if not initial:
+                    old = state[2] if state else frozenset()
+                    for name in sorted(names - old):
+                        self.emit(os.path.join(path, name), CREATED)
+                    for name in sorted(old - names):
+                        self.emit(os.path.join(path, name), DELETED)
+                state = self._dirs[path] = (listing.mtime, tuple(listing.subdirs), names)
+            stack.extend(state[1])
+        if self._stop.is_set():
+            return
+        for path in [p for p in self._dirs if p not in seen]:
+            # 目录已被删除（或移走）
+            for name in sorted(self._dirs.pop(path)[2]):
+                self.emit(os.path.join(path, name), DELETED)
+
+
+class WatchManager:
+    """
+    按扫描根目录管理监听：本地磁盘使用 watchdog 原生监听（inotify 等），网络挂载与目录过多的树使用轮询
+
+    :param observer: watchdog Observer（None 时全部使用轮询）
+    :param handler: 原生监听的 FileSystemEventHandler
+    :param emit: 轮询发现变更时调用 emit(path, action)
+    :param mode: 'auto' 按文件系统类型选择；'native' / 'poll' 强制使用一种方式
+    :param prefer_poll: 可选 prefer_poll(root) -> bool，auto 模式下本地目录是否也改用轮询（如目录数过多）
+    """
+
+    def __init__(self, observer, handler, emit, exts, mode='auto', poll_interval=60.0, prefer_poll=None):
+        self.observer = observer
+        self.handler = handler
+        self.emit = emit
+        self.exts = tuple(exts)
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.prefer_poll = prefer_poll
+        self._lock = threading.Lock()
+        self._watches = {}  # root -> (NATIVE, ObservedWatch) | (POLL, PollingWatcher)
+
+    def _choose(self, root):
+        if self.observer is None or self.mode == POLL:
+            return POLL
+        if self.mode == NATIVE:
+            return NATIVE
+        if is_network_path(root):
+            return POLL
+        if self.prefer_poll is not None and self.prefer_poll(root):
+            return POLL
+        return NATIVE
+
+    def sync(self, roots):
+        """使监听集合与 roots 一致：只移除/添加有变化的根目录，已有的监听保持不动"""
+        targets = [r for r in libdiff.normalize_roots(roots) if os.path.isdir(r)]
+        with self._lock:
+            for root in [r for r in self._watches if r not in targets]:
+                self._remove(root)
+            for root in targets:
+                if root not in self._watches:
+                    self._add(root)
+
+    def _add(self, root):
+        kind = self._choose(root)
+        if kind == NATIVE:
+            try:
+                self._watches[root] = (NATIVE, self.observer.schedule(self.handler, root, recursive=True))
+                logger.info(f"监听目录: {root}")
+                return
+            except Exception as e:
+                # 如 inotify 监听数达到上限 (ENOSPC)
+                logger.warning(f"无法原生监听目录 {root}，改用轮询: {e}")
+        poller = PollingWatcher(root, self.emit, self.exts, self.poll_interval)
+        poller.start()
+        self._watches[root] = (POLL, poller)
+        logger.info(f"轮询监听目录: {root} (间隔 {self.poll_interval:g} 秒)")
+
+    def _remove(self, root):
+        kind, watch = self._watches.pop(root)
+        try:
+            if kind == NATIVE:
+                self.observer.unschedule(watch)
+            else:
+                watch.stop()
+            logger.info(f"停止监听目录: {root}")
+        except Exception as e:
+            logger.warning(f"停止监听目录失败: {root} ({e})")
+
+    def watches(self) -> dict:
+        """root -> 监听方式"""
+        with self._lock:
+            return {root: kind for root, (kind, _) in self._watches.items()}
+
+    def stop(self):
+        with self._lock:
+            for kind, watch in self._watches.values():
+                if kind == POLL:
+                    watch.stop()
+            self._watches.clear()
+        if self.observer is not None:
+            self.observer.stop()
@@ -0,0 +1,229 @@
+"""
+扫描比对的行为检查：目录遍历顺序、归并比对、根目录规范化与旧库结构迁移
+
+归并比对要求磁盘侧与数据库侧的路径顺序完全一致，顺序错位会把仍在磁盘上的歌曲当作删除，
+这里用容易排错的同名前缀目录（A、A-B、A B、A.d）覆盖这一点。
+
+用法: python test_library_scan.py （也可用 pytest 运行）
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mod import catalog, db, libdiff, libsearch, roots, schema, walker
+
+EXTS = ('.mp3',)
+
+# 文件与目录名故意互为前缀："-"、" "、"." 的码点都小于 "/"，按路径排序时 A-B/x 排在 A/x 之前
+TREE = [
+    'A.mp3',
+    'A/B/c.mp3',
+    'A/a.mp3',
+    'A/z.mp3',
+    'A-B/x.mp3',
+    'A-B.mp3',
+    'A B/y.mp3',
+    'A.d/q.mp3',
+    'AB/w.mp3',
+    'a/lower.mp3',
+    'A/covers/skip.mp3',  # 程序生成的目录，不参与扫描
+    'A/not-audio.txt',
+]
+
+
+def make_tree(base):
+    for rel in TREE:
+        path = os.path.join(base, *rel.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(rel.encode('utf-8'))
+    return [os.path.join(base, *rel.split('/')) for rel in TREE
+            if rel.endswith('.mp3') and '/covers/' not in rel]
+
+
+def with_tree(fn):
+    base = tempfile.mkdtemp(prefix='2fmusic-test-')
+    try:
+        return fn(base, make_tree(base))
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def songs_db(rows):
+    """内存中的 songs 表 (path, mtime, size)，与正式库一样使用 BINARY 排序"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE songs (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER)")
+    conn.executemany("INSERT INTO songs (path, mtime, size) VALUES (?, ?, ?)", rows)
+    return conn
+
+
+def test_iter_files_order():
+    def check(base, files):
+        paths = [f.path for f in walker.Walker(EXTS, workers=2, prefetch=2).iter_files([base])]
+        assert paths == sorted(files), paths
+        # 与 SQLite ORDER BY path 的顺序一致
+        conn = songs_db([(p, 0, 0) for p in files])
+        assert paths == [r[0] for r in conn.execute("SELECT path FROM songs ORDER BY path")]
+    with_tree(check)
+
+
+def test_iter_files_multiple_roots():
+    def check(base, files):
+        # 传入的根目录无序且互相嵌套，规范化后依次遍历的结果仍整体有序、不重复
+        roots_ = libdiff.normalize_roots([os.path.join(base, 'A'), os.path.join(base, 'A-B'),
+                                          os.path.join(base, 'A', 'B')])
+        paths = [f.path for f in walker.Walker(EXTS).iter_files(roots_)]
+        expected = sorted(p for p in files if libdiff.under(p, [os.path.join(base, 'A'), os.path.join(base, 'A-B')]))
+        assert paths == expected, paths
+    with_tree(check)
+
+
+def test_normalize_roots():
+    base = os.path.abspath(os.sep + 'music')
+    a, ab, a_b = os.path.join(base, 'A'), os.path.join(base, 'A-B'), os.path.join(base, 'A', 'B')
+    # 去重、去掉末尾分隔符、去掉嵌套的根目录、忽略空值，按 路径+分隔符 排序
+    assert libdiff.normalize_roots([a + os.sep, a_b, ab, a, '', None]) == [ab, a]
+    # 前缀相同但不是子目录的根目录不能被当作嵌套去掉
+    assert libdiff.normalize_roots([os.path.join(base, 'AB'), a]) == [a, os.path.join(base, 'AB')]
+    assert libdiff.normalize_roots([base, a, ab]) == [base]
+    assert libdiff.normalize_roots(['relative']) == [os.path.abspath('relative')]
+
+
+def test_merge():
+    files = [walker.FileRecord(p, os.path.basename(p), 1.0, 10) for p in ('/m/A/a', '/m/A/b', '/m/A/c', '/m/A-B/d')]
+    rows = [('/m/A-B/d', 1.0, 10), ('/m/A/a', 1.0, 10), ('/m/A/b', 2.0, 10), ('/m/A/gone', 1.0, 10), ('/m/Z', 1.0, 1)]
+    # merge 的两个输入须按路径升序
+    files.sort(key=lambda f: f.path)
+    rows.sort()
+    changes = [(c.op, c.path) for c in libdiff.merge(files, rows)]
+    assert changes == [
+        (libdiff.UPDATE, '/m/A/b'),
+        (libdiff.INSERT, '/m/A/c'),
+        (libdiff.DELETE, '/m/A/gone'),
+        (libdiff.DELETE, '/m/Z'),
+    ], changes
+
+    # keep 只对数据库中有、磁盘上未列出的路径调用，返回 True 时不产出删除
+    asked = []
+
+    def keep(path):
+        asked.append(path)
+        return path.startswith('/m/Z')
+
+    changes = [(c.op, c.path) for c in libdiff.merge(files, rows, keep)]
+    assert asked == ['/m/A/gone', '/m/Z'], asked
+    assert (libdiff.DELETE, '/m/Z') not in changes
+    assert (libdiff.DELETE, '/m/A/gone') in changes
+
+    # 任一侧为空
+    assert [c.op for c in libdiff.merge([], rows)] == [libdiff.DELETE] * len(rows)
+    assert [c.op for c in libdiff.merge(files, [])] == [libdiff.INSERT] * len(files)
+
+
+def test_diff_against_disk():
+    def check(base, files):
+        stats = {p: os.stat(p) for p in files}
+        removed = os.path.join(base, 'A', 'removed.mp3')
+        outside = os.path.join(os.path.dirname(base), 'elsewhere', 'song.mp3')
+        rows = [(p, stats[p].st_mtime, stats[p].st_size) for p in files
+                if not p.endswith('A-B.mp3')]               # 新增
+        rows = [(p, m - 1 if p.endswith('z.mp3') else m, s) for p, m, s in rows]  # 变更
+        rows += [(removed, 0, 0), (outside, 0, 0)]           # 删除
+        conn = songs_db(rows)
+        w = walker.Walker(EXTS)
+
+        changes = sorted((c.op, c.path) for c in libdiff.diff(conn, w, [base]))
+        assert changes == sorted([
+            (libdiff.INSERT, os.path.join(base, 'A-B.mp3')),
+            (libdiff.UPDATE, os.path.join(base, 'A', 'z.mp3')),
+            (libdiff.DELETE, removed),
+            (libdiff.DELETE, outside),
+        ]), changes
+
+        # 只比对根目录范围内的歌曲时，范围外的歌曲不产出删除
+        changes = [(c.op, c.path) for c in libdiff.diff(conn, w, [base], whole_library=False)]
+        assert (libdiff.DELETE, outside) not in changes and (libdiff.DELETE, removed) in changes
+
+        # 数据库侧分页读取：页边界落在同名前缀目录之间也不能漏行或重复
+        for size in (1, 2, 3):
+            paged = [r[0] for r in libdiff.iter_db_rows(conn, page_size=size)]
+            assert paged == sorted(r[0] for r in rows), (size, paged)
+            paged = [r[0] for r in libdiff.iter_db_rows(conn, [os.path.join(base, 'A-B'), os.path.join(base, 'A')],
+                                                        page_size=size)]
+            assert paged == sorted(p for p, _, _ in rows if libdiff.under(p, [os.path.join(base, 'A-B'),
+                                                                               os.path.join(base, 'A')])), paged
+            changes = [(c.op, c.path) for c in libdiff.merge(w.iter_files([base]), libdiff.iter_db_rows(conn, page_size=size))]
+            assert len(changes) == 4, changes
+    with_tree(check)
+
+
+def open_test_database(path):
+    """与 app.open_database 注册相同的 SQL 函数（迁移中的触发器依赖它们）"""
+    database = db.Database(path)
+    database.create_function(libsearch.FOLD_FUNCTION, 1, libsearch.fold)
+    database.create_function(catalog.SPLIT_FUNCTION, 1, catalog.split_artists_json)
+    database.create_function(catalog.PRIMARY_FUNCTION, 1, catalog.primary_artist)
+    database.create_function(roots.DIR_ID_FUNCTION, 1, roots.dir_id)
+    return database
+
+
+def test_migrate_baseline_db():
+    base = tempfile.mkdtemp(prefix='2fmusic-test-')
+    path = os.path.join(base, 'data.db')
+    try:
+        # 引入结构迁移之前 init_db 建立的表
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+            CREATE TABLE songs (id TEXT PRIMARY KEY, path TEXT UNIQUE, filename TEXT, title TEXT, artist TEXT,
+                                album TEXT, mtime REAL, size INTEGER, has_cover INTEGER DEFAULT 0);
+            CREATE TABLE favorite_playlists (id TEXT PRIMARY KEY, name TEXT NOT NULL, is_default INTEGER DEFAULT 0,
+                                             created_at REAL);
+            CREATE TABLE favorites (song_id TEXT, playlist_id TEXT, title TEXT DEFAULT '', artist TEXT DEFAULT '',
+                                    created_at REAL, PRIMARY KEY (song_id, playlist_id));
+            CREATE TABLE mount_points (path TEXT PRIMARY KEY, created_at REAL);
+            CREATE TABLE system_settings (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        conn.executemany("INSERT INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            ('s1', '/music/周杰倫 - 晴天.mp3', '周杰倫 - 晴天.mp3', '晴天', '周杰倫', '葉惠美', 1.0, 100, 1),
+            ('s2', '/mnt/ext/B - Two.mp3', 'B - Two.mp3', 'Two', 'A/B', '', 2.0, 200, 0),
+        ])
+        conn.execute("INSERT INTO mount_points VALUES ('/mnt/ext', 0)")
+        conn.execute("INSERT INTO favorite_playlists VALUES ('default', '默认收藏夹', 1, 0)")
+        conn.execute("INSERT INTO favorites VALUES ('s1', 'default', '晴天', '周杰倫', 0)")
+        conn.commit()
+        conn.close()
+
+        database = open_test_database(path)
+        latest = schema.MIGRATIONS[-1][0]
+        assert database.migrate(schema.MIGRATIONS) == latest
+        # 再次执行不重复应用
+        assert database.migrate(schema.MIGRATIONS) == latest
+
+        with database.connection() as conn:
+            assert [r[0] for r in conn.execute("SELECT id FROM songs ORDER BY id")] == ['s1', 's2']
+            assert conn.execute("SELECT COUNT(*) FROM favorites").fetchone()[0] == 1
+            stats = {r[0]: r[1] for r in conn.execute("SELECT key, value FROM library_stats")}
+            assert stats['songs'] == 2 and stats['total_size'] == 300 and stats['covers'] == 1, stats
+            # 检索索引已由迁移重建，繁简互搜
+            assert [r['id'] for r in libsearch.search(conn, '晴天')] == ['s1']
+            assert [r['id'] for r in libsearch.search(conn, '周杰伦')] == ['s1']
+            artists = {r[0]: r[1] for r in conn.execute("SELECT name, song_count FROM artists")}
+            assert artists.get('周杰倫') == 1, artists
+            mount = conn.execute("SELECT id, song_count, total_size FROM mount_points").fetchone()
+            assert mount[0] is not None
+        database.close()
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f"[通过] {name}")
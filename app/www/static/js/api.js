@@ -235,6 +235,11 @@ export const api = {
         throw error;
       }
     },
+    async search(query, limit = 200) {
+      const params = new URLSearchParams({ q: query, limit: String(limit) });
+      const res = await fetch(`/api/music/search?${params}`);
+      return jsonOrThrow(res);
+    },
     async deleteFile(filename) {
       const encodedName = encodeURIComponent(filename);
       const res = await fetch(`/api/music/delete/${encodedName}`, { method: 'DELETE' });
@@ -1,5 +1,6 @@
 import { state } from './state.js';
 import { ui } from './ui.js';
+import { coverThumb } from './utils.js';
 
 // 歌手聚合视图 - 按歌手分组显示歌曲
 export function renderArtistAggregateView(songs, playTrack) {
@@ -104,7 +105,7 @@ function openArtistModal(artistName, artistSongs, playTrack) {
     
     songItem.innerHTML = `
       <div class="artist-modal-song-cover">
-        <img src="${song.cover}" loading="lazy">
+        <img src="${coverThumb(song.cover, 64)}" loading="lazy">
       </div>
       <div class="artist-modal-song-info">
         <div class="artist-modal-song-title">${song.title}</div>
@@ -14,9 +14,28 @@ export function startScanPolling(isUserAction = false, onRefreshSongs, onRefresh
   let hasTrackedScrape = false;
   let lastScrapingPath = null;
   let lastScrapingMsg = null; // Store final message
+  let pollTimer = null;
+  let polling = false;
+  let wakePending = false;
+  let eventsConnected = false;
+
+  // 服务端推送 (SSE)：连接正常时空闲期降低轮询频率，收到状态变更后立即轮询一次
+  const wake = () => {
+    if (hasTrackedScan || hasTrackedScrape || state.isPollingFast) return; // 已在快速轮询
+    if (polling) { wakePending = true; return; }
+    clearTimeout(pollTimer);
+    pollTimer = setTimeout(poll, 0);
+  };
+  if (typeof EventSource !== 'undefined') {
+    const events = new EventSource('/api/events');
+    events.onopen = () => { eventsConnected = true; };
+    events.onerror = () => { eventsConnected = false; };
+    ['scan', 'library'].forEach(topic => events.addEventListener(topic, wake));
+  }
 
   // 轮询函数，使用 setTimeout 实现动态间隔
   const poll = async () => {
+    polling = true;
     try {
       const status = await api.system.status();
       const isModalOpen = ui.uploadModal && ui.uploadModal.classList.contains('active');
@@ -171,12 +190,15 @@ export function startScanPolling(isUserAction = false, onRefreshSongs, onRefresh
     } catch (e) {
       console.error('Poll error', e);
     } finally {
-      // 动态调整间隔：正在扫描或刮削时 0.5s，否则 1s
+      // 动态调整间隔：正在扫描或刮削时 0.5s，否则 1s（SSE 已连接时 10s，变更由推送唤醒）
       // Speed up polling to catch fast scraping tasks
-      const delay = (hasTrackedScan || hasTrackedScrape || state.isPollingFast) ? 500 : 1000;
+      const fast = hasTrackedScan || hasTrackedScrape || state.isPollingFast;
+      const delay = wakePending ? 0 : (fast ? 500 : (eventsConnected ? 10000 : 1000));
       // Set a flag to keep fast polling for a moment after completion?
       // Simplified: just check if we are *tracking* something.
-      setTimeout(poll, delay);
+      polling = false;
+      wakePending = false;
+      pollTimer = setTimeout(poll, delay);
     }
   };
 
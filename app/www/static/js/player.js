@@ -1,7 +1,7 @@
 import { state, persistState, saveFavorites, savePlaylist, saveCachedPlaylists, saveCachedPlaylistSongs, updateListenStats, getListenStats } from './state.js';
 import { ui } from './ui.js';
 import { api } from './api.js';
-import { showToast, showConfirmDialog, hideProgressToast, updateDetailFavButton, formatTime, renderNoLyrics, updateSliderFill, flyToElement, throttle, extractColorFromImage } from './utils.js';
+import { showToast, showConfirmDialog, hideProgressToast, updateDetailFavButton, formatTime, renderNoLyrics, updateSliderFill, flyToElement, throttle, extractColorFromImage, coverThumb } from './utils.js';
 import { startScanPolling, loadMountPoints } from './mounts.js';
 import { showPlaylistSelectDialog, loadPlaylistFilter, handlePlaylistFilterChange, showCreatePlaylistDialog, clearPlaylistCache } from './favorites.js';
 import { batchManager } from './batch-manager.js';
@@ -599,7 +599,7 @@ export function renderPlaylist() {
       if (song.isExternal) card.style.border = '1px dashed var(--primary)';
 
       // 卡片内容（不包含复选框和收藏按钮）
-      card.innerHTML = `<img src="${song.cover}" loading="lazy"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>`;
+      card.innerHTML = `<img src="${coverThumb(song.cover, 256)}" loading="lazy"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>`;
 
       card.addEventListener('click', (e) => {
         // 防止点击复选框时触发播放
@@ -1206,7 +1206,7 @@ export function renderPlaylistSongs(songs, skipSort = false) {
     const playCountBadge = stats && stats.playCount >= 1 ? `<span class="play-count-badge" title="已播放${stats.playCount}次">${formatPlayCount(stats.playCount)}</span>` : '';
 
     // 卡片内容（不包含复选框和收藏按钮）
-    card.innerHTML = `<img src="${song.cover}" loading="lazy"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>${playCountBadge}`;
+    card.innerHTML = `<img src="${coverThumb(song.cover, 256)}" loading="lazy"><div class="card-info"><div class="title" title="${song.title}">${song.title}</div><div class="artist">${song.artist}</div></div>${playCountBadge}`;
 
     card.addEventListener('click', (e) => {
       // 防止点击复选框时触发播放
@@ -1512,6 +1512,32 @@ export async function playTrack(index, autoPlay = true) {
   persistState(ui.audio);
 }
 
+// 按封面主色调设置全屏播放器背景与菜单底色
+function applyCoverColor(color) {
+  if (!color || !ui.fullPlayerOverlay) return;
+  // 移动端防止背景太透导致看到下面的列表 (透视问题)
+  const isMobile = window.innerWidth <= 768;
+  const alpha = isMobile ? 0.98 : 0.8;
+  const rgbaStr = `rgba(${color.r}, ${color.g}, ${color.b}, ${alpha})`;
+
+  // 1. 设置全屏背景渐变
+  ui.fullPlayerOverlay.style.background = `linear-gradient(to bottom, ${rgbaStr} 0%, #000 120%)`;
+
+  // 2. 设置动态菜单背景色 (使用提取的 RGB + 0.7 透明度)
+  // 这样 Action Menu 就有了跟随封面的半透明背景
+  document.documentElement.style.setProperty('--dynamic-glass-color', `rgba(${color.r}, ${color.g}, ${color.b}, 0.7)`);
+}
+
+// 服务端计算的调色板（主色调在前）可在封面加载前直接应用主题色
+function applyTrackPalette(track) {
+  const fpCover = document.getElementById('fp-cover');
+  const hex = track && track.palette && track.palette[0];
+  if (fpCover) fpCover.dataset.color = hex || '';
+  if (!hex) return;
+  const value = parseInt(hex.slice(1), 16);
+  applyCoverColor({ r: (value >> 16) & 255, g: (value >> 8) & 255, b: value & 255 });
+}
+
 function loadTrackInfo(track) {
   if (!track) return;
   ['current-title', 'fp-title'].forEach(id => { const el = document.getElementById(id); if (el) el.innerText = track.title; });
@@ -1519,6 +1545,7 @@ function loadTrackInfo(track) {
   // 更健壮的封面处理，确保始终有封面显示
   const coverSrc = track.cover && track.cover.trim() !== '' ? track.cover : '/static/images/ICON_256.PNG';
   ['current-cover', 'fp-cover'].forEach(id => { const el = document.getElementById(id); if (el) el.src = coverSrc; });
+  applyTrackPalette(track);
   updateDetailFavButton(state.favorites.has(track.id));
   document.title = `${track.title} - 2FMusic`;
   if (ui.lyricsContainer) ui.lyricsContainer.innerHTML = '';
@@ -1835,6 +1862,7 @@ async function checkAndFetchMetadata(track, fetchId) {
           if (d.success && d.album_art) {
             console.log('[API] 封面加载成功 (', Math.round(performance.now() - startTime), 'ms )');
             track.cover = d.album_art;
+            if (d.palette) track.palette = d.palette;
             savePlaylist(); // 保存封面更新
             
             // 根据用户设置决定是否保存到缓存
@@ -1851,7 +1879,7 @@ async function checkAndFetchMetadata(track, fetchId) {
               console.log('[Cache] 封面缓存已禁用，跳过保存');
             }
             
-            if (ui.audio.src.includes(encodeURIComponent(track.id))) { ['current-cover', 'fp-cover'].forEach(id => { const el = document.getElementById(id); if (el) el.src = track.cover; }); }
+            if (ui.audio.src.includes(encodeURIComponent(track.id))) { ['current-cover', 'fp-cover'].forEach(id => { const el = document.getElementById(id); if (el) el.src = track.cover; }); applyTrackPalette(track); }
             renderPlaylist();
           }
         } catch (err) {
@@ -2121,14 +2149,32 @@ export function bindPlayerEvents() {
     });
   }
 
-  ui.searchInput?.addEventListener('input', (e) => {
-    const term = e.target.value.toLowerCase().trim();
+  // 先本地即时过滤，停止输入后再合并服务端全文检索结果（支持繁简互搜、专辑/文件名匹配）
+  let searchTimer = null;
+  let searchSeq = 0;
+  const filterSongCards = (term, serverIds = null) => {
     document.querySelectorAll('.song-card').forEach(card => {
       const index = card.dataset.index;
       const song = state.displayPlaylist[index];
-      const match = song.title.toLowerCase().includes(term) || song.artist.toLowerCase().includes(term);
+      const match = song.title.toLowerCase().includes(term) || song.artist.toLowerCase().includes(term) || (serverIds?.has(song.id) ?? false);
       if (match) card.classList.remove('hidden'); else card.classList.add('hidden');
     });
+  };
+  ui.searchInput?.addEventListener('input', (e) => {
+    const term = e.target.value.toLowerCase().trim();
+    const seq = ++searchSeq;
+    clearTimeout(searchTimer);
+    filterSongCards(term);
+    if (!term) return;
+    searchTimer = setTimeout(async () => {
+      try {
+        const res = await api.library.search(term);
+        if (seq !== searchSeq || !res.success) return;
+        filterSongCards(term, new Set(res.data.map(s => s.id)));
+      } catch (err) {
+        // 离线或接口失败时保留本地过滤结果
+      }
+    }, 250);
   });
 
   if (ui.volumeSlider) {
@@ -2442,21 +2488,9 @@ export function bindUiControls() {
       // 简单判断是否是默认图
       if (fpCover.src.indexOf('ICON_256.PNG') !== -1) {
         if (ui.fullPlayerOverlay) ui.fullPlayerOverlay.style.background = 'rgba(0, 0, 0, 0.85)';
-      } else {
-        const color = extractColorFromImage(fpCover);
-        if (color) {
-          // 移动端防止背景太透导致看到下面的列表 (透视问题)
-          const isMobile = window.innerWidth <= 768;
-          const alpha = isMobile ? 0.98 : 0.8;
-          const rgbaStr = `rgba(${color.r}, ${color.g}, ${color.b}, ${alpha})`;
-
-          // 1. 设置全屏背景渐变
-          ui.fullPlayerOverlay.style.background = `linear-gradient(to bottom, ${rgbaStr} 0%, #000 120%)`;
-
-          // 2. 设置动态菜单背景色 (使用提取的 RGB + 0.7 透明度)
-          // 这样 Action Menu 就有了跟随封面的半透明背景
-          document.documentElement.style.setProperty('--dynamic-glass-color', `rgba(${color.r}, ${color.g}, ${color.b}, 0.7)`);
-        }
+      } else if (!fpCover.dataset.color) {
+        // 服务端没有提供调色板时才在本地解码取色
+        applyCoverColor(extractColorFromImage(fpCover));
       }
     };
 
@@ -1,5 +1,6 @@
 import { state } from './state.js';
 import { ui } from './ui.js';
+import { coverThumb } from './utils.js';
 
 // 打开播放队列窗口
 export function openQueueModal() {
@@ -46,7 +47,7 @@ export function openQueueModal() {
     queueItem.innerHTML = `
       <div class="queue-item-number">${index + 1}</div>
       <div class="queue-item-cover">
-        <img src="${song.cover}" loading="lazy">
+        <img src="${coverThumb(song.cover, 64)}" loading="lazy">
         ${index === state.currentTrackIndex ? '<div class="playing-indicator"><i class="fas fa-play"></i></div>' : ''}
       </div>
       <div class="queue-item-info">
@@ -132,7 +133,7 @@ function removeFromQueue(index, container, modal) {
     queueItem.innerHTML = `
       <div class="queue-item-number">${newIndex + 1}</div>
       <div class="queue-item-cover">
-        <img src="${song.cover}" loading="lazy">
+        <img src="${coverThumb(song.cover, 64)}" loading="lazy">
         ${newIndex === state.currentTrackIndex ? '<div class="playing-indicator"><i class="fas fa-play"></i></div>' : ''}
       </div>
       <div class="queue-item-info">
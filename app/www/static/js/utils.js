@@ -151,6 +151,12 @@ export function formatTime(s) {
   return `${min}:${sec.toString().padStart(2, '0')}`;
 }
 
+// 曲库封面按显示尺寸请求缩略图（服务端取 64/256/512 档），其他来源的图片原样返回
+export function coverThumb(url, size) {
+  if (!url || !url.startsWith('/api/music/covers/')) return url;
+  return `${url}${url.includes('?') ? '&' : '?'}size=${size}`;
+}
+
 export function renderNoLyrics(msg) {
   if (!ui.lyricsContainer) return;
   ui.lyricsContainer.innerHTML = `<p class="lyric-line active">${msg}</p>`;